@@ -0,0 +1,87 @@
+'''
+    Helpers shared by the benchmark scripts.
+
+    Importing the real `webapp` package starts every Dash app, and educationJourney downloads
+    a Google Sheet at import time. Benchmarks must run offline, so they register a bare `webapp`
+    package pointing at the source folder, and only the modules they need get imported.
+'''
+
+import os
+import sys
+import time
+import types
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_webapp_module(name):
+    if 'webapp' not in sys.modules:
+        from flask import Flask
+
+        package = types.ModuleType('webapp')
+        package.__path__ = [os.path.join(REPO_ROOT, 'webapp')]
+        package.application = Flask('webapp', root_path=package.__path__[0])
+        package.application.secret_key = 'benchmark'
+        sys.modules['webapp'] = package
+
+    __import__(f'webapp.{name}')
+    return sys.modules[f'webapp.{name}']
+
+
+def synthetic_inputs(assets, years, seed=0):
+    '''
+        Builds engine-ready arrays for a portfolio of `assets` random line items.
+    '''
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    weeks = years * 52
+
+    idealProportion = rng.uniform(1, 30, assets)
+    idealProportion /= idealProportion.sum()
+    strategy = rng.choice([1.0375, 1.075, 1.15], assets)
+    thresholdProportion = np.minimum(
+        (np.sin(idealProportion * 0.5 * np.pi) + (idealProportion * 0.7)) / (0.7 + 1),
+        idealProportion * strategy
+    )
+
+    weeklyGrowth = (1 + rng.uniform(0.02, 0.4, assets)) ** (1/52) - 1
+    growth = np.tile(weeklyGrowth, (weeks, 1)) * rng.normal(1, 3, (weeks, assets))
+
+    return 1000 * idealProportion, growth, idealProportion, thresholdProportion, 100*12/52
+
+
+def synthetic_investments(assets, seed=0):
+    '''
+        Investments list in the session format (what /add-investment stores), half of them with random growth.
+    '''
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    return [
+        {
+            'investment_id': f'ASSET {i}',
+            'ideal_proportion': float(rng.integers(1, 30)),
+            'investment_strategy': str(rng.choice(['Conservative', 'Medium', 'Risky'])),
+            'expected_growth': float(rng.uniform(2, 40)),
+            'random_growth': bool(i % 2),
+            'asset_volatility': str(rng.choice(['Low', 'Mid', 'High'])),
+            'growth_decay': bool(i % 2),
+            'volatility_duration': float(rng.integers(1, 5)),
+            'volatility_magnitude': float(rng.uniform(1, 1.5)),
+            'volatility_phase': float(rng.uniform(0, 1)),
+            'bullbear_duration': float(rng.integers(2, 10)),
+            'bullbear_magnitude': float(rng.uniform(1, 1.5)),
+            'bullbear_phase': float(rng.uniform(0, 1))
+        }
+        for i in range(assets)
+    ]
+
+
+def best_of(func, repeat=3):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
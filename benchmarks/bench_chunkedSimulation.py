@@ -0,0 +1,61 @@
+'''
+    Peak memory of daily simulations as the horizon grows.
+
+        full:     every array built for the whole horizon at once (prepare_portfolio + simulate_timeline
+                  with daily steps), float64 outputs. Only there for its memory: it rebalances every day
+        chunked:  portfolioEngine.simulate_chunked(), recording one step per year
+
+    Peak memory is measured with tracemalloc (numpy reports its allocations to it). The chunked
+    column should stay flat, whatever the horizon.
+
+        python benchmarks/bench_chunkedSimulation.py --assets 200 --years 5 20 60 100
+'''
+
+import argparse
+import time
+import tracemalloc
+
+from _common import load_webapp_module, synthetic_investments
+
+
+def measure(func):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak, seconds, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--assets', type=int, default=200)
+    parser.add_argument('--years', type=int, nargs='+', default=[5, 20, 60, 100])
+    parser.add_argument('--full-max-years', type=int, default=60, help="skips the full run above this horizon")
+    args = parser.parse_args()
+
+    portfolioEngine = load_webapp_module('portfolioEngine')
+    investments = synthetic_investments(args.assets)
+    stepsPerYear = portfolioEngine.STEPS_PER_YEAR['daily']
+
+    def full_run(years):
+        inputs = portfolioEngine.prepare_portfolio(investments, 1000, years * stepsPerYear, steps_per_year=stepsPerYear)
+        return portfolioEngine.simulate_timeline(inputs, 100 * 12 / stepsPerYear)[0]
+
+    print(f"{args.assets} assets, daily steps")
+    print(f"{'years':>6} {'full MB':>10} {'chunked MB':>12} {'chunked s':>10}")
+    for years in args.years:
+        if years <= args.full_max_years:
+            fullPeak, _, _ = measure(lambda: full_run(years))
+            full = f"{fullPeak / 2**20:>10.1f}"
+        else:
+            full = f"{'-':>10}"
+
+        chunkedPeak, chunkedSeconds, _ = measure(lambda: portfolioEngine.simulate_chunked(
+            investments, 1000, 100, years, time_step='daily', record_every=stepsPerYear))
+        print(f"{years:>6} {full} {chunkedPeak / 2**20:>12.1f} {chunkedSeconds:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
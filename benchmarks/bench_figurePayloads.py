@@ -0,0 +1,79 @@
+'''
+    Payload size and serialization time of the chart figures, before/after typed arrays.
+
+        before: plain JSON float lists, encoded with the standard json module
+        after:  base64 typed arrays (figurePayloads.encode_figure), encoded with orjson
+
+    Figures are built once, only encoding and serialization are timed. Covers the Portfolio Projection
+    line charts (10, 100 and 1,000 assets over 40 years by default) and the Compound Interest chart.
+
+        python benchmarks/bench_figurePayloads.py
+'''
+
+import argparse
+
+import numpy as np
+import plotly.graph_objects as go
+
+from _common import best_of, load_webapp_module, synthetic_inputs
+
+
+def measure(figurePayloads, figures, repeat):
+    '''
+        Serializes already built figures both ways, returns {mode: (bytes, seconds)}.
+    '''
+    from plotly.io.json import to_json_plotly
+
+    results = {}
+    for mode, typed, engine in (('before', False, 'json'), ('after', True, 'orjson')):
+        figurePayloads.TYPED_ARRAYS = typed
+
+        def serialize():
+            return to_json_plotly([figurePayloads.encode_figure(figure) for figure in figures], engine=engine)
+
+        seconds, payload = best_of(serialize, repeat)
+        results[mode] = (len(payload), seconds)
+
+    figurePayloads.TYPED_ARRAYS = True
+    return results
+
+
+def report(label, results):
+    (beforeBytes, beforeSeconds), (afterBytes, afterSeconds) = results['before'], results['after']
+    print(f"{label:>24} {beforeBytes:>12,} {afterBytes:>12,} {beforeBytes / afterBytes:>6.1f}x "
+          f"{beforeSeconds * 1000:>10.1f} {afterSeconds * 1000:>10.1f} {beforeSeconds / afterSeconds:>6.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--assets', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--years', type=int, default=40)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    portfolioEngine = load_webapp_module('portfolioEngine')
+    portfolioProjection = load_webapp_module('portfolioProjection')
+    compoundInterest = load_webapp_module('compoundInterest')
+    figurePayloads = load_webapp_module('figurePayloads')
+
+    print(f"{'':>24} {'bytes before':>12} {'bytes after':>12} {'':>7} {'ms before':>10} {'ms after':>10}")
+
+    for assets in args.assets:
+        timeline = portfolioEngine.run_rebalancing(*synthetic_inputs(assets, args.years))
+        investment_ids = np.array([f'ASSET {i}' for i in range(assets)])
+
+        figures = [portfolioProjection.line_chart_by_type(investment_ids, timeline),
+                   portfolioProjection.line_chart_total(timeline)]
+
+        report(f'{assets} assets, {args.years} years', measure(figurePayloads, figures, args.repeat))
+
+    # Same 4 traces as update_values, at the slider maximum
+    traces = [
+        compoundInterest.generate_scatter_trace(compoundInterest.compound_interest_over_time(0, 500, rate, 50, 3, 6), str(rate), 'Final Balance')
+        for rate in (15, 2, 12.39, 9.75)
+    ]
+    report('compound interest, 50y', measure(figurePayloads, [go.Figure(data=traces)], args.repeat))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+'''
+    Portfolio Projection with thousands of line items, step by step through what a Calculate click does.
+
+        session:    the session's stored portfolio into a SimulationContext (its first use: cache key and engine-ready copy)
+        prepare:    prepare_portfolio, every per-asset input array
+        simulate:   growth (market cycles and random streams) and the rebalancing loop
+        taxes:      the tax-lot ledger of that run (FIFO lots, yearly brackets), at most 2x simulate
+        charts:     display_portfolio, top MAX_CHART_SERIES assets plus "Other" above that
+        serialize:  the callback's JSON response
+        summary:    the same run summarized without any timeline (/simulate with timeline=false)
+
+    Time per asset should stay flat as the asset count grows. The total of the largest portfolio
+    (5,000 assets over 40 years by default) is checked against --target seconds.
+
+        python benchmarks/bench_largePortfolio.py --assets 100 1000 5000 --years 40
+'''
+
+import argparse
+
+from _common import best_of, load_webapp_module, synthetic_investments
+
+STEPS = ('session', 'prepare', 'simulate', 'taxes', 'charts', 'serialize', 'summary')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--assets', type=int, nargs='+', default=[100, 1000, 5000])
+    parser.add_argument('--years', type=int, default=40)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--target', type=float, default=5, help='seconds allowed for the largest portfolio, every step included')
+    args = parser.parse_args()
+
+    portfolioProjection = load_webapp_module('portfolioProjection')
+    simulationBatch = load_webapp_module('simulationBatch')
+    simulationCache = load_webapp_module('simulationCache')
+    simulationContext = load_webapp_module('simulationContext')
+    taxLedger = load_webapp_module('taxLedger')
+    sessionStore = load_webapp_module('sessionStore')
+    figurePayloads = load_webapp_module('figurePayloads')
+    application = portfolioProjection.application
+
+    # Nothing cached: every run simulates from scratch
+    portfolioProjection.simulation_cache = simulationCache.SimulationCache(maxsize=0)
+    settings = simulationContext.PortfolioSettings(start_amount=1000, monthly_amount=100, investment_time=args.years)
+
+    # JIT compilation and first-call imports out of the way
+    portfolioProjection.simulate_timeline(simulationContext.SimulationContext(tuple(synthetic_investments(3)), settings))
+
+    print(f"{'assets':>7} " + ' '.join(f"{step + ' s':>11}" for step in STEPS) + f" {'total s':>9} {'us/asset':>9} {'charts KB':>10}")
+    for assets in args.assets:
+        investments = synthetic_investments(assets)
+        timings = {}
+
+        with application.test_request_context():
+            def first_use():
+                # Every change of the portfolio is followed by one of these, later clicks reuse what it computed
+                sessionStore.session_store.set_investments(sessionStore.current_id(), investments)
+                return simulationContext.from_session(settings)
+            timings['session'], context = best_of(first_use, args.repeat)
+
+        timings['prepare'], inputs = best_of(lambda: portfolioProjection.get_portfolio_inputs(context), args.repeat)
+        timings['simulate'], (investmentIds, timeline) = best_of(lambda: portfolioProjection.simulate_timeline(context), args.repeat)
+        timings['taxes'], _ = best_of(lambda: taxLedger.tax_ledger(inputs.start_amount, timeline, portfolioProjection.TAX_RULES),
+                                      args.repeat)
+        timings['charts'], charts = best_of(lambda: portfolioProjection.display_portfolio(settings, investmentIds, timeline, None, 'weekly'),
+                                            args.repeat)
+        timings['serialize'], payload = best_of(lambda: figurePayloads.to_json(charts), args.repeat)
+        timings['summary'], _ = best_of(lambda: simulationBatch.run_batch([(investments, settings)], timeline=False), args.repeat)
+
+        # simulate_timeline prepares the portfolio itself, the summary is another way to get a result
+        total = timings['session'] + timings['simulate'] + timings['taxes'] + timings['charts'] + timings['serialize']
+        print(f"{assets:>7} " + ' '.join(f"{timings[step]:>11.3f}" for step in STEPS)
+              + f" {total:>9.2f} {total / assets * 1e6:>9.0f} {len(payload) / 1024:>10.0f}")
+
+    if timings['taxes'] > 2 * timings['simulate']:
+        raise SystemExit(f"The tax ledger took {timings['taxes']:.2f}s, over twice the {timings['simulate']:.2f}s of the simulation")
+    if total > args.target:
+        raise SystemExit(f"{assets:,} assets over {args.years} years took {total:.2f}s, over the {args.target:g}s target")
+    print(f"{assets:,} assets over {args.years} years: {total:.2f}s (target {args.target:g}s, "
+          f"{portfolioProjection.MAX_CHART_SERIES} chart series at most)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+'''
+    Throughput benchmark for the rebalancing kernel of portfolioEngine.
+
+    Runs every available backend over a few portfolio sizes, checks that they all agree
+    with the numpy backend and prints asset-weeks per second.
+
+        python benchmarks/bench_portfolioEngine.py
+'''
+
+import argparse
+
+import numpy as np
+
+from _common import best_of, load_webapp_module, synthetic_inputs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--assets', type=int, nargs='+', default=[10, 100, 300])
+    parser.add_argument('--years', type=int, default=40)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    portfolioEngine = load_webapp_module('portfolioEngine')
+
+    print(f"{'assets':>7} {'backend':>8} {'seconds':>10} {'asset-weeks/s':>15}")
+    for assets in args.assets:
+        inputs = synthetic_inputs(assets, args.years)
+        reference = None
+
+        for backend in portfolioEngine.BACKENDS:
+            portfolioEngine.run_rebalancing(*inputs, backend=backend) # warm-up (JIT compilation)
+            seconds, result = best_of(lambda: portfolioEngine.run_rebalancing(*inputs, backend=backend), args.repeat)
+
+            if reference is None:
+                reference = result
+            else:
+                for field, expected, actual in zip(result._fields, reference, result):
+                    if not np.allclose(actual, expected, rtol=1e-7, atol=1e-9):
+                        raise SystemExit(f"backend '{backend}' diverges from numpy on {field} ({assets} assets)")
+
+            print(f"{assets:>7} {backend:>8} {seconds:>10.4f} {assets * args.years * 52 / seconds:>15,.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+'''
+    Cost of each rebalancing policy as the horizon grows, with deterministic growth.
+
+    'weekly' does the full rebalancing work every week. The other policies compound in closed
+    form between events, so their time should follow the number of events rather than the weeks.
+
+        python benchmarks/bench_rebalancingPolicies.py --assets 10 --years 10 40 160 640
+'''
+
+import argparse
+
+import numpy as np
+
+from _common import best_of, load_webapp_module, synthetic_inputs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--assets', type=int, default=10)
+    parser.add_argument('--years', type=int, nargs='+', default=[10, 40, 160, 640])
+    parser.add_argument('--backend', default='numpy')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    portfolioEngine = load_webapp_module('portfolioEngine')
+
+    print(f"{'years':>6} {'policy':>10} {'events':>8} {'ms':>10} {'us/event':>10}")
+    for years in args.years:
+        startAmount, growth, idealProportion, thresholdProportion, weeklyContribution = synthetic_inputs(args.assets, years)
+        growth = np.tile(growth.mean(axis=0), (len(growth), 1)) # deterministic: same growth every week
+        lastWeek = [len(growth) - 1]
+
+        for policy in portfolioEngine.REBALANCING_POLICIES:
+            def run():
+                return portfolioEngine.run_rebalancing(startAmount, growth, idealProportion, thresholdProportion, weeklyContribution,
+                                                       backend=args.backend, policy=policy, record_weeks=lastWeek)
+            run()
+            seconds, _ = best_of(run, args.repeat)
+
+            if policy == 'threshold':
+                # weeks where something was sold
+                timeline = portfolioEngine.run_rebalancing(startAmount, growth, idealProportion, thresholdProportion,
+                                                           weeklyContribution, policy=policy)
+                events = int((np.diff(timeline.total_sold.sum(axis=-1), prepend=0) > 0).sum())
+            else:
+                events = int(portfolioEngine.rebalancing_events(len(growth), policy).sum())
+
+            print(f"{years:>6} {policy:>10} {events:>8} {seconds * 1000:>10.2f} {seconds * 1e6 / max(events, 1):>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
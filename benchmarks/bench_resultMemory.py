@@ -0,0 +1,121 @@
+'''
+    Peak memory of turning one simulation into what the Portfolio Projection page shows
+    (final worth, per-asset totals for the pie chart and the sold/bought table).
+
+        tuples:     the original code, one Python tuple per asset per week, then a DataFrame + groupbys
+        long:       vectorized long-format DataFrame (float64, investment_id string per row) + groupbys
+        compact:    simulationResult.PortfolioTimeline views
+        compact32:  same, stored as float32
+
+    Every variant runs in its own process, on top of an already simulated timeline. Peak RSS
+    comes from /proc (VmHWM, reset before the variant runs), so it includes pandas' own memory;
+    tracemalloc's peak is printed next to it.
+
+        python benchmarks/bench_resultMemory.py --assets 100 1000 --years 40
+'''
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tracemalloc
+
+from _common import load_webapp_module, synthetic_inputs
+
+VARIANTS = ('tuples', 'long', 'compact', 'compact32')
+
+
+def proc_status(field):
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5') # resets VmHWM to the current RSS
+    except OSError:
+        pass
+
+
+def run_variant(variant, assets, years):
+    import gc
+    import numpy as np
+    import pandas as pd
+
+    portfolioEngine = load_webapp_module('portfolioEngine')
+    simulationResult = load_webapp_module('simulationResult')
+
+    startAmount, growth, idealProportion, thresholdProportion, weeklyContribution = synthetic_inputs(assets, years)
+    timeline = portfolioEngine.run_rebalancing(startAmount, growth, idealProportion, thresholdProportion, weeklyContribution)
+    investment_ids = np.array([f'ASSET {i}' for i in range(assets)])
+    del growth
+    gc.collect()
+
+    reset_peak_rss()
+    baseline = proc_status('VmRSS')
+    tracemalloc.start()
+
+    if variant == 'tuples':
+        weeks = timeline.current_amount.shape[0]
+        rows = [
+            (investment_ids[i], timeline.current_amount[week, i], week + 1, timeline.total_sold[week, i],
+             timeline.total_bought[week, i], timeline.actual_proportion[week, i])
+            for week in range(weeks) for i in range(assets)
+        ]
+        frame = pd.DataFrame(rows, columns=['investment_id', 'Current Amount ($)', 'Week', 'Total Sold', 'Total Bought', 'Actual Proportion (%)'])
+        del rows
+    if variant in ('tuples', 'long'):
+        if variant == 'long':
+            frame = simulationResult.PortfolioTimeline.from_engine(investment_ids, timeline).to_frame()
+            frame['investment_id'] = frame['investment_id'].astype(object)
+        worth = frame[frame['Week'] == frame['Week'].max()]['Current Amount ($)'].sum()
+        frame['Current Year'] = frame['Week'] // 52
+        pie = frame.groupby('investment_id').sum()['Actual Proportion (%)'].reset_index()
+        table = frame[['investment_id', 'Total Sold', 'Total Bought']].groupby('investment_id', as_index=False).sum().round(2)
+        kept = frame
+    else:
+        result = simulationResult.PortfolioTimeline.from_engine(investment_ids, timeline,
+                                                                dtype=np.float32 if variant == 'compact32' else None)
+        worth = result.final_worth()
+        pie = result.per_asset_sum('actual_proportion')
+        table = pd.DataFrame({'Total Sold': result.per_asset_sum('total_sold'), 'Total Bought': result.per_asset_sum('total_bought')}).round(2)
+        kept = result
+
+    _, tracedPeak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'rss': proc_status('VmHWM') - baseline, 'traced': tracedPeak, 'worth': float(worth)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--assets', type=int, nargs='+', default=[100, 1000])
+    parser.add_argument('--years', type=int, default=40)
+    parser.add_argument('--variant', choices=VARIANTS, help=argparse.SUPPRESS) # child process
+    args = parser.parse_args()
+
+    if args.variant:
+        print(json.dumps(run_variant(args.variant, args.assets[0], args.years)))
+        return
+
+    print(f"{'assets':>7} {'variant':>10} {'peak RSS MB':>12} {'traced MB':>10} {'x compact':>10}")
+    for assets in args.assets:
+        results = {}
+        for variant in VARIANTS:
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--variant', variant, '--assets', str(assets), '--years', str(args.years)],
+                check=True, capture_output=True, text=True
+            ).stdout
+            results[variant] = json.loads(output.strip().splitlines()[-1])
+
+        for variant, result in results.items():
+            ratio = result['rss'] / max(results['compact']['rss'], 1)
+            print(f"{assets:>7} {variant:>10} {result['rss'] / 2**20:>12.1f} {result['traced'] / 2**20:>10.1f} {ratio:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+'''
+    Headless batch runs (/simulate): one batched engine pass per portfolio vs one run at a time,
+    and the size / encoding time of each result format.
+
+        python benchmarks/bench_simulationBatch.py --runs 10 100 500 --assets 6 --years 40
+'''
+
+import argparse
+import time
+
+from _common import load_webapp_module, synthetic_investments
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, nargs='+', default=[10, 100, 500])
+    parser.add_argument('--assets', type=int, default=6)
+    parser.add_argument('--years', type=int, default=40)
+    args = parser.parse_args()
+
+    simulationBatch = load_webapp_module('simulationBatch')
+    simulationContext = load_webapp_module('simulationContext')
+
+    investments = synthetic_investments(args.assets)
+    simulationBatch.run_batch([(investments, simulationContext.PortfolioSettings(investment_time=1))]) # JIT warm-up
+
+    print(f"{'runs':>6} {'batched s':>10} {'one by one s':>13} {'speedup':>8}   encoded MB (s)")
+    for count in args.runs:
+        runs = [
+            (investments, simulationContext.PortfolioSettings(start_amount=100 * i, monthly_amount=i, investment_time=args.years))
+            for i in range(count)
+        ]
+
+        start = time.perf_counter()
+        results = simulationBatch.run_batch(runs)
+        batchedSeconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for run in runs:
+            simulationBatch.run_batch([run])
+        singleSeconds = time.perf_counter() - start
+
+        encoded = []
+        for name, encoder in simulationBatch.ENCODERS.items():
+            if name == 'arrow' and simulationBatch.pyarrow is None:
+                continue
+            start = time.perf_counter()
+            size = len(encoder(results))
+            encoded.append(f"{name} {size / 2**20:.1f} ({time.perf_counter() - start:.2f})")
+
+        print(f"{count:>6} {batchedSeconds:>10.3f} {singleSeconds:>13.3f} {singleSeconds / batchedSeconds:>7.1f}x   {', '.join(encoded)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+'''
+    Regression suite for the two calculation engines, against a stored baseline.
+
+        calc_portfolio:               asset counts x horizons (up to MAX_INVESTMENT_TIME) x random growth on/off
+        compound_interest_over_time:  the Investment Time slider range
+
+    Every case records:
+        seconds:  best wall time of at least --repeat runs (more for quick cases), nothing cached
+        peak_mb:  peak traced memory of one more run (tracemalloc, numpy allocations included)
+        payload:  bytes the callback sends to the browser for it (the serialized charts)
+
+    Results are compared to benchmarks/baseline.json; any case slower, hungrier or with a bigger
+    payload than the baseline by more than --threshold (a fraction) fails the run (exit code 1).
+    Timings depend on the machine: record the baseline where it will be compared.
+
+        python benchmarks/bench_suite.py                   # compare with the baseline
+        python benchmarks/bench_suite.py --save-baseline   # (re)write it
+        python benchmarks/bench_suite.py --quick --threshold 0.5
+
+    Runs offline: only the engine modules are imported (see _common), no browser involved.
+'''
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+from _common import load_webapp_module, synthetic_investments
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+ASSET_COUNTS = [1, 10, 100, 1000]
+HORIZONS = [1, 10, 40, None] # None: MAX_INVESTMENT_TIME
+COMPOUND_YEARS = [1, 5, 10, 20, 30, 40, 50] # the slider goes from 1 to 50
+
+QUICK_ASSET_COUNTS = [1, 10, 100]
+QUICK_HORIZONS = [1, 40]
+
+METRICS = ('seconds', 'peak_mb', 'payload')
+TIME_FLOOR = 0.02 # seconds; timings are compared as if never shorter than this, the short cases are mostly noise
+MEMORY_FLOOR = 1 # MB, same idea for the peak memory
+MIN_SAMPLING = 0.5 # seconds; quick cases are repeated (past --repeat) until their runs add up to this
+MAX_REPEAT = 200
+
+
+def measure(func, repeat):
+    '''
+        (best seconds, peak traced MB, result). Memory is traced on its own run, tracing slows allocations down.
+    '''
+
+    timings = []
+    while len(timings) < repeat or (sum(timings) < MIN_SAMPLING and len(timings) < MAX_REPEAT):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    seconds = min(timings)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak / 2**20, result
+
+
+# ---------------------------------------- cases
+
+def portfolio_cases(asset_counts, horizons, repeat):
+    '''
+        (case name, function measuring it) pairs, like compound_cases.
+    '''
+
+    portfolioProjection = load_webapp_module('portfolioProjection')
+    simulationCache = load_webapp_module('simulationCache')
+    simulationContext = load_webapp_module('simulationContext')
+    figurePayloads = load_webapp_module('figurePayloads')
+
+    # Nothing cached: every run simulates from scratch
+    portfolioProjection.simulation_cache = simulationCache.SimulationCache(maxsize=0)
+
+    for assets in asset_counts:
+        for horizon in horizons:
+            years = horizon or portfolioProjection.MAX_INVESTMENT_TIME
+            for randomGrowth in (False, True):
+                def run(assets=assets, years=years, randomGrowth=randomGrowth):
+                    investments = [dict(investment, random_growth=randomGrowth) for investment in synthetic_investments(assets)]
+                    settings = simulationContext.PortfolioSettings(start_amount=1000, monthly_amount=100, investment_time=years)
+                    context = simulationContext.SimulationContext(tuple(investments), settings)
+
+                    portfolioProjection.calc_portfolio(context) # warm-up (JIT compilation, first-call imports)
+                    seconds, peak, result = measure(lambda: portfolioProjection.calc_portfolio(context), repeat)
+
+                    # What the Calculate click sends back, built from the same simulation
+                    charts = portfolioProjection.display_portfolio(settings, result.assets.astype(str).to_numpy(),
+                                                                   portfolioProjection.simulate_timeline(context)[1], None, 'weekly')
+                    return {'seconds': seconds, 'peak_mb': peak, 'payload': len(figurePayloads.to_json(charts))}
+
+                yield f"calc_portfolio/assets={assets}/years={years}/random={'on' if randomGrowth else 'off'}", run
+
+
+def compound_cases(years_range, repeat):
+    compoundInterest = load_webapp_module('compoundInterest')
+    figurePayloads = load_webapp_module('figurePayloads')
+
+    # The calculator's default inputs, over the slider range
+    defaults = {'yieldRate': 15, 'initialContribution': 0, 'monthlyContributions': 500,
+                'yearlyGainOnContributions': 3, 'expectedInflation': 6}
+
+    for years in years_range:
+        def run(years=years):
+            seconds, peak, _ = measure(lambda: compoundInterest.compound_interest_over_time(
+                defaults['initialContribution'], defaults['monthlyContributions'], defaults['yieldRate'], years,
+                defaults['yearlyGainOnContributions'], defaults['expectedInflation']
+            ), repeat)
+
+            response = compoundInterest.update_values(years, defaults['yieldRate'], defaults['initialContribution'],
+                                                      defaults['monthlyContributions'], defaults['yearlyGainOnContributions'],
+                                                      defaults['expectedInflation'])
+            return {'seconds': seconds, 'peak_mb': peak, 'payload': len(figurePayloads.to_json(list(response)))}
+
+        yield f"compound_interest_over_time/years={years}", run
+
+
+# ---------------------------------------- baseline
+
+def environment():
+    import numpy as np
+    try:
+        import numba
+        numbaVersion = numba.__version__
+    except ImportError:
+        numbaVersion = None
+    return {'machine': platform.machine(), 'processor': platform.processor(), 'python': platform.python_version(),
+            'numpy': np.__version__, 'numba': numbaVersion}
+
+
+def regressions(results, baseline, threshold):
+    '''
+        [(case, metric, baseline value, current value)] of everything past the threshold.
+    '''
+
+    found = []
+    for name, current in results.items():
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        for metric in METRICS:
+            if metric not in expected:
+                continue
+            reference, value = expected[metric], current[metric]
+            floor = {'seconds': TIME_FLOOR, 'peak_mb': MEMORY_FLOOR}.get(metric, 0)
+            reference, value = max(reference, floor), max(value, floor)
+            if value > reference * (1 + threshold):
+                found.append((name, metric, expected[metric], current[metric]))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true', help='write the results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed regression, as a fraction of the baseline')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--quick', action='store_true', help='smaller matrix, for a quick check')
+    parser.add_argument('--filter', default='', help='only run cases whose name contains this')
+    args = parser.parse_args()
+
+    asset_counts, horizons = (QUICK_ASSET_COUNTS, QUICK_HORIZONS) if args.quick else (ASSET_COUNTS, HORIZONS)
+    cases = [
+        lambda: portfolio_cases(asset_counts, horizons, args.repeat),
+        lambda: compound_cases(COMPOUND_YEARS, args.repeat)
+    ]
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            stored = json.load(f)
+        baseline = stored.get('results', {})
+        if not args.save_baseline and stored.get('environment') != environment():
+            print(f"note: the baseline was recorded on {stored.get('environment')}, timings may not compare", file=sys.stderr)
+
+    results = {}
+    print(f"{'case':<58} {'seconds':>9} {'peak MB':>9} {'payload KB':>11} {'vs baseline (s)':>16}")
+    start = time.perf_counter()
+    for generate in cases:
+        for name, run in generate():
+            if args.filter not in name:
+                continue
+            results[name] = result = run()
+            expected = baseline.get(name)
+            change = f"{result['seconds'] / max(expected['seconds'], 1e-9):>15.2f}x" if expected else f"{'new':>16}"
+            print(f"{name:<58} {result['seconds']:>9.4f} {result['peak_mb']:>9.1f} {result['payload'] / 1024:>11.1f} {change}")
+    print(f"{len(results)} cases in {time.perf_counter() - start:.1f}s")
+
+    if args.save_baseline:
+        # Cases that weren't run this time keep their previous baseline
+        with open(args.baseline, 'w') as f:
+            json.dump({'environment': environment(), 'results': {**baseline, **results}}, f, indent=1, sort_keys=True)
+        print(f"baseline written to {args.baseline}")
+        return
+
+    if not baseline:
+        print("no baseline to compare with, run with --save-baseline first")
+        return
+
+    found = regressions(results, baseline, args.threshold)
+    for name, metric, expected, value in found:
+        print(f"REGRESSION {name}: {metric} {expected:,.4g} -> {value:,.4g}")
+    if found:
+        raise SystemExit(1)
+    print(f"no regression past {args.threshold:.0%} of the baseline")
+
+
+if __name__ == '__main__':
+    main()
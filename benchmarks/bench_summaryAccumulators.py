@@ -0,0 +1,64 @@
+'''
+    Summary statistics accumulated by the engine while it loops, vs keeping the whole timeline.
+
+    Every batch slot is a scenario of the same portfolio (like a sweep, or a /simulate batch):
+        timeline:  the four (weeks, batch, assets) outputs, what callers used to summarize
+        summary:   run_rebalancing(summary=True, record_weeks=[]), nothing the size of the timeline
+
+        python benchmarks/bench_summaryAccumulators.py --batch 1 100 1000 --assets 6 --years 40
+'''
+
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+from _common import load_webapp_module, synthetic_inputs
+
+
+def measure(run):
+    tracemalloc.start()
+    start = time.perf_counter()
+    run()
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch', type=int, nargs='+', default=[1, 100, 1000])
+    parser.add_argument('--assets', type=int, default=6)
+    parser.add_argument('--years', type=int, default=40)
+    parser.add_argument('--backend', default='auto')
+    args = parser.parse_args()
+
+    portfolioEngine = load_webapp_module('portfolioEngine')
+    startAmount, growth, idealProportion, thresholdProportion, weeklyContribution = synthetic_inputs(args.assets, args.years)
+
+    print(f"{'batch':>6} {'timeline s':>11} {'MB':>8} {'summary s':>10} {'MB':>8}")
+    for batch in args.batch:
+        startAmounts = startAmount * np.linspace(0.5, 2, batch)[:, np.newaxis]
+        contributions = np.linspace(0, 2 * weeklyContribution, batch)
+
+        def with_timeline():
+            timeline = portfolioEngine.run_rebalancing(startAmounts, growth, idealProportion, thresholdProportion, contributions,
+                                                       backend=args.backend)
+            return timeline.current_amount[-1].sum(axis=-1)
+
+        def summary_only():
+            _, summary = portfolioEngine.run_rebalancing(startAmounts, growth, idealProportion, thresholdProportion, contributions,
+                                                         backend=args.backend, summary=True, record_weeks=np.empty(0, dtype=int))
+            return summary.final_worth
+
+        if not np.allclose(with_timeline(), summary_only(), rtol=1e-12): # also warms the JIT up
+            raise SystemExit("summary final worth differs from the timeline's")
+        timelineSeconds, timelinePeak = measure(with_timeline)
+        summarySeconds, summaryPeak = measure(summary_only)
+        print(f"{batch:>6} {timelineSeconds:>11.3f} {timelinePeak / 2**20:>8.1f} {summarySeconds:>10.3f} {summaryPeak / 2**20:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+'''
+    What-if grid (portfolioEngine.simulate_sweep) against a single projection.
+
+    Each pair of swept settings runs as a 20x20 grid (20x4 with strategies), the others staying
+    at the single run's values. The ratio column is the grid's time over one run's: one batched
+    pass should stay well under the number of cells.
+
+        python benchmarks/bench_sweep.py --assets 6 --years 40
+'''
+
+import argparse
+import itertools
+
+import numpy as np
+
+from _common import best_of, load_webapp_module, synthetic_investments
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--assets', type=int, default=6)
+    parser.add_argument('--years', type=int, default=40)
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--backend', default=None)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    portfolioEngine = load_webapp_module('portfolioEngine')
+    investments = synthetic_investments(args.assets)
+
+    def single_run():
+        inputs = portfolioEngine.prepare_portfolio(investments, 1000, args.years * 52)
+        return portfolioEngine.simulate_timeline(inputs, 100*12/52, backend=args.backend)
+
+    single_run() # compiles the numba kernels, when that backend is used
+    singleSeconds, _ = best_of(single_run, args.repeat)
+    print(f"{args.assets} assets, {args.years} years: one run {singleSeconds * 1000:.1f} ms\n")
+
+    grid = {
+        'start_amount': np.linspace(0, 10000, args.steps),
+        'monthly_amount': np.linspace(0, 1000, args.steps),
+        'horizons': np.unique(np.linspace(1, args.years, args.steps).round().astype(int)),
+        'strategies': [None, 'Conservative', 'Medium', 'Risky']
+    }
+    single = {'start_amount': [1000], 'monthly_amount': [100], 'horizons': [args.years], 'strategies': [None]}
+
+    print(f"{'swept':<32}{'cells':>8}{'ms':>10}{'x one run':>11}")
+    for x_axis, y_axis in itertools.combinations(grid, 2):
+        values = {**single, x_axis: grid[x_axis], y_axis: grid[y_axis]}
+        seconds, sweep = best_of(lambda: portfolioEngine.simulate_sweep(
+            investments, values['start_amount'], values['monthly_amount'], values['horizons'], values['strategies'],
+            backend=args.backend
+        ), args.repeat)
+        print(f"{x_axis + ' x ' + y_axis:<32}{sweep.final_worth.size:>8}{seconds * 1000:>10.1f}{seconds / singleSeconds:>11.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+'''
+    Concurrency check for the Portfolio Projection callback.
+
+    Every request gets its own session (portfolio) and its own settings. They are first answered
+    one at a time, with no cache, to get the expected responses; then all of them are fired
+    again from a thread pool against a fresh cache. Each concurrent response has to match its
+    sequential one: any leak of state between requests shows up as a mismatch.
+
+        python benchmarks/stress_concurrentCallbacks.py --requests 64 --threads 16
+'''
+
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from _common import load_webapp_module, synthetic_investments
+
+
+def callback_body(settings):
+    state = [
+        ('investment-start-amount', settings['start_amount']),
+        ('investment-monthly-amount', settings['monthly_amount']),
+        ('investment-time-slider', settings['investment_time']),
+        ('montecarlo-paths', settings['montecarlo_paths']),
+        ('legacy-random-check', ['legacy'] if settings['legacy_random'] else []),
+        ('rebalancing-policy', settings['rebalancing_policy']),
+        ('time-step', settings['time_step']),
+        ('chart-resolution', 'weekly')
+    ]
+    return {
+        'output': '..charts-div.children...simulation-job.data...simulation-poll.disabled..',
+        'outputs': [
+            {'id': 'charts-div', 'property': 'children'},
+            {'id': 'simulation-job', 'property': 'data'},
+            {'id': 'simulation-poll', 'property': 'disabled'}
+        ],
+        'inputs': [
+            {'id': 'calculate-button', 'property': 'n_clicks', 'value': 1},
+            {'id': 'simulation-poll', 'property': 'n_intervals', 'value': None},
+            {'id': 'value-view', 'property': 'value', 'value': 'nominal'}
+        ],
+        'changedPropIds': ['calculate-button.n_clicks'],
+        'state': [{'id': component, 'property': 'value', 'value': value} for component, value in state]
+                 + [{'id': 'simulation-job', 'property': 'data', 'value': None},
+                    {'id': 'inflation-mode', 'property': 'value', 'value': 'constant'},
+                    {'id': 'inflation-value', 'property': 'value', 'value': '4'},
+                    {'id': 'inflation-upload', 'property': 'contents', 'value': None}]
+    }
+
+
+def make_requests(count, assets):
+    requests = []
+    for i in range(count):
+        settings = {
+            'start_amount': 1000 + 250 * i,
+            'monthly_amount': 50 + 10 * (i % 7),
+            'investment_time': 1 + i % 40,
+            'montecarlo_paths': 100 if i % 8 == 0 else 0,
+            'legacy_random': i % 5 == 0,
+            'rebalancing_policy': ('weekly', 'monthly', 'quarterly', 'threshold')[i % 4],
+            'time_step': 'daily' if i % 6 == 0 else 'weekly'
+        }
+        requests.append((synthetic_investments(assets + i % 4, seed=i), settings))
+    return requests
+
+
+def post(application, investments, settings):
+    sessionStore = load_webapp_module('sessionStore')
+
+    client = application.test_client()
+    with client.session_transaction() as session:
+        sessionStore.session_store.set_investments(sessionStore.current_id(session), investments)
+
+    response = client.post('/dash/portfolioProjection/_dash-update-component', json=callback_body(settings))
+    if response.status_code != 200:
+        raise SystemExit(f"callback failed with {response.status_code}: {response.data[:500]}")
+    return json.loads(response.data)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=64)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--assets', type=int, default=6)
+    args = parser.parse_args()
+
+    portfolioProjection = load_webapp_module('portfolioProjection')
+    simulationCache = load_webapp_module('simulationCache')
+    application = portfolioProjection.application
+
+    requests = make_requests(args.requests, args.assets)
+
+    # Expected answers, one request at a time and nothing cached
+    portfolioProjection.simulation_cache = simulationCache.SimulationCache(maxsize=0)
+    start = time.perf_counter()
+    expected = [post(application, investments, settings) for investments, settings in requests]
+    sequentialSeconds = time.perf_counter() - start
+
+    portfolioProjection.simulation_cache = simulationCache.SimulationCache()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.threads) as pool:
+        responses = list(pool.map(lambda request: post(application, *request), requests))
+    concurrentSeconds = time.perf_counter() - start
+
+    mismatches = [i for i, (response, reference) in enumerate(zip(responses, expected)) if response != reference]
+
+    print(f"{args.requests} requests: {sequentialSeconds:.2f}s sequential, {concurrentSeconds:.2f}s on {args.threads} threads")
+    if mismatches:
+        raise SystemExit(f"{len(mismatches)} responses differ from their sequential run: requests {mismatches}")
+    print("every concurrent response matches its own sequential run")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+'''
+    Shared setup of the test suite.
+
+    Importing the real `webapp` package starts every Dash app, and educationJourney downloads
+    a Google Sheet at import time. Tests must run offline, so (like the benchmarks) they register
+    a bare `webapp` package pointing at the source folder, and import only the modules they test.
+'''
+
+import copy
+import os
+import sys
+import types
+
+import pytest
+from flask import Flask
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Tests reuse the request builders of the benchmark scripts
+sys.path.insert(0, os.path.join(REPO_ROOT, 'benchmarks'))
+
+if 'webapp' not in sys.modules:
+    package = types.ModuleType('webapp')
+    package.__path__ = [os.path.join(REPO_ROOT, 'webapp')]
+    package.application = Flask('webapp', root_path=package.__path__[0])
+    package.application.secret_key = 'tests'
+    # Nothing shared on disk between test runs: in-process caches, sessions and simulations only
+    package.application.config.update(SIMULATION_CACHE_DIR=None, SIMULATION_JOBS_DIR=None, SESSION_DB_PATH=None,
+                                      TAX_BRACKETS=None)
+    sys.modules['webapp'] = package
+
+
+PORTFOLIO = [
+    {'investment_id': 'Debenture A', 'ideal_proportion': 25, 'investment_strategy': 'Medium', 'expected_growth': 9,
+     'random_growth': False, 'asset_volatility': 'Low', 'growth_decay': False, 'volatility_duration': 3,
+     'volatility_magnitude': 1, 'volatility_phase': 0, 'bullbear_duration': 4, 'bullbear_magnitude': 1, 'bullbear_phase': 0},
+    {'investment_id': 'Bitcoin', 'ideal_proportion': 5, 'investment_strategy': 'Conservative', 'expected_growth': 30,
+     'random_growth': True, 'asset_volatility': 'High', 'growth_decay': True, 'volatility_duration': 2,
+     'volatility_magnitude': 1.2, 'volatility_phase': 0.3, 'bullbear_duration': 4, 'bullbear_magnitude': 1.15, 'bullbear_phase': 0.8},
+    {'investment_id': 'Cardano', 'ideal_proportion': 10, 'investment_strategy': 'Conservative', 'expected_growth': 75,
+     'random_growth': True, 'asset_volatility': 'High', 'growth_decay': True, 'volatility_duration': 2,
+     'volatility_magnitude': 1.2, 'volatility_phase': 0.5, 'bullbear_duration': 4, 'bullbear_magnitude': 1.35, 'bullbear_phase': 0.9},
+    {'investment_id': '10-yr Treasury', 'ideal_proportion': 25, 'investment_strategy': 'Risky', 'expected_growth': 4.2,
+     'random_growth': False, 'asset_volatility': 'Low', 'growth_decay': False, 'volatility_duration': 3,
+     'volatility_magnitude': 1, 'volatility_phase': 0, 'bullbear_duration': 4, 'bullbear_magnitude': 1, 'bullbear_phase': 0},
+    {'investment_id': 'SP500', 'ideal_proportion': 15, 'investment_strategy': 'Medium', 'expected_growth': 10,
+     'random_growth': True, 'asset_volatility': 'Mid', 'growth_decay': True, 'volatility_duration': 3,
+     'volatility_magnitude': 1, 'volatility_phase': 0, 'bullbear_duration': 10, 'bullbear_magnitude': 1, 'bullbear_phase': 0.05}
+]
+
+
+@pytest.fixture
+def investments():
+    '''
+        A small mixed portfolio in the session format (what /add-investment stores).
+    '''
+    return copy.deepcopy(PORTFOLIO)
+
+
+@pytest.fixture(params=['numpy', 'numba'])
+def backend(request):
+    '''
+        Every rebalancing backend; numba is an optional dependency, skipped when it isn't installed.
+    '''
+    from webapp import portfolioEngine
+    if request.param not in portfolioEngine.BACKENDS:
+        pytest.skip(f'{request.param} is not installed')
+    return request.param
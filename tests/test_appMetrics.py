@@ -0,0 +1,97 @@
+import time
+
+import dash
+import pytest
+from dash import html
+from dash.dependencies import Input, Output
+from dash.exceptions import PreventUpdate
+from flask import Flask
+
+from webapp import appMetrics
+
+
+def metric_lines(prefix, **labels):
+    wanted = [f'{name}="{value}"' for name, value in labels.items()]
+    return [line for line in appMetrics.render().splitlines()
+            if line.startswith(prefix) and all(label in line for label in wanted)]
+
+
+def metric_count(prefix, **labels):
+    lines = metric_lines(prefix + '_count', **labels)
+    return sum(int(line.rsplit(' ', 1)[1]) for line in lines)
+
+
+@pytest.fixture
+def metered_app(request):
+    name = f'test_{request.node.name}'.replace('[', '_').replace(']', '')
+    dash_app = dash.Dash(__name__, server=Flask(name), routes_pathname_prefix='/dash/test/')
+    dash_app.layout = html.Div([html.Button(id='button'), html.Div(id='output'), html.Div(id='other')])
+    timed_callback = appMetrics.instrument_dash(dash_app, name)
+
+    @dash_app.callback(Output('output', 'children'), Input('button', 'n_clicks'))
+    @timed_callback
+    def show_clicks(n_clicks):
+        with appMetrics.stage(appMetrics.FIGURE_BUILD):
+            time.sleep(0.01)
+        return f'{n_clicks} clicks'
+
+    @dash_app.callback(Output('other', 'children'), Input('button', 'title'))
+    @timed_callback
+    def never_updates(title):
+        raise PreventUpdate
+
+    return name, dash_app, show_clicks
+
+
+def update(client, output, prop, value):
+    return client.post('/dash/test/_dash-update-component', json={
+        'output': f'{output}.children',
+        'outputs': {'id': output, 'property': 'children'},
+        'inputs': [{'id': 'button', 'property': prop, 'value': value}],
+        'changedPropIds': [f'button.{prop}']
+    })
+
+
+def test_callbacks_are_timed_with_their_stages(metered_app):
+    name, dash_app, _ = metered_app
+    client = dash_app.server.test_client()
+
+    response = update(client, 'output', 'n_clicks', 3)
+    assert response.status_code == 200 and b'3 clicks' in response.data
+
+    assert metric_count('callback_latency_seconds', app=name, callback='show_clicks') == 1
+    assert metric_count('callback_payload_bytes', app=name, callback='show_clicks') == 1
+    handler = f'{name}.show_clicks'
+    # One observation per stage and callback: Dash's serialization is added to the callback's own
+    assert metric_count('stage_seconds', stage=appMetrics.FIGURE_BUILD, handler=handler) == 1
+    assert metric_count('stage_seconds', stage=appMetrics.SERIALIZATION, handler=handler) == 1
+    figureSeconds = float(metric_lines('stage_seconds_sum', stage=appMetrics.FIGURE_BUILD, handler=handler)[0].rsplit(' ', 1)[1])
+    assert figureSeconds >= 0.01
+
+
+def test_prevented_updates_count_as_errors_without_payload(metered_app):
+    name, dash_app, _ = metered_app
+    client = dash_app.server.test_client()
+
+    assert update(client, 'other', 'title', 'x').status_code == 204
+    assert metric_count('callback_latency_seconds', app=name, callback='never_updates') == 1
+    assert metric_count('callback_payload_bytes', app=name, callback='never_updates') == 0
+    assert metric_lines('callback_errors_total', app=name, callback='never_updates', error='PreventUpdate') == \
+        [f'callback_errors_total{{app="{name}",callback="never_updates",error="PreventUpdate"}} 1']
+
+
+def test_direct_calls_still_work(metered_app):
+    name, _, show_clicks = metered_app
+
+    # Outside of a request, the stages are observed as soon as the callback returns
+    assert show_clicks(2) == '2 clicks'
+    assert metric_count('stage_seconds', stage=appMetrics.FIGURE_BUILD, handler=f'{name}.show_clicks') == 1
+    assert metric_count('callback_latency_seconds', app=name) == 0
+
+
+def test_other_requests_are_left_alone(metered_app):
+    name, dash_app, _ = metered_app
+    client = dash_app.server.test_client()
+
+    assert client.get('/dash/test/_dash-layout').status_code == 200
+    assert metric_lines('callback_latency_seconds', app=name) == []
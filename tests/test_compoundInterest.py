@@ -0,0 +1,83 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from webapp import appMetrics, compoundInterest
+
+
+def reference_table(initialContribution, monthlyContributions, yieldRate, investmentTime, yearlyGainOnContributions, expectedInflation):
+    '''
+        The original month by month table, one row appended at a time.
+    '''
+
+    yieldRate /= 100
+    yearlyGainOnContributions /= 100
+    expectedInflation /= 100
+
+    monthly_rate = (1 + yieldRate) ** (1/12) - 1
+    monthly_contrib_growth = (1 + yearlyGainOnContributions) ** (1/12) - 1
+    monthly_inflation = (1 + expectedInflation) ** (1/12) - 1
+
+    current_balance = [initialContribution]
+    current_interest = [initialContribution * monthly_rate]
+    current_inflation = [initialContribution * monthly_inflation]
+    current_contribution = [monthlyContributions]
+    final_balance = [current_balance[0] + current_interest[0] - current_inflation[0] + current_contribution[0]]
+
+    investmentTime *= 12
+    for _ in range(1, investmentTime):
+        local_balance = final_balance[-1]
+        local_interest = local_balance * monthly_rate
+        local_inflation = local_balance * monthly_inflation
+        local_contribution = monthlyContributions
+        local_result = local_balance + local_interest - local_inflation + local_contribution
+
+        current_balance.append(local_balance)
+        current_interest.append(local_interest)
+        current_inflation.append(local_inflation)
+        current_contribution.append(local_contribution)
+        final_balance.append(local_result)
+
+        monthlyContributions *= (1 + monthly_contrib_growth - monthly_inflation)
+
+    df = pd.DataFrame({
+        'Initial Balance': current_balance,
+        'Interest': current_interest,
+        'Inflation': current_inflation,
+        'Monthly Investment': current_contribution,
+        'Final Balance': final_balance
+    })
+    df = df.round(2)
+
+    df['Months'] = np.arange(1, investmentTime + 1)
+    df['Current Year'] = df['Months'] // 12
+    return df
+
+
+@pytest.mark.parametrize('initialContribution, monthlyContributions, investmentTime, yearlyGain, inflation', list(itertools.product(
+    [0, 123456.78], [0, 3333.33], [1, 20, 50], [3, -2], [6, 0, 20]
+)))
+def test_table_matches_the_month_by_month_loop(initialContribution, monthlyContributions, investmentTime, yearlyGain, inflation):
+    yields = [15, 2, 12.39, 9.75, 0, -5, -100, 40]
+    curves = compoundInterest.compound_interest_curves(initialContribution, monthlyContributions, yields, investmentTime,
+                                                       yearlyGain, inflation)
+
+    for row, yieldRate in enumerate(yields):
+        expected = reference_table(initialContribution, monthlyContributions, yieldRate, investmentTime, yearlyGain, inflation)
+        for column in compoundInterest.CURVE_COLUMNS + ('Months', 'Current Year'):
+            values = curves[column][row] if column in compoundInterest.CURVE_COLUMNS else curves[column]
+            np.testing.assert_array_equal(values, expected[column].to_numpy(), err_msg=f'{column} at {yieldRate}%')
+
+
+def test_single_rate_dataframe():
+    expected = reference_table(1000, 500, 15, 20, 3, 6)
+    pd.testing.assert_frame_equal(compoundInterest.compound_interest_over_time(1000, 500, 15, 20, 3, 6), expected)
+
+
+def test_figure_build_is_timed_by_the_callback_only():
+    # update_values times building the traces and the figure as one stage, the traces aren't a stage of their own
+    assert not hasattr(compoundInterest.generate_scatter_trace, '__wrapped__')
+    figure, final_balance, *_ = compoundInterest.update_values(20, 15, 0, 500, 3, 6)
+    assert final_balance == f"Your Final Balance: ${reference_table(0, 500, 15, 20, 3, 6)['Final Balance'].iloc[-1]:,.2f}"
@@ -0,0 +1,46 @@
+'''
+    The Portfolio Projection callback answered from many threads at once: every request has its own
+    session and settings, and each concurrent response has to match the one it gets on its own.
+    Any state leaking between requests shows up as a mismatch.
+'''
+
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from webapp import portfolioProjection, sessionStore, simulationCache
+from stress_concurrentCallbacks import callback_body, make_requests
+
+
+def post(investments, settings):
+    client = portfolioProjection.application.test_client()
+    with client.session_transaction() as session:
+        sessionStore.session_store.set_investments(sessionStore.current_id(session), investments)
+
+    response = client.post('/dash/portfolioProjection/_dash-update-component', json=callback_body(settings))
+    assert response.status_code == 200, response.data[:500]
+    return json.loads(response.data)
+
+
+def test_concurrent_responses_match_sequential_ones(monkeypatch):
+    requests = make_requests(24, 4)
+
+    monkeypatch.setattr(portfolioProjection, 'simulation_cache', simulationCache.SimulationCache(maxsize=0))
+    expected = [post(investments, settings) for investments, settings in requests]
+
+    monkeypatch.setattr(portfolioProjection, 'simulation_cache', simulationCache.SimulationCache())
+    with ThreadPoolExecutor(8) as pool:
+        responses = list(pool.map(lambda request: post(*request), requests))
+
+    mismatches = [i for i, (response, reference) in enumerate(zip(responses, expected)) if response != reference]
+    assert not mismatches, f'responses differ from their sequential run: requests {mismatches}'
+
+
+@pytest.mark.parametrize('legacy_random', [False, True])
+def test_repeated_request_is_answered_the_same(monkeypatch, investments, legacy_random):
+    # The second answer comes from the cache
+    monkeypatch.setattr(portfolioProjection, 'simulation_cache', simulationCache.SimulationCache())
+    settings = {'start_amount': 1000, 'monthly_amount': 100, 'investment_time': 4, 'montecarlo_paths': 0,
+                'legacy_random': legacy_random, 'rebalancing_policy': 'weekly', 'time_step': 'weekly'}
+    assert post(investments, settings) == post(investments, settings)
@@ -0,0 +1,142 @@
+import io
+
+import pandas as pd
+import pytest
+
+from webapp import investmentTable, routes, sessionStore
+
+
+def csv_file(investments, drop=()):
+    frame = pd.DataFrame(investments, columns=investmentTable.TABLE_FIELDS).drop(columns=list(drop))
+    return io.BytesIO(frame.to_csv(index=False).encode())
+
+
+def parquet_file(investments):
+    stream = io.BytesIO()
+    pd.DataFrame(investments, columns=investmentTable.TABLE_FIELDS).to_parquet(stream, index=False)
+    return io.BytesIO(stream.getvalue())
+
+
+def validate(stream, file_format='csv'):
+    return investmentTable.validate_table(investmentTable.read_table(stream, file_format))
+
+
+@pytest.fixture
+def client():
+    return routes.application.test_client()
+
+
+def test_complete_rows_are_read_back(investments):
+    stored, errors = validate(csv_file(investments))
+    assert errors == []
+    assert [investment['investment_id'] for investment in stored] == [investment['investment_id'].upper() for investment in investments]
+    assert stored[1]['expected_growth'] == 30.0 and stored[1]['random_growth'] is True
+
+
+@pytest.mark.parametrize('field', ['ideal_proportion', 'expected_growth', 'random_growth', 'bullbear_phase'])
+def test_a_missing_engine_column_is_rejected(investments, field):
+    with pytest.raises(investmentTable.TableError, match=field):
+        validate(csv_file(investments, drop=[field]))
+
+
+@pytest.mark.parametrize('field', ['ideal_proportion', 'expected_growth', 'random_growth'])
+def test_a_blank_engine_field_is_rejected(investments, field):
+    del investments[2][field]
+    stored, errors = validate(csv_file(investments))
+    assert stored == []
+    assert errors == [{'row': 3, 'errors': [f'Missing {field}']}]
+
+
+def test_optional_fields_can_be_left_out(investments):
+    for investment in investments:
+        del investment['growth_decay']
+    stored, errors = validate(csv_file(investments, drop=['correlations']))
+    assert errors == [] and len(stored) == len(investments)
+
+
+def test_upload_stores_nothing_from_an_incomplete_table(client, investments):
+    del investments[0]['expected_growth']
+    response = client.post('/upload-investments?format=csv&mode=replace', data=csv_file(investments).getvalue())
+    assert response.status_code == 400
+    assert response.get_json()['errors'] == [{'row': 1, 'errors': ['Missing expected_growth']}]
+
+    with client.session_transaction() as session:
+        assert not sessionStore.session_store.investments(sessionStore.current_id(session))
+
+
+def test_parquet_upload(client, investments):
+    # Typed columns: booleans and floats come back as they were, a null is a blank cell
+    stored, errors = validate(parquet_file(investments), 'parquet')
+    assert errors == []
+    assert stored[1]['random_growth'] is True and stored[1]['expected_growth'] == 30.0
+
+    del investments[3]['random_growth']
+    response = client.post('/upload-investments?format=parquet&mode=replace', data=parquet_file(investments).getvalue())
+    assert response.status_code == 400
+    assert response.get_json()['errors'] == [{'row': 4, 'errors': ['Missing random_growth']}]
+
+
+@pytest.mark.parametrize('file_format', ['csv', 'parquet'])
+def test_download_and_upload_round_trip(client, investments, file_format):
+    assert client.post('/upload-investments?format=csv&mode=replace', data=csv_file(investments).getvalue()).status_code == 200
+    downloaded = client.get(f'/download-investments?format={file_format}')
+    assert downloaded.status_code == 200
+
+    stored, errors = validate(io.BytesIO(downloaded.data), file_format)
+    assert errors == []
+    with client.session_transaction() as session:
+        assert stored == list(sessionStore.session_store.investments(sessionStore.current_id(session)))
+
+
+# ---------------------------------------- Batch edits
+
+def edit(client, operations):
+    return client.post('/edit-investments', json={'operations': operations})
+
+
+def stored_ids(client):
+    with client.session_transaction() as session:
+        return [investment['investment_id'] for investment in sessionStore.session_store.investments(sessionStore.current_id(session))]
+
+
+def test_incomplete_added_rows_are_rejected(client, investments):
+    assert edit(client, [{'op': 'add', 'investment': investments[0]}]).status_code == 200
+
+    complete = dict(investments[1])
+    incomplete = {field: value for field, value in investments[2].items() if field != 'expected_growth'}
+    response = edit(client, [{'op': 'add', 'investment': complete}, {'op': 'add', 'investment': incomplete}])
+
+    assert response.status_code == 400
+    assert response.get_json()['errors'] == [{'operation': 1, 'errors': ['Missing expected_growth']}]
+    assert stored_ids(client) == ['DEBENTURE A']
+
+
+def test_updates_cannot_blank_an_engine_field(client, investments):
+    assert edit(client, [{'op': 'add', 'investment': investment} for investment in investments[:2]]).status_code == 200
+
+    response = edit(client, [{'op': 'update', 'investment_id': 'BITCOIN', 'changes': {'ideal_proportion': None}}])
+    assert response.status_code == 400
+    assert response.get_json()['errors'] == [{'operation': 0, 'errors': ['Missing ideal_proportion']}]
+
+
+def test_complete_batch_is_applied(client, investments):
+    assert edit(client, [{'op': 'add', 'investment': investment} for investment in investments]).status_code == 200
+
+    response = edit(client, [
+        {'op': 'delete', 'investment_id': 'CARDANO'},
+        {'op': 'update', 'investment_id': 'SP500', 'changes': {'expected_growth': 12}},
+        {'op': 'add', 'investment': dict(investments[0], investment_id='New asset')}
+    ])
+    assert response.get_json() == {'status': 'success', 'added': 1, 'updated': 1, 'deleted': 1}
+    assert stored_ids(client) == ['DEBENTURE A', 'BITCOIN', '10-YR TREASURY', 'SP500', 'NEW ASSET']
+
+
+def test_updates_keep_the_investment_id(investments):
+    # Default portfolio ids keep their case: an edit must not rename the asset (its id seeds its random stream)
+    changes, errors = investmentTable.plan_changes(investments, [
+        {'op': 'update', 'investment_id': 'Bitcoin', 'changes': {'expected_growth': 20}},
+        {'op': 'update', 'investment_id': 'sp500', 'changes': {'investment_id': 'Total market'}}
+    ])
+    assert errors == []
+    assert changes.updated['Bitcoin'] == dict(investments[1], expected_growth=20.0)
+    assert changes.updated['SP500']['investment_id'] == 'TOTAL MARKET'
@@ -0,0 +1,247 @@
+import numpy as np
+import pytest
+
+from webapp import portfolioEngine
+
+
+def individual_worth(investments, start_amount, monthly_amount, years, strategy, backend):
+    if strategy is not None:
+        investments = [dict(investment, investment_strategy=strategy) for investment in investments]
+    inputs = portfolioEngine.prepare_portfolio(investments, start_amount, years * 52)
+    timeline, _ = portfolioEngine.simulate_timeline(inputs, monthly_amount * 12 / 52, backend=backend)
+    return timeline.current_amount[-1].sum()
+
+
+def assert_matches_individual_runs(sweep, investments, backend):
+    for (s, m, h, k), worth in np.ndenumerate(sweep.final_worth):
+        expected = individual_worth(investments, sweep.start_amounts[s], sweep.monthly_amounts[m], int(sweep.horizons[h]),
+                                    sweep.strategies[k], backend)
+        assert worth == pytest.approx(expected, rel=1e-9), (s, m, h, k)
+
+
+def test_single_scenario_grid(investments, backend):
+    sweep = portfolioEngine.simulate_sweep(investments, [5000], [400], [3], ['Risky'], backend=backend)
+    assert_matches_individual_runs(sweep, investments, backend)
+
+
+@pytest.mark.parametrize('memory_budget', [portfolioEngine.MONTECARLO_MEMORY_BUDGET, 1])
+def test_every_cell_matches_its_own_run(investments, backend, memory_budget):
+    # A budget of 1 byte leaves one scenario per chunk
+    sweep = portfolioEngine.simulate_sweep(investments, [1000, 5000], [0, 400], [1, 3], [None, 'Risky'],
+                                           memory_budget=memory_budget, backend=backend)
+    assert sweep.final_worth.shape == (2, 2, 2, 2)
+    assert_matches_individual_runs(sweep, investments, backend)
+
+
+def test_trailing_single_scenario_chunk(investments, backend):
+    # Three scenarios per horizon, two per chunk: the last chunk of each horizon holds one
+    inputs = portfolioEngine.prepare_portfolio(investments, 1, 2 * 52)
+    scenarioBytes = 2 * 2 * 52 * len(inputs.ideal_proportion) * 8
+    sweep = portfolioEngine.simulate_sweep(investments, [1000, 2000, 3000], [100], [1, 2],
+                                           memory_budget=2 * scenarioBytes, backend=backend)
+    assert_matches_individual_runs(sweep, investments, backend)
+
+
+def test_summary_matches_recorded_worth(investments, backend):
+    arguments = (investments, [1000, 5000], [400], [1, 3], [None, 'Risky'])
+    recorded = portfolioEngine.simulate_sweep(*arguments, memory_budget=1, backend=backend)
+    summarized = portfolioEngine.simulate_sweep(*arguments, memory_budget=1, backend=backend, summary=True)
+    np.testing.assert_allclose(summarized.final_worth, recorded.final_worth, rtol=1e-9)
+
+
+# ------------------------------------------------------------------------------------------------
+# The weekly loop as it was written before the engine existed, one week and one portfolio at a time
+
+def reference_week(amount, sold, bought, weekGrowth, idealProportion, thresholdProportion, contribution):
+    amount += amount * weekGrowth
+
+    thresholdInvestment = thresholdProportion * amount.sum()
+    idealInvestment = idealProportion * amount.sum()
+    sellingDelta = np.maximum(amount - thresholdInvestment, np.zeros(len(amount)))
+    sold += sellingDelta
+    amount = np.minimum(amount, thresholdInvestment)
+
+    toBuy_Delta = np.maximum(idealInvestment - amount, np.zeros(len(amount)))
+    toBuy_Proportion = toBuy_Delta / (toBuy_Delta.sum() + 1e-10)
+    if np.sum(toBuy_Proportion) == 0:
+        toBuy_Proportion = np.full(len(amount), 1/len(amount))
+
+    boughtValues = toBuy_Proportion * np.round(sellingDelta.sum() + contribution, 2)
+    bought += boughtValues
+    return amount + boughtValues
+
+
+def reference_run(startAmount, growth, idealProportion, thresholdProportion, contribution, policy='weekly', steps_per_year=52):
+    '''
+        (weeks, assets) amounts, totals sold and bought. Outside of rebalancing weeks nothing is sold
+        and the contribution is bought at the ideal proportions.
+    '''
+
+    periods = {'weekly': 52, 'monthly': 12, 'quarterly': 4, 'threshold': 0}[policy]
+    amount, sold, bought = np.array(startAmount, dtype=np.float64), np.zeros(len(startAmount)), np.zeros(len(startAmount))
+    amounts, solds, boughts = [], [], []
+
+    for week, weekGrowth in enumerate(growth):
+        grown = amount * (1 + weekGrowth)
+        scheduled = week * periods // steps_per_year != (week + 1) * periods // steps_per_year
+        crossed = policy == 'threshold' and (grown > thresholdProportion * grown.sum()).any()
+        if scheduled or crossed:
+            amount = reference_week(amount, sold, bought, weekGrowth, idealProportion, thresholdProportion, contribution)
+        else:
+            amount = grown + contribution * idealProportion
+            bought += contribution * idealProportion
+        amounts.append(amount.copy())
+        solds.append(sold.copy())
+        boughts.append(bought.copy())
+
+    return np.array(amounts), np.array(solds), np.array(boughts)
+
+
+def legacy_growth(inputs):
+    '''
+        Growth of a legacy run, drawn like the old code did: the global generator seeded with every
+        week's seed at once, then one np.random.normal call per week.
+    '''
+
+    mean, spread = portfolioEngine.portfolio_cycles(inputs)
+    weeks = np.arange(1, len(mean) + 1)
+    state = np.random.get_state()
+    try:
+        np.random.seed((weeks + inputs.name_length[0]).astype(int))
+        values = np.array([np.random.normal(mean[i], spread[i]) for i in range(len(weeks))])
+    finally:
+        np.random.set_state(state)
+    return inputs.decay * values
+
+
+def test_decay_matches_linspace(investments):
+    inputs = portfolioEngine.prepare_portfolio(investments, 1000, 5 * 52)
+    for start, decay in zip(inputs.decay[0], inputs.decay.T):
+        np.testing.assert_array_equal(decay, np.linspace(start, decay[-1], num=5 * 52))
+
+
+def test_legacy_run_is_bit_exact(investments):
+    inputs = portfolioEngine.prepare_portfolio(investments, 1000, 4 * 52)
+    timeline, _ = portfolioEngine.simulate_timeline(inputs, 100 * 12 / 52, random_mode='legacy', backend='numpy')
+
+    amounts, sold, bought = reference_run(inputs.start_amount, legacy_growth(inputs), inputs.ideal_proportion,
+                                          inputs.threshold_proportion, 100 * 12 / 52)
+    np.testing.assert_array_equal(timeline.current_amount, amounts)
+    np.testing.assert_array_equal(timeline.total_sold, sold)
+    np.testing.assert_array_equal(timeline.total_bought, bought)
+
+
+@pytest.mark.parametrize('years, previous_years', [(5, 3), (3, 5), (4, 4)])
+def test_resumed_run_matches_a_fresh_one(investments, years, previous_years):
+    contribution = 100 * 12 / 52
+    _, checkpoint = portfolioEngine.simulate_timeline(portfolioEngine.prepare_portfolio(investments, 1000, previous_years * 52),
+                                                      contribution, backend='numpy')
+
+    inputs = portfolioEngine.prepare_portfolio(investments, 1000, years * 52)
+    resumed, _ = portfolioEngine.simulate_timeline(inputs, contribution, previous=checkpoint, backend='numpy')
+    fresh, _ = portfolioEngine.simulate_timeline(inputs, contribution, backend='numpy')
+
+    assert portfolioEngine.resume_week(checkpoint, inputs) > 0
+    for field in portfolioEngine.EngineResult._fields:
+        np.testing.assert_array_equal(getattr(resumed, field), getattr(fresh, field), err_msg=field)
+
+
+@pytest.mark.parametrize('policy', portfolioEngine.REBALANCING_POLICIES)
+@pytest.mark.parametrize('steps_per_year', [52, 365])
+def test_policies_match_the_weekly_loop(investments, policy, steps_per_year):
+    inputs = portfolioEngine.prepare_portfolio(investments, 1000, 3 * steps_per_year, steps_per_year)
+    growth = portfolioEngine.growth_schedule(inputs)
+    contribution = 100 * 12 / steps_per_year
+
+    timeline = portfolioEngine.run_rebalancing(inputs.start_amount, growth, inputs.ideal_proportion, inputs.threshold_proportion,
+                                               contribution, backend='numpy', policy=policy, steps_per_year=steps_per_year)
+    amounts, sold, bought = reference_run(inputs.start_amount, growth, inputs.ideal_proportion, inputs.threshold_proportion,
+                                          contribution, policy, steps_per_year)
+
+    np.testing.assert_allclose(timeline.current_amount, amounts, rtol=1e-9)
+    np.testing.assert_allclose(timeline.total_sold, sold, rtol=1e-9, atol=1e-9)
+    np.testing.assert_allclose(timeline.total_bought, bought, rtol=1e-9)
+
+
+@pytest.mark.parametrize('policy', ['monthly', 'threshold'])
+def test_batched_policies_match_their_single_runs(investments, policy):
+    # Slots that rebalance on different weeks share the closed-form stretches
+    inputs = portfolioEngine.prepare_portfolio(investments, 1000, 3 * 52)
+    growth = portfolioEngine.growth_schedule(inputs)
+    strategies = np.array([1.0375, 1.075, 1.15])
+    thresholds = np.array([portfolioEngine.threshold_proportion(inputs.ideal_proportion, strategy) for strategy in strategies])
+    contributions = np.array([0, 50, 400])
+
+    batched = portfolioEngine.run_rebalancing(inputs.start_amount, growth[:, np.newaxis, :], inputs.ideal_proportion, thresholds,
+                                              contributions, backend='numpy', policy=policy)
+    for slot in range(len(strategies)):
+        amounts, _, _ = reference_run(inputs.start_amount, growth, inputs.ideal_proportion, thresholds[slot],
+                                      contributions[slot], policy)
+        np.testing.assert_allclose(batched.current_amount[:, slot], amounts, rtol=1e-9)
+
+
+# ------------------------------------------------------------------------------------------------
+# numpy and numba backends: same algorithm, the same numbers to float rounding
+
+numba_backend = pytest.mark.skipif('numba' not in portfolioEngine.BACKENDS, reason='numba is not installed')
+
+
+def test_numba_is_opt_in():
+    # numpy unless asked: only it gives the reference results bit for bit
+    assert portfolioEngine.resolve_backend() == 'numpy'
+    assert portfolioEngine.resolve_backend('auto') == ('numba' if 'numba' in portfolioEngine.BACKENDS else 'numpy')
+    with pytest.raises(ValueError):
+        portfolioEngine.resolve_backend('fortran')
+
+
+def test_default_backend_is_bit_exact(investments):
+    inputs = portfolioEngine.prepare_portfolio(investments, 1000, 4 * 52)
+    timeline, _ = portfolioEngine.simulate_timeline(inputs, 100 * 12 / 52, random_mode='legacy')
+
+    amounts, sold, bought = reference_run(inputs.start_amount, legacy_growth(inputs), inputs.ideal_proportion,
+                                          inputs.threshold_proportion, 100 * 12 / 52)
+    np.testing.assert_array_equal(timeline.current_amount, amounts)
+    np.testing.assert_array_equal(timeline.total_sold, sold)
+    np.testing.assert_array_equal(timeline.total_bought, bought)
+
+
+def assert_same_results(numpyResult, numbaResult):
+    for field in numpyResult._fields:
+        np.testing.assert_allclose(getattr(numbaResult, field), getattr(numpyResult, field), rtol=1e-9, atol=1e-9, err_msg=field)
+
+
+@numba_backend
+@pytest.mark.parametrize('batch', [None, 4])
+def test_backends_agree_on_the_timeline(investments, batch):
+    inputs = portfolioEngine.prepare_portfolio(investments * 4, 1000, 6 * 52)
+    growth = portfolioEngine.growth_schedule(inputs)
+    thresholds = inputs.threshold_proportion
+    if batch is not None:
+        # Different growth and thresholds per slot
+        growth = growth[:, np.newaxis, :] * np.linspace(0.5, 2, batch)[:, np.newaxis]
+        thresholds = thresholds * np.linspace(0.9, 1.2, batch)[:, np.newaxis]
+
+    results = [portfolioEngine.run_rebalancing(inputs.start_amount, growth, inputs.ideal_proportion, thresholds, 100 * 12 / 52,
+                                               backend=backend)
+               for backend in ('numpy', 'numba')]
+    assert_same_results(*results)
+
+
+@numba_backend
+def test_backends_agree_on_the_summary(investments):
+    inputs = portfolioEngine.prepare_portfolio(investments, 1000, 10 * 52)
+    growth = portfolioEngine.growth_schedule(inputs)
+
+    results = [portfolioEngine.run_rebalancing(inputs.start_amount, growth, inputs.ideal_proportion, inputs.threshold_proportion,
+                                               100 * 12 / 52, backend=backend, record_weeks=[10 * 52 - 1], summary=True)
+               for backend in ('numpy', 'numba')]
+    assert_same_results(results[0][0], results[1][0])
+    assert_same_results(results[0][1], results[1][1])
+
+
+@numba_backend
+def test_backends_agree_on_monte_carlo(investments):
+    inputs = portfolioEngine.prepare_portfolio(investments, 1000, 5 * 52)
+    numpyPaths, numbaPaths = (portfolioEngine.simulate_paths(inputs, 100 * 12 / 52, 64, backend=backend) for backend in ('numpy', 'numba'))
+    np.testing.assert_allclose(numbaPaths.total, numpyPaths.total, rtol=1e-9)
+    np.testing.assert_allclose(numbaPaths.per_asset, numpyPaths.per_asset, rtol=1e-9, atol=1e-9)
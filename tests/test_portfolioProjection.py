@@ -0,0 +1,110 @@
+import json
+
+import pytest
+
+from webapp import appMetrics, figurePayloads, portfolioProjection, sessionStore, simulationCache, simulationContext, taxLedger
+
+
+def dash_id(component_id):
+    return json.dumps(component_id, sort_keys=True, separators=(',', ':')) if isinstance(component_id, dict) else component_id
+
+
+def zoom_body(graph, relayoutData, chartsSettings):
+    output = figurePayloads.figure_id(graph)
+    return {
+        'output': f'{dash_id(output)}.data',
+        'outputs': {'id': output, 'property': 'data'},
+        'inputs': [{'id': figurePayloads.graph_id_of(graph), 'property': 'relayoutData', 'value': relayoutData}],
+        'changedPropIds': [f'{dash_id(figurePayloads.graph_id_of(graph))}.relayoutData'],
+        'state': [{'id': 'charts-settings', 'property': 'data', 'value': chartsSettings}]
+    }
+
+
+@pytest.fixture
+def client(investments, monkeypatch):
+    monkeypatch.setattr(portfolioProjection, 'simulation_cache', simulationCache.SimulationCache())
+    client = portfolioProjection.application.test_client()
+    with client.session_transaction() as session:
+        sessionStore.session_store.set_investments(sessionStore.current_id(session), investments)
+    return client
+
+
+@pytest.fixture
+def simulations(monkeypatch):
+    calls = []
+
+    def counted(context):
+        calls.append(context)
+        return simulate_timeline(context)
+
+    simulate_timeline = portfolioProjection.simulate_timeline
+    monkeypatch.setattr(portfolioProjection, 'simulate_timeline', counted)
+    return calls
+
+
+CHARTS_SETTINGS = {'settings': simulationContext.PortfolioSettings()._asdict(), 'resolution': 'weekly', 'inflation': None}
+
+
+@pytest.mark.parametrize('graph', ['line-chart-by-type', 'line-chart-total'])
+def test_relayout_without_zoom_skips_the_simulation(client, simulations, graph):
+    response = client.post('/dash/portfolioProjection/_dash-update-component',
+                           json=zoom_body(graph, {'legend.x': 0.5}, CHARTS_SETTINGS))
+    assert response.status_code == 204
+    assert simulations == []
+
+
+@pytest.mark.parametrize('graph', ['line-chart-by-type', 'line-chart-total'])
+def test_zoom_redraws_from_the_simulation(client, simulations, graph):
+    response = client.post('/dash/portfolioProjection/_dash-update-component',
+                           json=zoom_body(graph, {'xaxis.range[0]': 10, 'xaxis.range[1]': 60}, CHARTS_SETTINGS))
+    assert response.status_code == 200
+    assert len(simulations) == 1
+    callback = 'zoom_' + graph.replace('-', '_')
+    assert f'callback_latency_seconds_count{{app="portfolioProjection",callback="{callback}"}}' in appMetrics.render()
+
+
+def test_weekly_horizons_stay_capped(client, simulations):
+    from stress_concurrentCallbacks import callback_body
+
+    settings = {'start_amount': 1000, 'monthly_amount': 100, 'investment_time': portfolioProjection.MAX_DAILY_INVESTMENT_TIME,
+                'montecarlo_paths': 0, 'legacy_random': False, 'rebalancing_policy': 'weekly', 'time_step': 'weekly'}
+    response = client.post('/dash/portfolioProjection/_dash-update-component', json=callback_body(settings))
+    assert response.status_code == 200
+    assert [context.settings.investment_time for context in simulations] == [portfolioProjection.MAX_INVESTMENT_TIME]
+
+
+def test_time_step_settings():
+    weekly = portfolioProjection.update_time_step_settings('weekly')
+    daily = portfolioProjection.update_time_step_settings('daily')
+
+    assert weekly[0] == portfolioProjection.MAX_INVESTMENT_TIME == 40
+    assert daily[0] == portfolioProjection.MAX_DAILY_INVESTMENT_TIME == 80
+    assert max(weekly[1]) == 40 and max(daily[1]) == 80
+    # Legacy paths can't be picked with daily steps, and the label says why
+    assert not weekly[2][0].get('disabled')
+    assert daily[2][0]['disabled'] and 'weekly steps only' in daily[2][0]['label']
+
+
+@pytest.mark.parametrize('value_view', ['nominal', 'real'])
+def test_zero_horizon(client, value_view):
+    from stress_concurrentCallbacks import callback_body
+
+    settings = {'start_amount': 1000, 'monthly_amount': 100, 'investment_time': 0, 'montecarlo_paths': 0,
+                'legacy_random': False, 'rebalancing_policy': 'weekly', 'time_step': 'weekly'}
+    body = callback_body(settings)
+    body['inputs'][2]['value'] = value_view
+    response = client.post('/dash/portfolioProjection/_dash-update-component', json=body)
+    assert response.status_code == 200
+    if value_view == 'real':
+        assert "That's $0.00 before inflation" in response.get_data(as_text=True)
+
+
+def test_zero_horizon_with_taxes(client, monkeypatch):
+    from stress_concurrentCallbacks import callback_body
+
+    monkeypatch.setattr(portfolioProjection, 'TAX_RULES', taxLedger.tax_rules([(0, 15)]))
+    settings = {'start_amount': 1000, 'monthly_amount': 100, 'investment_time': 0, 'montecarlo_paths': 0,
+                'legacy_random': False, 'rebalancing_policy': 'weekly', 'time_step': 'weekly'}
+    response = client.post('/dash/portfolioProjection/_dash-update-component', json=callback_body(settings))
+    assert response.status_code == 200
+    assert 'Taxes Due (not deducted)' in response.get_data(as_text=True)
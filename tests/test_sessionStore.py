@@ -0,0 +1,93 @@
+import pytest
+from flask.sessions import SecureCookieSessionInterface
+
+from webapp import investmentTable, routes, sessionStore
+
+
+def traced(store):
+    '''
+        Every SQL statement the store's in-memory connection runs from here on.
+    '''
+    statements = []
+    store._shared.set_trace_callback(statements.append)
+    return statements
+
+
+@pytest.fixture
+def store():
+    return sessionStore.SessionStore()
+
+
+def test_lru_hits_run_no_query(store, investments):
+    store.set_investments('a', investments)
+    assert store.portfolio('a').investments == tuple(investments)
+
+    statements = traced(store)
+    for _ in range(3):
+        assert store.portfolio('a').investments == tuple(investments)
+    assert statements == []
+
+
+def test_misses_read_in_a_deferred_transaction(investments):
+    store = sessionStore.SessionStore(cache_assets=0) # nothing stays cached
+    store.set_investments('a', investments)
+
+    statements = traced(store)
+    assert store.portfolio('a').investments == tuple(investments)
+    assert 'BEGIN DEFERRED' in statements
+    assert not any('IMMEDIATE' in statement for statement in statements)
+
+
+def test_changes_from_another_worker_are_seen(tmp_path, investments):
+    # Two stores on one file, like two gunicorn workers
+    path = str(tmp_path / 'sessions.sqlite')
+    first, second = sessionStore.SessionStore(path), sessionStore.SessionStore(path)
+
+    first.set_investments('a', investments[:2])
+    assert second.portfolio('a').investments == tuple(investments[:2])
+    assert first.portfolio('a').investments == tuple(investments[:2])
+
+    second.add_investment('a', investments[2])
+    assert first.portfolio('a').investments == tuple(investments[:3])
+
+    second.delete_investment('a', investments[0]['investment_id'])
+    assert first.portfolio('a').investments == tuple(investments[1:3])
+
+    second.delete('a')
+    assert first.portfolio('a') is None
+
+
+def test_own_changes_patch_the_cached_copy(store, investments):
+    store.set_investments('a', investments[:2])
+    store.add_investment('a', investments[2])
+
+    statements = traced(store)
+    assert store.portfolio('a').investments == tuple(investments[:3])
+    assert statements == []
+
+
+def test_cookie_sessions_are_migrated(investments):
+    application = routes.application
+    serializer = SecureCookieSessionInterface().get_signing_serializer(application)
+    cookie = serializer.dumps({'investments': investments, 'theme': 'dark'})
+
+    client = application.test_client()
+    client.set_cookie(application.config['SESSION_COOKIE_NAME'], cookie)
+    response = client.get('/download-investments')
+
+    assert response.status_code == 200
+    rows = response.get_data(as_text=True).splitlines()[1:]
+    assert [row.split(',')[0] for row in rows] == [investment['investment_id'] for investment in investments]
+
+    session_id = client.get_cookie(application.config['SESSION_COOKIE_NAME']).value
+    assert sessionStore.SESSION_ID_PATTERN.match(session_id)
+    assert sessionStore.session_store.load(session_id) == {'theme': 'dark'}
+
+
+def test_unsigned_cookies_start_a_new_session():
+    application = routes.application
+    client = application.test_client()
+    client.set_cookie(application.config['SESSION_COOKIE_NAME'], 'not a signed session')
+
+    response = client.get('/download-investments')
+    assert response.get_data(as_text=True).splitlines() == [','.join(investmentTable.TABLE_FIELDS)]
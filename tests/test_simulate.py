@@ -0,0 +1,110 @@
+import io
+
+import numpy as np
+import pyarrow.ipc
+import pytest
+
+from webapp import portfolioEngine, routes, sessionStore
+
+
+SETTINGS = {'start_amount': 5000, 'monthly_amount': 400, 'investment_time': 3}
+
+
+@pytest.fixture
+def client():
+    return routes.application.test_client()
+
+
+def simulate(client, runs, **query):
+    return client.post('/simulate', json={'runs': runs, **query})
+
+
+def test_results_match_the_engine(client, investments):
+    response = simulate(client, [{'investments': investments, 'settings': SETTINGS}])
+    assert response.status_code == 200
+
+    # /simulate stores ids capitalized, like /add-investment, and they seed each asset's stream
+    normalized = [dict(investment, investment_id=investment['investment_id'].upper()) for investment in investments]
+    inputs = portfolioEngine.prepare_portfolio(normalized, 5000, 3 * 52)
+    timeline, _ = portfolioEngine.simulate_timeline(inputs, 400 * 12 / 52)
+    result = response.get_json()['results'][0]
+    assert result['summary']['final_worth'] == pytest.approx(timeline.current_amount[-1].sum(), rel=1e-9)
+
+
+def test_duplicate_ids_are_rejected_whatever_their_case(client, investments):
+    investments.append(dict(investments[0], investment_id=investments[0]['investment_id'].lower()))
+    response = simulate(client, [{'investments': investments, 'settings': SETTINGS}])
+    assert response.status_code == 400
+    assert response.get_json() == {'status': 'error', 'message': 'Duplicate investment_id', 'run': 0}
+
+
+def test_incomplete_investments_are_rejected(client, investments):
+    del investments[1]['expected_growth']
+    response = simulate(client, [{'investments': investments, 'settings': SETTINGS}])
+    assert response.status_code == 400
+    assert response.get_json()['message'] == 'Missing expected_growth'
+
+
+def test_large_portfolio_is_validated_in_one_pass(client, investments, monkeypatch):
+    # Every id is checked against a set: the lookups don't grow with the portfolio
+    portfolio = [dict(investments[i % len(investments)], investment_id=f'ASSET {i}') for i in range(5000)]
+    checked = []
+    validate_investment = routes.validate_investment
+
+    def spied(data, taken_ids):
+        assert isinstance(taken_ids, set) and len(taken_ids) == len(checked)
+        checked.append(data['investment_id'])
+        return validate_investment(data, taken_ids)
+
+    monkeypatch.setattr(routes, 'validate_investment', spied)
+    response = simulate(client, [{'investments': portfolio, 'settings': dict(SETTINGS, investment_time=1)}], timeline=False)
+    assert response.status_code == 200
+    assert len(checked) == 5000
+
+
+def test_add_investment_rejects_taken_ids(client, investments):
+    with client.session_transaction() as session:
+        sessionStore.session_store.set_investments(sessionStore.current_id(session), investments)
+
+    assert client.post('/add-investment', json=dict(investments[0], investment_id='sp500')).get_json() == \
+        {'status': 'error', 'message': 'Duplicate investment_id'}
+    assert client.post('/add-investment', json=dict(investments[0], investment_id='new one')).get_json() == {'status': 'success'}
+
+
+def test_arrow_results(client, investments):
+    response = simulate(client, [{'investments': investments, 'settings': SETTINGS}], format='arrow')
+    assert response.status_code == 200
+    table = pyarrow.ipc.open_stream(io.BytesIO(response.data)).read_all()
+    assert table.num_rows > 0
+
+
+@pytest.mark.parametrize('settings, error', [
+    ({'investment_time': 40}, None),
+    ({'investment_time': 41}, 'investment_time must be between 1 and 40 years with weekly steps'),
+    ({'investment_time': 80, 'time_step': 'daily'}, None),
+    ({'investment_time': 81, 'time_step': 'daily'}, 'investment_time must be between 1 and 80 years with daily steps'),
+    ({'legacy_random': True}, None),
+    ({'legacy_random': True, 'time_step': 'daily'}, 'legacy_random needs weekly time steps'),
+    ({'time_step': 'hourly'}, 'Invalid time_step')
+])
+def test_settings_limits(settings, error):
+    validated, message = routes.validate_settings(settings)
+    assert message == error
+    assert (validated is None) == (error is not None)
+
+
+@pytest.mark.parametrize('value', ['false', 'true', 0, 1, None])
+def test_booleans_must_be_json_booleans(client, investments, value):
+    investments[0]['random_growth'] = value
+    response = simulate(client, [{'investments': investments, 'settings': SETTINGS}])
+    assert response.status_code == 400
+    assert response.get_json()['message'] == 'Invalid value for random_growth'
+
+    assert routes.validate_settings({'legacy_random': value}) == (None, 'Invalid value for legacy_random')
+
+    response = simulate(client, [{'investments': investments[1:], 'settings': SETTINGS}], timeline=value)
+    assert response.status_code == 400
+    assert response.get_json()['message'] == 'Invalid value for timeline'
+
+    response = client.post('/add-investment', json=dict(investments[0], investment_id='Strict'))
+    assert response.get_json() == {'status': 'error', 'message': 'Invalid value for random_growth'}
@@ -0,0 +1,115 @@
+import json
+import os
+import time
+
+import numpy as np
+import pytest
+
+from stress_concurrentCallbacks import callback_body
+from webapp import portfolioProjection, sessionStore, simulationJobs
+
+# Pool workers start from a forkserver: conftest registers the bare webapp package in it
+PRELOAD = ['conftest']
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture(autouse=True)
+def forkserver_path(monkeypatch):
+    # The forkserver doesn't get the parent's sys.path, only its environment
+    monkeypatch.setenv('PYTHONPATH', os.pathsep.join([TESTS_DIR, os.path.dirname(TESTS_DIR), os.path.join(os.path.dirname(TESTS_DIR), 'benchmarks')]))
+
+
+def counted_job(directory, steps, progress=None):
+    '''
+        Leaves one file per run in directory, then reports progress `steps` times, 50ms apart.
+    '''
+
+    open(os.path.join(directory, f'run-{os.getpid()}-{time.monotonic_ns()}'), 'w').close()
+    for step in range(steps):
+        progress(step / steps, f'step {step}')
+        time.sleep(0.05)
+    return {'steps': np.arange(steps)}
+
+
+def runs(directory):
+    return [name for name in os.listdir(directory) if name.startswith('run-')]
+
+
+def wait_for(jobs, key, states=('done', 'cancelled', 'failed'), timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = jobs.status(key)
+        if status is not None and status['state'] in states:
+            return status
+        time.sleep(0.05)
+    raise AssertionError(f'job {key} is still {jobs.status(key)}')
+
+
+@pytest.fixture
+def jobs(tmp_path):
+    jobs = simulationJobs.SimulationJobs(str(tmp_path / 'jobs'), max_workers=1, preload=PRELOAD)
+    yield jobs
+    if jobs._pool is not None:
+        jobs._pool.shutdown(cancel_futures=True)
+
+
+def test_job_runs_and_returns_its_result(jobs, tmp_path):
+    jobs.submit('short', counted_job, str(tmp_path), 3)
+    assert wait_for(jobs, 'short')['state'] == 'done'
+    np.testing.assert_array_equal(jobs.result('short')['steps'], np.arange(3))
+    jobs.release('short')
+
+
+def test_same_key_joins_the_running_job(jobs, tmp_path):
+    jobs.submit('shared', counted_job, str(tmp_path), 20)
+    wait_for(jobs, 'shared', states=('running',))
+    assert jobs.submit('shared', counted_job, str(tmp_path), 20)['waiters'] == 2
+
+    assert wait_for(jobs, 'shared')['state'] == 'done'
+    assert len(runs(tmp_path)) == 1
+
+
+def test_last_release_cancels_the_job(jobs, tmp_path):
+    jobs.submit('unwanted', counted_job, str(tmp_path), 1000)
+    jobs.submit('unwanted', counted_job, str(tmp_path), 1000)
+    wait_for(jobs, 'unwanted', states=('running',))
+
+    jobs.release('unwanted')
+    time.sleep(0.2)
+    assert jobs.status('unwanted')['state'] == 'running' # somebody still waits for it
+
+    jobs.release('unwanted')
+    assert wait_for(jobs, 'unwanted')['state'] == 'cancelled'
+    assert jobs.result('unwanted') is None
+
+
+def test_dashboard_runs_long_simulations_in_the_background(monkeypatch, tmp_path, investments):
+    jobs = simulationJobs.SimulationJobs(str(tmp_path / 'jobs'), max_workers=1, preload=PRELOAD)
+    monkeypatch.setattr(portfolioProjection, 'simulation_jobs', jobs)
+    monkeypatch.setattr(portfolioProjection, 'BACKGROUND_MIN_WORK', 0)
+
+    client = portfolioProjection.application.test_client()
+    with client.session_transaction() as session:
+        sessionStore.session_store.set_investments(sessionStore.current_id(session), investments)
+
+    settings = {'start_amount': 1000, 'monthly_amount': 100, 'investment_time': 10, 'montecarlo_paths': 50,
+                'legacy_random': False, 'rebalancing_policy': 'weekly', 'time_step': 'weekly'}
+    body = callback_body(settings)
+    try:
+        response = json.loads(client.post('/dash/portfolioProjection/_dash-update-component', json=body).data)['response']
+        job = response['simulation-job']['data']
+        assert job is not None and response['simulation-poll']['disabled'] is False
+
+        # What the page's interval does until the charts come back
+        body['changedPropIds'] = ['simulation-poll.n_intervals']
+        body['state'] = [dict(state, value=job) if state['id'] == 'simulation-job' else state for state in body['state']]
+        deadline = time.monotonic() + 60
+        while response['simulation-poll']['disabled'] is False:
+            assert time.monotonic() < deadline, 'the background simulation never finished'
+            time.sleep(0.1)
+            response = json.loads(client.post('/dash/portfolioProjection/_dash-update-component', json=body).data)['response']
+
+        assert 'Your portfolio is now worth' in json.dumps(response['charts-div']['children'])
+    finally:
+        if jobs._pool is not None:
+            jobs._pool.shutdown(cancel_futures=True)
@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+from webapp import portfolioEngine, taxLedger
+
+
+def reference_gains(startAmount, timeline, growth, steps_per_year=52):
+    '''
+        (yearly gains, cost of the lots still open) from a plain list of [quantity, cost] lots per asset,
+        sold one lot at a time, oldest first. Prices come from the growth schedule itself.
+    '''
+
+    sold = np.diff(timeline.total_sold, axis=0, prepend=0)
+    bought = np.diff(timeline.total_bought, axis=0, prepend=0)
+    price = np.cumprod(1 + growth, axis=0)
+    steps, assets = sold.shape
+
+    gains = np.zeros((steps, assets))
+    openCost = np.zeros(assets)
+    for asset in range(assets):
+        lots = [[startAmount[asset], startAmount[asset]]]
+        for step in range(steps):
+            quantity, basis = sold[step, asset] / price[step, asset], 0.0
+            while quantity > 1e-12 and lots:
+                lotQuantity, lotCost = lots[0]
+                taken = min(quantity, lotQuantity)
+                basis += lotCost * taken / lotQuantity
+                if taken >= lotQuantity - 1e-15:
+                    lots.pop(0)
+                else:
+                    lots[0] = [lotQuantity - taken, lotCost * (lotQuantity - taken) / lotQuantity]
+                quantity -= taken
+            gains[step, asset] = sold[step, asset] - basis
+            if bought[step, asset] > 0:
+                lots.append([bought[step, asset] / price[step, asset], bought[step, asset]])
+        openCost[asset] = sum(cost for _, cost in lots)
+
+    return np.add.reduceat(gains, np.arange(0, steps, steps_per_year), axis=0), openCost
+
+
+@pytest.mark.parametrize('years', [1, 10])
+def test_fifo_matches_lot_by_lot_reference(investments, years):
+    inputs = portfolioEngine.prepare_portfolio(investments, 10000, years * 52)
+    timeline, _ = portfolioEngine.simulate_timeline(inputs, 500 * 12 / 52, backend='numpy')
+    rules = taxLedger.tax_rules([(0, 10), (5000, 20), (20000, 30)], 2000)
+
+    result = taxLedger.tax_ledger(inputs.start_amount, timeline, rules)
+    yearlyGains, openCost = reference_gains(inputs.start_amount, timeline, portfolioEngine.growth_schedule(inputs))
+
+    scale = max(np.abs(yearlyGains).max(), 1)
+    np.testing.assert_allclose(result.yearly_gains, yearlyGains, rtol=0, atol=1e-9 * scale)
+    np.testing.assert_allclose(result.lots.cost.sum(axis=1), openCost, rtol=1e-9)
+    np.testing.assert_allclose(result.taxes_paid.sum(), taxLedger.yearly_taxes(yearlyGains, rules).sum(), rtol=1e-9)
+
+
+def test_gains_add_up(investments):
+    # Realized plus unrealized gains are everything the portfolio earned on top of what was put in
+    inputs = portfolioEngine.prepare_portfolio(investments, 10000, 8 * 52)
+    timeline, _ = portfolioEngine.simulate_timeline(inputs, 500 * 12 / 52, backend='numpy')
+    result = taxLedger.tax_ledger(inputs.start_amount, timeline)
+
+    earned = timeline.current_amount[-1] + timeline.total_sold[-1] - timeline.total_bought[-1] - inputs.start_amount
+    np.testing.assert_allclose(result.realized_gains + result.unrealized_gains, earned, rtol=1e-9, atol=1e-6)
+
+
+def test_brackets_exemption_and_carried_losses():
+    rules = taxLedger.tax_rules([(0, 10), (100, 20)], 50)
+    taxes = taxLedger.yearly_taxes(np.array([[100., -20.], [-300., 0.], [500., 0.], [400., 0.]]), rules)
+
+    # 80 - 50 exempt at 10%; a loss carried; 500 - 300 carried - 50 exempt and 400 - 50 exempt, over both brackets
+    np.testing.assert_allclose(taxes, [[3, 0], [0, 0], [20, 0], [60, 0]])
+
+
+def test_negative_rules_are_rejected():
+    with pytest.raises(ValueError):
+        taxLedger.tax_rules([(0, -5)])
+    with pytest.raises(ValueError):
+        taxLedger.tax_rules([(0, 15)], exemption=-1)
+
+
+def test_run_without_steps():
+    empty = np.zeros((0, 3))
+    timeline = portfolioEngine.EngineResult(*(empty for _ in portfolioEngine.EngineResult._fields))
+    start = np.array([100., 50., 0.])
+    result = taxLedger.tax_ledger(start, timeline, taxLedger.tax_rules([(0, 10), (1000, 20)], 500))
+
+    assert result.yearly_gains.shape == result.yearly_taxes.shape == (0, 3)
+    for field in ['realized_gains', 'taxes_paid', 'unrealized_gains']:
+        np.testing.assert_array_equal(getattr(result, field), np.zeros(3))
+    np.testing.assert_array_equal(result.lots.quantity[:, 0], start)
+    np.testing.assert_array_equal(result.lots.cost.sum(axis=1), start)
+    np.testing.assert_array_equal(result.lots.head, np.zeros(3))
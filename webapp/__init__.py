@@ -1,10 +1,36 @@
 from flask import Flask
 import logging
+import os
+import tempfile
 
 application = Flask(__name__, static_url_path='/static')
 application.secret_key = 'your_secret_key'
 application.logger.setLevel(logging.INFO)
 
+# Simulation results shared by every worker on this host (set to None to keep the cache in-process only)
+application.config['SIMULATION_CACHE_DIR'] = os.path.join(tempfile.gettempdir(), 'portfolio_webapp_cache')
+# Status and results of background simulations (set to None to calculate everything within the request)
+application.config['SIMULATION_JOBS_DIR'] = os.path.join(tempfile.gettempdir(), 'portfolio_webapp_jobs')
+# Sessions (investments included) shared by every worker on this host, the cookie only holds their id
+# (set to None to keep them in-process only, lost on restart)
+application.config['SESSION_DB_PATH'] = os.path.join(tempfile.gettempdir(), 'portfolio_webapp_sessions.sqlite')
+
+# Profit taxes on what the rebalancer sells, e.g. [(0, 15)]: ((yearly realized gains from which it applies, rate in %), ...)
+# and the yearly gains that aren't taxed. They're reported next to the run, never deducted from it (None leaves taxes out)
+application.config['TAX_BRACKETS'] = None
+application.config['TAX_EXEMPTION'] = 0
+
+# Simulation engine: 'numpy' gives the reference results bit for bit. 'numba' (requirements-optional.txt) is faster,
+# and matches them to float rounding only; 'auto' uses it when it's installed
+application.config['ENGINE_BACKEND'] = 'numpy'
+
+# Callback and route metrics on /metrics (Prometheus text), served to local clients only unless this is True
+application.config['METRICS_PUBLIC'] = False
+# Set to a folder to keep cProfile dumps of a sample of the slow callbacks and requests
+application.config['METRICS_PROFILE_DIR'] = None
+application.config['METRICS_PROFILE_SAMPLE_RATE'] = 0.1
+application.config['METRICS_PROFILE_SLOW_SECONDS'] = 2.0
+
 
 # needs to come after app instance is created
 from webapp import routes
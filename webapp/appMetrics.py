@@ -0,0 +1,378 @@
+'''
+    Latency metrics for the Dash callbacks and the Flask routes, served as Prometheus text on /metrics.
+
+    Hooks:
+        - instrument_dash(dash_app, name):       times the requests to dash_app's callback endpoint, returns
+                                                  the decorator its callbacks are registered with
+        - instrument_routes(application, module): wraps the Flask views defined in that module
+        - stage(name):                            times a stage of the work, as a decorator or a `with` block
+
+    Recorded:
+        - callback_latency_seconds{app, callback}              whole callback, Dash's serialization included
+        - callback_payload_bytes{app, callback}                size of the JSON response
+        - callback_errors_total{app, callback, error}          exceptions raised (PreventUpdate included)
+        - http_request_latency_seconds{endpoint, method, status}
+        - http_response_bytes{endpoint, method, status}        responses of unknown length (streamed) aren't counted
+        - stage_seconds{stage, handler}                        time spent in each stage during one callback or request;
+                                                               a stage nested in another only counts for itself, and
+                                                               handler is 'none' outside of one (benchmarks, scripts)
+
+    Metrics live in the process that records them: each gunicorn worker has its own (scrape or sum them
+    per worker), and simulations running on simulationJobs' process pool don't show up in stage_seconds.
+
+    Slow requests can be profiled: with application.config['METRICS_PROFILE_DIR'] set, a sampled fraction
+    (METRICS_PROFILE_SAMPLE_RATE) of callbacks and requests runs under cProfile, and the ones slower than
+    METRICS_PROFILE_SLOW_SECONDS are dumped there as .prof files (pstats, snakeviz...), the newest
+    METRICS_PROFILE_KEEP of them are kept.
+'''
+
+import bisect
+import contextlib
+import cProfile
+import functools
+import logging
+import os
+import random
+import re
+import threading
+import time
+import uuid
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Stages of a projection, from the growth draws to the bytes sent
+RANDOM_GENERATION = 'random_generation'
+REBALANCE_LOOP = 'rebalance_loop'
+FIGURE_BUILD = 'figure_build'
+SERIALIZATION = 'serialization'
+STAGES = (RANDOM_GENERATION, REBALANCE_LOOP, FIGURE_BUILD, SERIALIZATION)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60) # seconds
+SIZE_BUCKETS = tuple(4**k for k in range(5, 14)) # bytes, 1KB to 64MB
+
+DEFAULT_PROFILE_SAMPLE_RATE = 0.1
+DEFAULT_PROFILE_SLOW_SECONDS = 2.0
+DEFAULT_PROFILE_KEEP = 100
+
+LOCAL_ADDRESSES = ('127.0.0.1', '::1')
+
+
+# ---------------------------------------- metric types
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[label]) for label in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = sorted(self._values.items())
+        lines.extend(f'{self.name}{_labels(self.labels, key)} {value}' for key, value in values)
+        return lines
+
+
+class Histogram:
+
+    def __init__(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.buckets = tuple(float(bound) for bound in buckets)
+        # label values -> [count per bucket (the last one is +Inf), sum, count]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[label]) for label in self.labels)
+        index = bisect.bisect_left(self.buckets, value) # bucket bounds are inclusive
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._series.items())
+
+        for key, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucketCount in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucketCount
+                bucketLabel = 'le="+Inf"' if bound == float('inf') else f'le="{bound!r}"'
+                lines.append(f'{self.name}_bucket{_labels(self.labels, key, bucketLabel)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labels, key)} {total!r}')
+            lines.append(f'{self.name}_count{_labels(self.labels, key)} {count}')
+        return lines
+
+
+CALLBACK_LATENCY = Histogram('callback_latency_seconds', 'Dash callback latency, serialization included.', ['app', 'callback'])
+CALLBACK_PAYLOAD = Histogram('callback_payload_bytes', 'Size of the Dash callback responses.', ['app', 'callback'], SIZE_BUCKETS)
+CALLBACK_ERRORS = Counter('callback_errors_total', 'Exceptions raised by Dash callbacks.', ['app', 'callback', 'error'])
+HTTP_LATENCY = Histogram('http_request_latency_seconds', 'Flask route latency.', ['endpoint', 'method', 'status'])
+HTTP_BYTES = Histogram('http_response_bytes', 'Size of the Flask route responses.', ['endpoint', 'method', 'status'], SIZE_BUCKETS)
+STAGE_SECONDS = Histogram('stage_seconds', 'Time spent in each stage during one callback or request.', ['stage', 'handler'])
+PROFILES_WRITTEN = Counter('slow_profiles_total', 'Profiles of slow callbacks and requests written to disk.', ['handler'])
+
+METRICS = [CALLBACK_LATENCY, CALLBACK_PAYLOAD, CALLBACK_ERRORS, HTTP_LATENCY, HTTP_BYTES, STAGE_SECONDS, PROFILES_WRITTEN]
+
+
+def render():
+    ''' Every metric in the Prometheus text exposition format. '''
+    return '\n'.join(line for metric in METRICS for line in metric.render()) + '\n'
+
+# ---------------------------------------- stages
+
+_local = threading.local()
+
+
+class stage(contextlib.ContextDecorator):
+    '''
+        Times a stage of the work:
+            @appMetrics.stage(appMetrics.FIGURE_BUILD)
+            def build_chart(...):
+
+            with appMetrics.stage(appMetrics.SERIALIZATION):
+                ...
+        The state lives on the thread, the same instance is safe to reenter and to share between threads.
+    '''
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        if not hasattr(_local, 'stack'):
+            _local.stack, _local.totals, _local.handler = [], {}, None
+        _local.stack.append([self.name, time.perf_counter(), 0.0]) # name, start, time spent in nested stages
+        return self
+
+    def __exit__(self, *exc_info):
+        name, start, nested = _local.stack.pop()
+        elapsed = time.perf_counter() - start
+        if _local.stack:
+            _local.stack[-1][2] += elapsed
+        _add_stage_time(name, elapsed - nested)
+
+        # Outside of a callback or request, every outermost stage is an observation of its own
+        if not _local.stack and _local.handler is None:
+            _flush_stages('none')
+        return False
+
+
+def _add_stage_time(name, seconds):
+    _local.totals[name] = _local.totals.get(name, 0.0) + seconds
+
+
+def _flush_stages(handler):
+    for name, seconds in _local.totals.items():
+        STAGE_SECONDS.observe(seconds, stage=name, handler=handler)
+    _local.totals = {}
+
+
+@contextlib.contextmanager
+def _handling(handler, totals=None):
+    '''
+        Collects the stages run within one callback or request, observed together at the end;
+        or into `totals` ({stage: seconds}), for the caller to add to them and observe them later.
+    '''
+
+    if not hasattr(_local, 'stack'):
+        _local.stack, _local.totals, _local.handler = [], {}, None
+    previous = _local.stack, _local.totals, _local.handler
+    _local.stack, _local.totals, _local.handler = [], {} if totals is None else totals, handler
+    try:
+        yield
+    finally:
+        if totals is None:
+            _flush_stages(handler)
+        _local.stack, _local.totals, _local.handler = previous
+
+# ---------------------------------------- slow request profiles
+
+_profile_lock = threading.Lock() # one profile at a time: profilers don't stack (and slow everything down)
+
+
+def _start_profile(config):
+    directory = config.get('METRICS_PROFILE_DIR')
+    if not directory or random.random() >= config.get('METRICS_PROFILE_SAMPLE_RATE', DEFAULT_PROFILE_SAMPLE_RATE):
+        return None
+    if not _profile_lock.acquire(blocking=False):
+        return None
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError: # another profiler (a debugger, a test runner...) is already active
+        _profile_lock.release()
+        return None
+    return profiler
+
+
+def _stop_profile(profiler, config, handler, seconds):
+    try:
+        profiler.disable()
+        if seconds < config.get('METRICS_PROFILE_SLOW_SECONDS', DEFAULT_PROFILE_SLOW_SECONDS):
+            return
+
+        directory = config['METRICS_PROFILE_DIR']
+        os.makedirs(directory, exist_ok=True)
+        name = re.sub(r'[^A-Za-z0-9_.-]+', '_', handler)
+        profiler.dump_stats(os.path.join(directory, f'{time.strftime("%Y%m%d-%H%M%S")}-{name}-{seconds * 1000:.0f}ms-{uuid.uuid4().hex[:8]}.prof'))
+        PROFILES_WRITTEN.inc(handler=handler)
+        _prune_profiles(directory, config.get('METRICS_PROFILE_KEEP', DEFAULT_PROFILE_KEEP))
+    except OSError:
+        logging.exception('Could not write the profile of a slow request')
+    finally:
+        _profile_lock.release()
+
+
+def _prune_profiles(directory, keep):
+    paths = sorted((entry.path for entry in os.scandir(directory) if entry.name.endswith('.prof')), key=os.path.getmtime)
+    for path in paths[:max(len(paths) - keep, 0)]:
+        with contextlib.suppress(OSError):
+            os.remove(path)
+
+
+def _timed(handler, config, func, args, kwargs, totals=None):
+    '''
+        (result, seconds, error) of func(*args, **kwargs), its stages observed under `handler` (or
+        collected into totals, see _handling). Exceptions are returned, for the caller to record them before raising.
+    '''
+
+    profiler = _start_profile(config)
+    start = time.perf_counter()
+    result, error = None, None
+    with _handling(handler, totals):
+        try:
+            result = func(*args, **kwargs)
+        except Exception as exception:
+            error = exception
+    seconds = time.perf_counter() - start
+
+    if profiler is not None:
+        _stop_profile(profiler, config, handler, seconds)
+    return result, seconds, error
+
+# ---------------------------------------- hooks
+
+def instrument_dash(dash_app, name):
+    '''
+        Times every request to dash_app's callback endpoint with Flask hooks on its server (Dash's
+        serialization included), and returns the decorator that names them, to put under each callback:
+            timed_callback = appMetrics.instrument_dash(dash_app, 'portfolioProjection')
+
+            @dash_app.callback(...)
+            @timed_callback
+            def update_chart(...):
+        Call it before the app serves its first request. Clientside callbacks run in the browser and are left alone.
+    '''
+
+    from flask import g, has_request_context, request
+
+    server = dash_app.server
+    path = dash_app.config.routes_pathname_prefix + '_dash-update-component'
+
+    @server.before_request
+    def start_callback():
+        if request.path == path:
+            # The decorated callback fills in its name, its own time and its stages
+            g.callback_timing = {'start': time.perf_counter(), 'callback': 'unknown', 'seconds': None, 'stages': {}}
+
+    @server.after_request
+    def observe_callback(response):
+        timing = g.pop('callback_timing', None) if request.path == path else None
+        if timing is None:
+            return response
+
+        seconds = time.perf_counter() - timing['start']
+        callback_name = timing['callback']
+        CALLBACK_LATENCY.observe(seconds, app=name, callback=callback_name)
+        length = response.calculate_content_length()
+        if response.status_code == 200 and length is not None: # 204: nothing to update
+            CALLBACK_PAYLOAD.observe(length, app=name, callback=callback_name)
+
+        if timing['seconds'] is not None:
+            # What the callback didn't spend itself is Dash validating and serializing what it returned
+            stages = timing['stages']
+            stages[SERIALIZATION] = stages.get(SERIALIZATION, 0.0) + max(seconds - timing['seconds'], 0.0)
+            for stage_name, stage_seconds in stages.items():
+                STAGE_SECONDS.observe(stage_seconds, stage=stage_name, handler=f'{name}.{callback_name}')
+        return response
+
+    def timed_callback(func):
+        callback_name = func.__name__
+        handler = f'{name}.{callback_name}'
+
+        @functools.wraps(func)
+        def timed_function(*args, **kwargs):
+            # Outside of a callback request (a direct call), its stages are observed right away
+            timing = g.get('callback_timing') if has_request_context() else None
+            result, seconds, error = _timed(handler, server.config, func, args, kwargs, timing['stages'] if timing else None)
+            if timing is not None:
+                timing.update(callback=callback_name, seconds=seconds)
+
+            if error is not None:
+                CALLBACK_ERRORS.inc(app=name, callback=callback_name, error=type(error).__name__)
+                raise error
+            return result
+
+        return timed_function
+
+    return timed_callback
+
+
+def instrument_routes(application, module_name):
+    ''' Wraps every view function of `application` defined in module_name (call it after the routes are declared). '''
+
+    for endpoint, view in list(application.view_functions.items()):
+        if getattr(view, '__module__', None) == module_name and not getattr(view, 'instrumented', False):
+            application.view_functions[endpoint] = _timed_view(application, endpoint, view)
+
+
+def _timed_view(application, endpoint, view):
+    from flask import request
+
+    def respond(*args, **kwargs):
+        return application.make_response(view(*args, **kwargs))
+
+    @functools.wraps(view)
+    def timed_view(*args, **kwargs):
+        response, seconds, error = _timed(endpoint, application.config, respond, args, kwargs)
+
+        status = getattr(error, 'code', 500) if error is not None else response.status_code
+        HTTP_LATENCY.observe(seconds, endpoint=endpoint, method=request.method, status=status)
+        if error is not None:
+            raise error
+
+        length = response.calculate_content_length()
+        if length is not None:
+            HTTP_BYTES.observe(length, endpoint=endpoint, method=request.method, status=status)
+        return response
+
+    timed_view.instrumented = True
+    return timed_view
@@ -1,4 +1,6 @@
 from webapp import application
+from webapp import appMetrics
+from webapp import figurePayloads
 
 import dash
 import dash_bootstrap_components as dbc
@@ -9,6 +11,9 @@ import numpy as np
 import pandas as pd
 
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP], server=application, routes_pathname_prefix='/dash/compoundCalc/')
+figurePayloads.register_decoder(app)
+# Latency and payload metrics of its callbacks (each one registered with @timed_callback), see /metrics
+timed_callback = appMetrics.instrument_dash(app, 'compoundInterest')
 
 
 app.layout = html.Div(style={
@@ -81,7 +86,7 @@ app.layout = html.Div(style={
         'marginBottom': '30px',
         'padding': '20px'
     }, children=[
-        dcc.Graph(id='compound-plot')
+        figurePayloads.typed_graph('compound-plot', go.Figure())
     ]),
     
     dbc.Row([
@@ -91,77 +96,93 @@ app.layout = html.Div(style={
 ])
 
 
+# Comparison curves of the chart, as (annual yield in %, legend name). They are rows of the same
+# arrays as the user's own curve, each extra one costs next to nothing
+BENCHMARK_YIELDS = [
+    (2, 'Average Treasury 3-month yield (2%)'),
+    (12.39, 'Average Stock market yield, last 10 years (12.39%)'),
+    (9.75, 'Average Stock market yield, last 20 years (9.75%)')
+]
+COMPARISON_YIELD = 12.39 # the final balance is compared with this benchmark
+
+CURVE_COLUMNS = ('Initial Balance', 'Interest', 'Inflation', 'Monthly Investment', 'Final Balance')
+
+
+def compound_interest_curves(initialContribution,
+                             monthlyContributions,
+                             yieldRates,
+                             investmentTime,
+                             yearlyGainOnContributions,
+                             expectedInflation):
+    '''
+        Month by month table of every yield rate at once: {column: (rates, months) array} for CURVE_COLUMNS
+        (rounded to cents), plus 'Months' and 'Current Year'.
+        The months are still a loop, each of them computes every rate in one go.
+    '''
+
+    # Convert numbers from Human Readable to decimal, annual rates to monthly
+    # (Python's pow for the rates too, like the month by month table always did)
+    monthly_rate = np.array([(1 + yieldRate / 100) ** (1/12) - 1 for yieldRate in yieldRates])
+    monthly_contrib_growth = (1 + yearlyGainOnContributions / 100) ** (1/12) - 1
+    monthly_inflation = (1 + expectedInflation / 100) ** (1/12) - 1
+    months = investmentTime * 12 # converting years to months
+
+    # Contributions increase by productivity gain and decrease by inflation every month after the second,
+    # the same for every rate
+    factors = np.full(months, 1 + monthly_contrib_growth - monthly_inflation)
+    factors[:2] = monthlyContributions, 1
+    contributions = np.cumprod(factors)
+
+    # ------ Row by row calculation, every rate at once
+    balances = np.empty((monthly_rate.shape[0], months + 1))
+    balances[:, 0] = initialContribution
+    for month, contribution in enumerate(contributions):
+        balance = balances[:, month]
+        balances[:, month + 1] = balance + balance * monthly_rate - balance * monthly_inflation + contribution
+
+    starting = balances[:, :-1]
+    curves = {
+        'Initial Balance': starting,
+        'Interest': starting * monthly_rate[:, np.newaxis],
+        'Inflation': starting * monthly_inflation,
+        'Monthly Investment': np.broadcast_to(contributions, starting.shape),
+        'Final Balance': balances[:, 1:]
+    }
+    curves = {column: np.round(values, 2) for column, values in curves.items()}
+
+    curves['Months'] = np.arange(1, months + 1)
+    curves['Current Year'] = curves['Months'] // 12
+    return curves
+
+
 def compound_interest_over_time(initialContribution,
                                 monthlyContributions,
                                 yieldRate,
                                 investmentTime,
                                 yearlyGainOnContributions,
                                 expectedInflation):
-    
-        # Convert number from Human Readable to decimal
-        yieldRate /= 100
-        yearlyGainOnContributions /= 100
-        expectedInflation /= 100
-        
-        # Convert annual rate to monthly
-        monthly_rate = (1 + yieldRate) ** (1/12) - 1
-        monthly_contrib_growth = (1 + yearlyGainOnContributions) ** (1/12) - 1
-        monthly_inflation = (1 + expectedInflation) ** (1/12) - 1
-
-        # ------ Initializing columns
-        current_balance = [initialContribution]
-        current_interest = [initialContribution * monthly_rate]
-        current_inflation = [initialContribution * monthly_inflation]
-        current_contribution = [monthlyContributions]
-        final_balance = [current_balance[0] + current_interest[0] - current_inflation[0] + current_contribution[0]]
-
-        investmentTime *= 12 # converting years to months    
-        for _ in range(1, investmentTime):
-            # ------ Row by row calculation
-            local_balance = final_balance[-1]
-            local_interest = local_balance * monthly_rate
-            local_inflation = local_balance * monthly_inflation
-            local_contribution = monthlyContributions
-            local_result = local_balance + local_interest - local_inflation + local_contribution
-
-            # ------ Appending values to columns
-            current_balance.append(local_balance)
-            current_interest.append(local_interest)
-            current_inflation.append(local_inflation)
-            current_contribution.append(local_contribution)
-            final_balance.append(local_result)
-
-            # Alter the monthly contribution for the next month
-            # Increase by productivity gain
-            # Decrease by inflation
-            monthlyContributions *= (1 + monthly_contrib_growth - monthly_inflation)
-        
-        df = pd.DataFrame({            
-            'Initial Balance': current_balance,
-            'Interest': current_interest,
-            'Inflation': current_inflation,
-            'Monthly Investment': current_contribution,
-            'Final Balance': final_balance
-                            })
-        df = df.round(2)
-        
-        df['Months'] = np.arange(1, investmentTime + 1)
-        df['Current Year'] = df['Months'] // 12
-        return df
-
-def generate_scatter_trace(df, name, hover_name):
+    '''
+        Month by month table of a single yield rate, as a DataFrame (see compound_interest_curves).
+    '''
+
+    curves = compound_interest_curves(initialContribution, monthlyContributions, [yieldRate], investmentTime,
+                                      yearlyGainOnContributions, expectedInflation)
+    return pd.DataFrame({column: curves[column][0] if column in CURVE_COLUMNS else curves[column]
+                         for column in CURVE_COLUMNS + ('Months', 'Current Year')})
+
+def generate_scatter_trace(months, balances, currentYear, name, hover_name):
     return go.Scatter(
-        x=df['Months'], 
-        y=df['Final Balance'], 
+        x=months, 
+        y=balances, 
         mode='lines', 
         name=name,
-        text=df['Current Year'],
-        hovertemplate=f'Month: %{{x}}<br>{hover_name}: $%{{y:,.2f}}<br>Current Year: %{{text}}'
+        customdata=currentYear,
+        hovertemplate=f'Month: %{{x}}<br>{hover_name}: $%{{y:,.2f}}<br>Current Year: %{{customdata}}'
     )
 
 
 @app.callback(
-    [Output('compound-plot', 'figure'),
+    [Output(figurePayloads.figure_id('compound-plot'), 'data'),
      Output('final-balance-display', 'children'),
      Output('final-balance-display', 'style'),
      Output('comparison-display', 'children'),
@@ -175,46 +196,29 @@ def generate_scatter_trace(df, name, hover_name):
         Input('expectedInflation-input', 'value')
     ]
 )
+@timed_callback
 def update_values(investmentTime, yieldRate, initialContribution, monthlyContributions, yearlyGainOnContributions, expectedInflation):
-    # Calculate dataframes
-    df = compound_interest_over_time(initialContribution,
-                                     monthlyContributions,
-                                     yieldRate,
-                                     investmentTime,
-                                     yearlyGainOnContributions,
-                                     expectedInflation)
-    df_Treasury = compound_interest_over_time(initialContribution,
-                                     monthlyContributions,
-                                     2,
-                                     investmentTime,
-                                     yearlyGainOnContributions,
-                                     expectedInflation)
-    df_stocks10 = compound_interest_over_time(initialContribution,
-                                     monthlyContributions,
-                                     12.39,
-                                     investmentTime,
-                                     yearlyGainOnContributions,
-                                     expectedInflation)
-    df_stocks20 = compound_interest_over_time(initialContribution,
-                                     monthlyContributions,
-                                     9.75,
-                                     investmentTime,
-                                     yearlyGainOnContributions,
-                                     expectedInflation)
-    
-    # Create traces
-    traces = [
-        generate_scatter_trace(df, 'Your Investment', 'Final Balance'),
-        generate_scatter_trace(df_Treasury, 'Average Treasury 3-month yield (2%)', 'Final Balance'),
-        generate_scatter_trace(df_stocks10, 'Average Stock market yield, last 10 years (12.39%)', 'Final Balance'),
-        generate_scatter_trace(df_stocks20, 'Average Stock market yield, last 20 years (9.75%)', 'Final Balance')
-    ]
+    # The user's curve and every benchmark, from one call
+    yields = [yieldRate] + [benchmark for benchmark, _ in BENCHMARK_YIELDS]
+    curves = compound_interest_curves(initialContribution,
+                                      monthlyContributions,
+                                      yields,
+                                      investmentTime,
+                                      yearlyGainOnContributions,
+                                      expectedInflation)
+    balances = curves['Final Balance']
     
-    layout = go.Layout(title="Compound Interest Over Time", xaxis=dict(title="Time in Months"), yaxis=dict(title="Amount"))
+    with appMetrics.stage(appMetrics.FIGURE_BUILD):
+        # Create traces
+        names = ['Your Investment'] + [name for _, name in BENCHMARK_YIELDS]
+        traces = [generate_scatter_trace(curves['Months'], balances[row], curves['Current Year'], name, 'Final Balance')
+                  for row, name in enumerate(names)]
+        layout = go.Layout(title="Compound Interest Over Time", xaxis=dict(title="Time in Months"), yaxis=dict(title="Amount"))
+        figure = go.Figure(data=traces, layout=layout)
     
     # Display values
-    final_balance = df['Final Balance'].iloc[-1]
-    stock_balance = df_stocks10['Final Balance'].iloc[-1]
+    final_balance = balances[0, -1]
+    stock_balance = balances[yields.index(COMPARISON_YIELD, 1), -1]
     difference = final_balance - stock_balance
 
     final_balance_content = f"Your Final Balance: ${final_balance:,.2f}"
@@ -227,7 +231,7 @@ def update_values(investmentTime, yieldRate, initialContribution, monthlyContrib
         'color': 'green' if difference >= 0 else 'red'
     }
 
-    return {'data': traces, 'layout': layout}, final_balance_content, final_balance_style, comparison_content, comparison_style
+    return figurePayloads.encode_figure(figure), final_balance_content, final_balance_style, comparison_content, comparison_style
 
 if __name__ == '__main__':
     application.run_server(debug=False)
\ No newline at end of file
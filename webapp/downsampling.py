@@ -0,0 +1,116 @@
+'''
+    Downsampling for the projection line charts.
+
+    A 40 year projection has 2,080 weekly points per asset, which is far more than a chart
+    a few hundred pixels wide can show. Two tools keep callback responses small:
+        - multi-resolution views: weekly, monthly and yearly (end of period) versions of a timeline
+        - LTTB (largest-triangle-three-buckets): keeps the visual shape of a line with fewer points
+'''
+
+import numpy as np
+
+
+RESOLUTIONS = ('daily', 'weekly', 'monthly', 'yearly')
+PERIODS_PER_YEAR = {'daily': 365, 'weekly': 52, 'monthly': 12, 'yearly': 1}
+
+
+def period_ends(weeks, resolution, steps_per_year=52):
+    '''
+        Indexes of the last week of every month/year in `weeks` (1-based week numbers).
+        The last week is always kept, so the view ends where the simulation ends.
+        Daily timelines pass steps_per_year=365, `weeks` are then day numbers.
+    '''
+
+    if resolution not in PERIODS_PER_YEAR:
+        raise ValueError(f"Unknown resolution '{resolution}', available: {', '.join(RESOLUTIONS)}")
+
+    weeks = np.asarray(weeks)
+    if PERIODS_PER_YEAR[resolution] >= steps_per_year or len(weeks) == 0:
+        return np.arange(len(weeks)) # can't be finer than the simulation itself
+
+    period = (weeks - 1) * PERIODS_PER_YEAR[resolution] // steps_per_year
+    return np.append(np.flatnonzero(np.diff(period)), len(weeks) - 1)
+
+
+def lttb_indices(x, y, threshold):
+    '''
+        Largest-triangle-three-buckets over every column of `y` at once.
+
+            x: (points,) shared by every series
+            y: (points,) or (points, series)
+
+        Returns the indexes of the points to keep, (threshold,) or (threshold, series).
+        The first and last points are always kept.
+    '''
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    single = y.ndim == 1
+    if single:
+        y = y[:, np.newaxis]
+
+    points, series = y.shape
+    if threshold >= points or threshold < 3:
+        indices = np.tile(np.arange(points)[:, np.newaxis], (1, series))
+        return indices[:, 0] if single else indices
+
+    # Every bucket but the first and last one (which hold a single point each)
+    edges = np.linspace(1, points - 1, threshold - 1).astype(int)
+    columns = np.arange(series)
+
+    indices = np.empty((threshold, series), dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = points - 1
+
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+
+        # The third vertex is the average of the next bucket
+        nextStart, nextEnd = end, (edges[bucket + 2] if bucket + 2 < len(edges) else points)
+        avgX = x[nextStart:nextEnd].mean()
+        avgY = y[nextStart:nextEnd].mean(axis=0)
+
+        previous = indices[bucket]
+        prevX = x[previous]
+        prevY = y[previous, columns]
+
+        # Twice the triangle area, for every candidate of the bucket and every series
+        areas = np.abs(
+            (prevX - avgX) * (y[start:end] - prevY)
+            - (prevX - x[start:end, np.newaxis]) * (avgY - prevY)
+        )
+        indices[bucket + 1] = start + areas.argmax(axis=0)
+
+    return indices[:, 0] if single else indices
+
+
+def resample(weeks, values, budget, resolution='weekly', week_range=None, steps_per_year=52):
+    '''
+        Picks what to draw for `values` ((weeks,) or (weeks, series)) within `budget` points per trace.
+
+            resolution:      one of RESOLUTIONS, the view to start from
+            week_range:      (first, last) week numbers, only that window is drawn (zoomed charts)
+            steps_per_year:  365 when `weeks` are days
+
+        Returns (x, y), with one column per series when `values` is 2-D. x has a column
+        per series too, because LTTB keeps different points for each of them.
+    '''
+
+    weeks = np.asarray(weeks)
+    values = np.asarray(values)
+
+    if week_range is not None:
+        inRange = (weeks >= week_range[0]) & (weeks <= week_range[1])
+        weeks, values = weeks[inRange], values[inRange]
+
+    view = period_ends(weeks, resolution, steps_per_year)
+    weeks, values = weeks[view], values[view]
+
+    if len(weeks) <= budget:
+        x = weeks if values.ndim == 1 else np.tile(weeks[:, np.newaxis], (1, values.shape[1]))
+        return x, values
+
+    indices = lttb_indices(weeks, values, budget)
+    if values.ndim == 1:
+        return weeks[indices], values[indices]
+    return weeks[indices], np.take_along_axis(values, indices, axis=0)
@@ -1,4 +1,5 @@
 from webapp import application
+from webapp import appMetrics
 
 from dash import dcc, html, Dash, Output, Input, State, no_update
 
@@ -38,6 +39,7 @@ def preprocess_labels(df, column_name):
 
 df = preprocess_labels(df, 'Label')
 
+@appMetrics.stage(appMetrics.FIGURE_BUILD)
 def create_sunburst(df):
     # df = data_store['DATA_CACHE'] # It seems we never need to call this one
 
@@ -96,6 +98,8 @@ def create_sunburst(df):
 
 # Create your Dash app
 app = Dash(__name__, server=application, url_base_pathname='/dash/educationJourney/', external_stylesheets=[dbc.themes.BOOTSTRAP])
+# Latency and payload metrics of its callbacks (each one registered with @timed_callback), see /metrics
+timed_callback = appMetrics.instrument_dash(app, 'educationJourney')
 
 # checklist to filter data between institutions
 checklist = dcc.Checklist(
@@ -173,6 +177,7 @@ app.layout = html.Div([
     Output('sunburst-chart', 'figure'),
     [Input('institution-checklist', 'value')]  # Input from the checklist
 )
+@timed_callback
 def update_chart(selected_institutions):
     logging.info("update_chart(selected_institutions) was just called...")
     # Filter the DataFrame based on selected institutions
@@ -187,6 +192,7 @@ def update_chart(selected_institutions):
     Output('store-url', 'data'),  # Update the store instead of the URL directly
     [Input('sunburst-chart', 'clickData')]
 )
+@timed_callback
 def store_url(clickData):
     if clickData:
         # Extracting the clicked part
@@ -216,6 +222,7 @@ app.clientside_callback(
     [Input('toggle-button', 'n_clicks')],
     [State('checklist-div', 'style')]
 )
+@timed_callback
 def toggle_checklist_visibility(n_clicks, style):
     if n_clicks % 2 == 0:  # Toggle visibility on each click
         return {'display': 'none'}
@@ -228,6 +235,7 @@ def toggle_checklist_visibility(n_clicks, style):
     [Input('dropdown-label', 'n_clicks')],
     [State('dropdown-state', 'data')]
 )
+@timed_callback
 def toggle_dropdown_state(n_clicks, data):
     if n_clicks:
         data['expanded'] = not data['expanded']
@@ -0,0 +1,136 @@
+'''
+    Compact figure payloads for the Dash callbacks.
+
+    Plotly serializes trace data as JSON float lists, ~18 characters per value. Here, numeric
+    trace arrays travel as base64 typed arrays instead ({'dtype': 'f8', 'bdata': ...}), and
+    the whole response is encoded with orjson through plotly's own to_json_plotly.
+
+    The plotly.js bundled with our Dash version can't read typed array specs yet, so figures
+    go to the browser inside a dcc.Store, and a clientside callback turns them into
+    Float64Array/Int16Array... before handing them to the dcc.Graph next to it.
+
+        figurePayloads.typed_graph('my-chart', figure)   # instead of dcc.Graph(figure=figure)
+        figurePayloads.register_decoder(dash_app)        # once per Dash app
+'''
+
+import base64
+
+import numpy as np
+from dash import dcc, html
+from dash.dependencies import Input, Output, MATCH
+from plotly.io.json import to_json_plotly
+
+from webapp import appMetrics
+
+
+TYPED_ARRAYS = True # False sends plain JSON lists, handy when debugging payloads by eye
+
+GRAPH_TYPE = 'typed-graph'
+FIGURE_TYPE = 'typed-figure'
+
+# Smallest integer type first, weeks and years fit in int16
+INTEGER_DTYPES = (np.int8, np.int16, np.int32)
+
+DECODE_FIGURE_JS = '''
+function(figure) {
+    if (!figure) {
+        return window.dash_clientside.no_update;
+    }
+    const arrayTypes = {i1: Int8Array, i2: Int16Array, i4: Int32Array, f4: Float32Array, f8: Float64Array};
+    const decode = function(value) {
+        if (!value || typeof value !== 'object' || !(value.dtype in arrayTypes) || typeof value.bdata !== 'string') {
+            return value;
+        }
+        const raw = atob(value.bdata);
+        const bytes = new Uint8Array(raw.length);
+        for (let i = 0; i < raw.length; i++) {
+            bytes[i] = raw.charCodeAt(i);
+        }
+        return new arrayTypes[value.dtype](bytes.buffer);
+    };
+    const data = (figure.data || []).map(function(trace) {
+        const decoded = {};
+        for (const key in trace) {
+            decoded[key] = decode(trace[key]);
+        }
+        return decoded;
+    });
+    return Object.assign({}, figure, {data: data});
+}
+'''
+
+
+def encode_array(values):
+    '''
+        Numeric array as {'dtype', 'bdata'}, little-endian like every browser.
+        Anything else (strings, objects) is returned untouched.
+    '''
+
+    original, values = values, np.asarray(values)
+    if values.ndim != 1 or values.dtype.kind not in 'iufb':
+        return original
+
+    if values.dtype.kind == 'f':
+        values = values.astype('<f8' if values.dtype.itemsize > 4 else '<f4', copy=False)
+    else:
+        low, high = (int(values.min()), int(values.max())) if len(values) else (0, 0)
+        dtype = next((d for d in INTEGER_DTYPES if np.iinfo(d).min <= low and high <= np.iinfo(d).max), None)
+        if dtype is None: # doesn't fit int32, a float64 keeps it exact up to 2**53
+            values = values.astype('<f8')
+        else:
+            values = values.astype(np.dtype(dtype).newbyteorder('<'), copy=False)
+
+    code = {np.dtype('<f8'): 'f8', np.dtype('<f4'): 'f4', np.dtype('<i4'): 'i4', np.dtype('<i2'): 'i2', np.dtype('i1'): 'i1'}[values.dtype]
+    return {'dtype': code, 'bdata': base64.b64encode(np.ascontiguousarray(values).tobytes()).decode('ascii')}
+
+
+@appMetrics.stage(appMetrics.SERIALIZATION)
+def encode_figure(figure):
+    '''
+        go.Figure (or figure dict) as a plain dict, with every numeric trace array as a typed array.
+    '''
+
+    figure = figure.to_dict() if hasattr(figure, 'to_dict') else dict(figure)
+    if not TYPED_ARRAYS:
+        return figure
+
+    figure['data'] = [
+        {key: (encode_array(value) if isinstance(value, (np.ndarray, list, tuple)) and key != 'name' else value)
+         for key, value in trace.items()}
+        for trace in figure.get('data', [])
+    ]
+    return figure
+
+
+def typed_graph(graph_id, figure, **graph_kwargs):
+    '''
+        dcc.Graph whose figure arrives through a dcc.Store as typed arrays.
+        Update it with Output(figure_id(graph_id), 'data') and encode_figure(...).
+    '''
+
+    return html.Div([
+        dcc.Graph(id=graph_id_of(graph_id), **graph_kwargs),
+        dcc.Store(id=figure_id(graph_id), data=encode_figure(figure))
+    ])
+
+
+def graph_id_of(graph_id):
+    return {'type': GRAPH_TYPE, 'index': graph_id}
+
+
+def figure_id(graph_id):
+    return {'type': FIGURE_TYPE, 'index': graph_id}
+
+
+def register_decoder(dash_app):
+    dash_app.clientside_callback(
+        DECODE_FIGURE_JS,
+        Output({'type': GRAPH_TYPE, 'index': MATCH}, 'figure'),
+        Input({'type': FIGURE_TYPE, 'index': MATCH}, 'data')
+    )
+
+
+@appMetrics.stage(appMetrics.SERIALIZATION)
+def to_json(value):
+    # orjson when it's installed, the same encoder Dash uses for callback responses
+    return to_json_plotly(value, engine='auto')
@@ -0,0 +1,142 @@
+'''
+    Inflation for the Portfolio Projection's real (today's money) view.
+
+    The simulation always runs in nominal terms. A schedule gives one inflation rate per year, from:
+        - 'constant': the same rate every year
+        - 'yearly':   piecewise, "year: rate" pairs like "0: 6, 5: 4" (each rate holds until the next year listed)
+        - 'series':   an uploaded CSV with one rate per year
+
+    Its deflators (what a dollar of each step is worth at the start) are one cumulative product over
+    the steps, and turning a nominal timeline into a real one is a multiplication by them: the same
+    run gives both views.
+'''
+
+import base64
+import io
+
+import numpy as np
+import pandas as pd
+
+
+INFLATION_MODES = ('constant', 'yearly', 'series')
+MAX_SERIES_YEARS = 1000 # rows read from an uploaded series
+
+
+def parse_schedule(text):
+    '''
+        [(from year, rate in %), ...] from "year: rate" pairs separated by commas or semicolons.
+        Raises ValueError when it can't.
+    '''
+
+    points = []
+    for part in str(text or '').replace(';', ',').split(','):
+        if not part.strip():
+            continue
+        year, separator, rate = part.partition(':')
+        if not separator:
+            raise ValueError(f'"{part.strip()}" is not a "year: rate" pair')
+        try:
+            points.append((int(year), float(rate)))
+        except ValueError:
+            raise ValueError(f'"{part.strip()}" is not a "year: rate" pair') from None
+    if not points:
+        raise ValueError('The inflation schedule needs at least one "year: rate" pair')
+    if any(year < 0 for year, _ in points):
+        raise ValueError('Inflation schedule years start at 0')
+    return sorted(points)
+
+
+def read_series(contents):
+    '''
+        Yearly rates (%) from a dcc.Upload data URL of a CSV: the 'inflation' column when there's a header
+        with one, its last column otherwise. Raises ValueError when the file isn't a series of numbers.
+    '''
+
+    try:
+        _, encoded = contents.split(',', 1)
+        frame = pd.read_csv(io.BytesIO(base64.b64decode(encoded)), header=None, dtype=str, nrows=MAX_SERIES_YEARS + 1,
+                            skipinitialspace=True)
+    except (ValueError, pd.errors.ParserError, pd.errors.EmptyDataError):
+        raise ValueError('The inflation series must be a CSV file') from None
+
+    column = frame.columns[-1]
+    first_row = frame.iloc[0].str.strip().str.lower()
+    if pd.to_numeric(first_row, errors='coerce').isna().any(): # a header
+        if (first_row == 'inflation').any():
+            column = frame.columns[(first_row == 'inflation').to_numpy().argmax()]
+        frame = frame.iloc[1:]
+
+    rates = pd.to_numeric(frame[column].dropna(), errors='coerce')
+    if rates.empty or rates.isna().any():
+        raise ValueError('The inflation series must hold one rate (%) per year')
+    return rates.to_numpy(dtype=np.float64)[:MAX_SERIES_YEARS]
+
+
+def yearly_rates(mode, value, years, series=None):
+    '''
+        Inflation (%) of each of the first `years` years (at least one). value is the constant rate or
+        the 'yearly' schedule, series the upload's contents. A series shorter than the horizon keeps its last rate.
+        Raises ValueError for schedules that can't be read, or rates of -100% and below.
+    '''
+
+    years = max(int(years), 1)
+    if mode == 'constant':
+        try:
+            rates = np.full(years, float(value))
+        except (TypeError, ValueError):
+            raise ValueError('The inflation rate must be a number') from None
+    elif mode == 'yearly':
+        points = parse_schedule(value)
+        rates = np.full(years, points[0][1]) # the first rate also covers the years before it
+        for year, rate in points:
+            rates[year:] = rate
+    elif mode == 'series':
+        if not series:
+            raise ValueError('Upload an inflation series first')
+        uploaded = read_series(series)
+        rates = np.full(years, uploaded[-1])
+        rates[:min(len(uploaded), years)] = uploaded[:years]
+    else:
+        raise ValueError(f'Inflation mode must be one of {", ".join(INFLATION_MODES)}')
+
+    if not np.isfinite(rates).all() or (rates <= -100).any():
+        raise ValueError('Inflation rates must be above -100%')
+    return rates
+
+
+def deflators(rates, steps, steps_per_year=52):
+    '''
+        (steps,) value at the start of a dollar at the end of each step, for yearly rates (%).
+        Years past the end of rates keep its last rate.
+    '''
+
+    rates = np.asarray(rates, dtype=np.float64)
+    year = np.minimum(np.arange(steps) // steps_per_year, len(rates) - 1)
+    return np.cumprod(((1 + rates / 100) ** (-1 / steps_per_year))[year])
+
+
+def deflate(timeline, deflator):
+    '''
+        Real version of an EngineResult: amounts at each step times its deflator, and the totals
+        sold/bought summed from each step's deflated trades. Proportions don't change.
+    '''
+
+    factor = deflator[:, None].astype(timeline.current_amount.dtype)
+
+    def cumulative(total):
+        return np.cumsum(np.diff(total, axis=0, prepend=0) * factor, axis=0, dtype=total.dtype)
+
+    return timeline._replace(
+        current_amount=timeline.current_amount * factor,
+        total_sold=cumulative(timeline.total_sold),
+        total_bought=cumulative(timeline.total_bought)
+    )
+
+
+def deflate_distribution(distribution, deflator):
+    '''
+        Real version of a MonteCarloResult: every band at a kept (1-based) week times that week's deflator.
+    '''
+
+    factor = deflator[np.asarray(distribution.weeks) - 1]
+    return distribution._replace(total=distribution.total * factor, per_asset=distribution.per_asset * factor[:, None])
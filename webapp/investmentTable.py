@@ -0,0 +1,400 @@
+'''
+    The investments table as a file: CSV, or Parquet (with pyarrow, in requirements.txt).
+
+    Uploads are read straight from the request stream and validated a whole column at a time,
+    with the same rules as /add-investment (routes.validate_investment uses the constants below):
+        - investment_id:                     letters, digits, spaces, '_' and '-', capitalized, no duplicates
+        - investment_strategy / volatility:  one of STRATEGIES / VOLATILITIES
+        - REQUIRED_FIELDS:                   every field the engine reads, none of them blank
+        - BOOLEAN_FIELDS / FLOAT_FIELDS:     a value that's there has to parse (growth_decay can be left out)
+        - correlations:                      optional, {other investment_id: coefficient between -1 and 1}
+                                             (a JSON object in files), see randomStreams.correlation_matrix
+    Every problem is reported with its row (1 is the first row after the header), nothing is stored
+    unless every row is valid.
+
+    Downloads are generated a chunk of rows at a time, in TABLE_FIELDS order (the page's table).
+'''
+
+from collections import namedtuple
+import csv
+import io
+import json
+import re
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError: # only Parquet files need it
+    pyarrow = None
+
+
+FILE_FORMATS = {
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet'
+}
+FILE_EXTENSIONS = {'.csv': 'csv', '.parquet': 'parquet', '.pq': 'parquet'}
+
+ID_PATTERN = '^[A-Za-z0-9_ -]+$'
+STRATEGIES = ['Risky', 'Medium', 'Conservative']
+VOLATILITIES = ['Low', 'Mid', 'High']
+BOOLEAN_FIELDS = ['growth_decay', 'random_growth']
+FLOAT_FIELDS = ['ideal_proportion', 'expected_growth', 'volatility_duration', 'volatility_magnitude', 'volatility_phase',
+                'bullbear_duration', 'bullbear_magnitude', 'bullbear_phase']
+
+# Columns of the page's table, in order
+TABLE_FIELDS = [
+    'investment_id', 'ideal_proportion', 'investment_strategy', 'expected_growth', 'random_growth', 'asset_volatility',
+    'growth_decay', 'volatility_duration', 'volatility_magnitude', 'volatility_phase', 'bullbear_duration',
+    'bullbear_magnitude', 'bullbear_phase', 'correlations'
+]
+# Every investment field the engine reads (what the dashboard's form sends): without one, its projection is NaN
+REQUIRED_FIELDS = [
+    'investment_id', 'ideal_proportion', 'investment_strategy', 'expected_growth', 'random_growth', 'asset_volatility',
+    'volatility_duration', 'volatility_magnitude', 'volatility_phase', 'bullbear_duration', 'bullbear_magnitude', 'bullbear_phase'
+]
+
+# Spreadsheets write booleans many ways; anything else is an error
+TRUE_VALUES = {'true', '1', 'yes', 'y'}
+FALSE_VALUES = {'false', '0', 'no', 'n'}
+
+MAX_ROWS = 10_000
+MAX_ERRORS = 1000 # rows reported, the count covers the rest
+EXPORT_CHUNK_ROWS = 1000
+
+
+class TableError(ValueError):
+    ''' The file itself can't be read (format, encoding, size...). '''
+
+
+def read_table(stream, file_format):
+    '''
+        DataFrame of the uploaded file, every column as objects (strings for CSV, Parquet's own types otherwise).
+    '''
+
+    if file_format == 'csv':
+        try:
+            frame = pd.read_csv(io.TextIOWrapper(stream, encoding='utf-8-sig'), dtype=str, keep_default_na=False,
+                                skipinitialspace=True, nrows=MAX_ROWS + 1)
+        except pd.errors.EmptyDataError:
+            raise TableError('The file is empty')
+        except (pd.errors.ParserError, UnicodeDecodeError) as e:
+            raise TableError(f'Could not read the CSV file: {e}')
+
+    elif file_format == 'parquet':
+        if pyarrow is None:
+            raise TableError('Parquet files are not supported on this server, use CSV')
+        try:
+            parquetFile = pyarrow.parquet.ParquetFile(stream if stream.seekable() else io.BytesIO(stream.read()))
+            if parquetFile.metadata.num_rows > MAX_ROWS:
+                raise TableError(f'At most {MAX_ROWS:,} rows per file')
+            frame = parquetFile.read().to_pandas().astype(object)
+        except pyarrow.ArrowException as e:
+            raise TableError(f'Could not read the Parquet file: {e}')
+
+    else:
+        raise TableError(f'Invalid format, expected one of {", ".join(FILE_FORMATS)}')
+
+    if len(frame) > MAX_ROWS:
+        raise TableError(f'At most {MAX_ROWS:,} rows per file')
+    frame.columns = [str(column).strip() for column in frame.columns]
+    return frame
+
+
+def validate_table(frame, existing_ids=()):
+    '''
+        Checks every row of an uploaded table at once; existing_ids are the investment_ids it can't reuse.
+        Raises TableError when a required column is missing. Returns (investments, errors): line item dicts like /add-investment stores them (only when every row is valid),
+        and [{'row': n, 'errors': [messages]}] of the invalid rows.
+    '''
+
+    rows = len(frame)
+    messages = [[] for _ in range(rows)]
+
+    def flag(invalid, message):
+        for i in np.flatnonzero(invalid):
+            messages[i].append(message)
+
+    missing = [field for field in REQUIRED_FIELDS if field not in frame.columns]
+    if missing:
+        raise TableError(f'Missing column{"s" if len(missing) > 1 else ""}: {", ".join(missing)}')
+    columns = {}
+
+    # -------------------------------- investment_id: pattern, then duplicates (hash lookups, within the file and against the portfolio)
+    ids = frame['investment_id'].map(lambda value: value if isinstance(value, str) else '')
+    validId = ids.str.match(ID_PATTERN).to_numpy(dtype=bool)
+    flag(~validId, 'Invalid investment_id')
+
+    ids = ids.str.upper()
+    taken = {investment_id.upper() for investment_id in existing_ids}
+    duplicate = validId & (ids.duplicated(keep='first').to_numpy() | ids.isin(taken).to_numpy())
+    flag(duplicate, 'Duplicate investment_id')
+    columns['investment_id'] = ids
+
+    # -------------------------------- labels
+    for field, labels in (('investment_strategy', STRATEGIES), ('asset_volatility', VOLATILITIES)):
+        values = frame[field]
+        flag(~values.isin(labels).to_numpy(), f'Invalid {field}')
+        columns[field] = values
+
+    # -------------------------------- optional fields: an empty cell is a missing field, an error for the required ones
+    for field in BOOLEAN_FIELDS:
+        if field in frame.columns:
+            columns[field], invalid = parse_booleans(frame[field])
+            flag(invalid, f'Invalid value for {field}')
+            if field in REQUIRED_FIELDS:
+                flag(blank(frame[field]), f'Missing {field}')
+
+    if 'correlations' in frame.columns:
+        # Nested objects, parsed one cell at a time
+        values = frame['correlations']
+        parsed = [parse_correlations(value) for value in values.where(~blank(values), None)]
+        for i, (_, error) in enumerate(parsed):
+            if error is not None:
+                messages[i].append(error)
+        columns['correlations'] = pd.Series([correlations for correlations, _ in parsed], dtype=object)
+
+    for field in FLOAT_FIELDS:
+        if field in frame.columns:
+            values = frame[field]
+            present = ~blank(values)
+            parsed = pd.to_numeric(values.where(present), errors='coerce')
+            flag(present & parsed.isna().to_numpy(), f'Invalid value for {field}')
+            if field in REQUIRED_FIELDS:
+                flag(~present, f'Missing {field}')
+            columns[field] = parsed.astype(np.float64).astype(object).where(present, None)
+
+    errors = [{'row': i + 1, 'errors': rowMessages} for i, rowMessages in enumerate(messages) if rowMessages]
+    if errors:
+        return [], errors
+
+    fields = [field for field in TABLE_FIELDS if field in columns]
+    table = zip(*(columns[field].tolist() for field in fields))
+    investments = [{field: value for field, value in zip(fields, row) if value is not None} for row in table]
+    return investments, []
+
+
+def parse_correlations(value):
+    '''
+        (correlations dict with capitalized ids, or None when empty; error message or None).
+        Accepts a dict, or its JSON in a string.
+    '''
+
+    if isinstance(value, str):
+        if not value.strip():
+            return None, None
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return None, 'Invalid correlations, expected a JSON object'
+    if value is None:
+        return None, None
+    if not isinstance(value, dict):
+        return None, 'Invalid correlations, expected an object'
+
+    correlations = {}
+    for other, coefficient in value.items():
+        if not isinstance(other, str) or not re.match(ID_PATTERN, other):
+            return None, 'Invalid investment_id in correlations'
+        try:
+            coefficient = float(coefficient)
+        except (TypeError, ValueError):
+            return None, f'Invalid correlation with {other}'
+        if not -1 <= coefficient <= 1:
+            return None, f'Correlation with {other} must be between -1 and 1'
+        correlations[other.upper()] = coefficient
+    return correlations or None, None
+
+
+def blank(values):
+    ''' (rows,) bool: empty cells, '' in CSV files and nulls in Parquet ones. '''
+    return (values.isna() | values.map(lambda value: isinstance(value, str) and not value.strip())).to_numpy(dtype=bool)
+
+
+def parse_booleans(values):
+    '''
+        (booleans as objects, None where blank; (rows,) bool of the invalid cells).
+    '''
+
+    def parse(value):
+        if isinstance(value, (bool, np.bool_)):
+            return bool(value)
+        if isinstance(value, (int, float, np.number)):
+            return bool(value) if value in (0, 1) else np.nan
+        text = str(value).strip().lower()
+        return True if text in TRUE_VALUES else False if text in FALSE_VALUES else np.nan
+
+    present = ~blank(values)
+    parsed = values.where(present).map(parse, na_action='ignore')
+    return parsed.where(present, None), present & parsed.isna().to_numpy()
+
+
+# ---------------------------------------- Batch edits
+
+# deleted: investment_ids removed; updated: {investment_id: its new line item} (the id itself can change);
+# added: new line items, appended in order
+TableChanges = namedtuple('TableChanges', ['deleted', 'updated', 'added'])
+
+OPERATIONS = ['add', 'update', 'delete']
+
+
+def plan_changes(investments, operations):
+    '''
+        Validates a batch of operations on the portfolio `investments`, all together:
+            {"op": "add", "investment": {<line item>}}
+            {"op": "update", "investment_id": <id>, "changes": {<fields to change, investment_id included>}}
+            {"op": "delete", "investment_id": <id>}
+        Every added or updated line item goes through validate_table as one table, so an added one needs
+        every REQUIRED_FIELDS field; duplicates are checked against the ids the batch leaves untouched. An investment can only be the target of one operation.
+        Returns (TableChanges, errors), errors being [{'operation': i, 'errors': [messages]}] (0-based), TableChanges None if any.
+    '''
+
+    index = {investment['investment_id']: investment for investment in investments} # hash index of the portfolio
+    messages = [[] for _ in operations]
+    targeted = set()
+    deleted, updatedIds, rows, rowOperations = [], [], [], []
+    keptIds = [] # updates that don't rename their investment
+
+    for i, operation in enumerate(operations):
+        if not isinstance(operation, dict) or operation.get('op') not in OPERATIONS:
+            messages[i].append(f'Invalid op, expected one of {", ".join(OPERATIONS)}')
+            continue
+
+        if operation['op'] == 'add':
+            if not isinstance(operation.get('investment'), dict):
+                messages[i].append('Expected an investment')
+                continue
+            rows.append(operation['investment'])
+            rowOperations.append(i)
+            continue
+
+        # Ids are stored capitalized, except the ones of the default portfolio
+        target = operation.get('investment_id')
+        if isinstance(target, str) and target not in index:
+            target = target.upper()
+        if target not in index:
+            messages[i].append('Unknown investment_id')
+            continue
+        if target in targeted:
+            messages[i].append('investment_id already changed by another operation')
+            continue
+        targeted.add(target)
+
+        if operation['op'] == 'delete':
+            deleted.append(target)
+        elif not isinstance(operation.get('changes'), dict):
+            messages[i].append('Expected the changes')
+        else:
+            updatedIds.append(target)
+            if 'investment_id' not in operation['changes']:
+                keptIds.append(target)
+            rows.append({**index[target], **operation['changes']})
+            rowOperations.append(i)
+
+    if rows:
+        untouched = (investment_id for investment_id in index if investment_id not in targeted)
+        validated, rowErrors = validate_table(pd.DataFrame(rows, columns=TABLE_FIELDS, dtype=object), untouched)
+        for error in rowErrors:
+            messages[rowOperations[error['row'] - 1]].extend(error['errors'])
+
+    errors = [{'operation': i, 'errors': operationMessages} for i, operationMessages in enumerate(messages) if operationMessages]
+    if errors:
+        return None, errors
+
+    validated = validated if rows else []
+    updated = dict(zip(updatedIds, (row for row, i in zip(validated, rowOperations) if operations[i]['op'] == 'update')))
+    for investment_id in keptIds: # validate_table capitalized it, but the id seeds the asset's random stream
+        updated[investment_id]['investment_id'] = investment_id
+    added = [row for row, i in zip(validated, rowOperations) if operations[i]['op'] == 'add']
+    return TableChanges(deleted, updated, added), []
+
+# ---------------------------------------- Downloads
+
+def file_value(investment, field, missing=None):
+    value = investment.get(field)
+    if value is None:
+        return missing
+    return json.dumps(value, sort_keys=True) if field == 'correlations' else value
+
+
+def iter_csv(investments):
+    '''
+        The investments as CSV, one chunk of EXPORT_CHUNK_ROWS rows at a time (header first).
+    '''
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(TABLE_FIELDS)
+
+    for start in range(0, len(investments), EXPORT_CHUNK_ROWS):
+        writer.writerows([file_value(investment, field, '') for field in TABLE_FIELDS]
+                         for investment in investments[start:start + EXPORT_CHUNK_ROWS])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    if buffer.tell(): # no investments, only the header
+        yield buffer.getvalue()
+
+
+def parquet_schema():
+    return pyarrow.schema([
+        (field, pyarrow.float64() if field in FLOAT_FIELDS else pyarrow.bool_() if field in BOOLEAN_FIELDS else pyarrow.string())
+        for field in TABLE_FIELDS
+    ])
+
+
+class _Drain(io.RawIOBase):
+    ''' Write-only file whose content is taken out by whoever reads it (ParquetWriter writes, iter_parquet yields). '''
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def iter_parquet(investments):
+    '''
+        The investments as Parquet, one row group of EXPORT_CHUNK_ROWS rows at a time.
+    '''
+
+    if pyarrow is None:
+        raise TableError('Parquet files are not supported on this server, use CSV')
+
+    schema = parquet_schema()
+    sink = _Drain()
+    with pyarrow.parquet.ParquetWriter(sink, schema) as writer:
+        for start in range(0, len(investments), EXPORT_CHUNK_ROWS):
+            chunk = investments[start:start + EXPORT_CHUNK_ROWS]
+            writer.write_table(pyarrow.table({field: [file_value(investment, field) for investment in chunk] for field in TABLE_FIELDS},
+                                             schema=schema))
+            yield sink.take()
+    yield sink.take() # footer
+
+
+EXPORTERS = {'csv': iter_csv, 'parquet': iter_parquet}
+
+
+def file_format(requested, filename=None, mimetype=None):
+    '''
+        Format name out of an explicit ?format=, the file's extension or its content type (in that order); None if unknown.
+    '''
+
+    if requested:
+        return requested if requested in FILE_FORMATS else None
+    for extension, name in FILE_EXTENSIONS.items():
+        if filename and filename.lower().endswith(extension):
+            return name
+    return {mimetype: name for name, mimetype in FILE_FORMATS.items()}.get(mimetype)
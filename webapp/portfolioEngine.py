@@ -0,0 +1,1105 @@
+'''
+    Simulation core for the Portfolio Projection dashboard.
+
+    The weekly rebalancing loop lives here, away from Dash and Flask, so it can be
+    benchmarked and reused. Every kernel writes into preallocated (weeks, assets)
+    arrays and only touches plain ndarrays inside the loop. Kernels also take an extra
+    batch axis, which is how Monte Carlo paths are simulated together.
+
+    Two backends are available:
+        - 'numpy': pure NumPy, always available; the default, and the reference for bit-exact results
+        - 'numba': JIT-compiled version of the same loop when numba is installed, opt-in. Its sums
+                   don't run in numpy's order, so it matches 'numpy' to float rounding, not bit for bit
+'''
+
+from collections import namedtuple
+import math
+
+import numpy as np
+import pandas as pd
+
+from webapp import appMetrics
+from webapp import randomStreams
+
+try:
+    import numba
+except ImportError: # numba is optional, the numpy backend covers every feature
+    numba = None
+
+
+# The backend of calls that don't pass one (the app sets it from its ENGINE_BACKEND config).
+# 'auto' picks the JIT backend when it's available
+DEFAULT_BACKEND = 'numpy'
+
+# Re-labeling risks and volatility
+STRATEGY_MULTIPLIERS = {
+    'Conservative': 1.0375,
+    'Medium': 1.075,
+    'Risky': 1.15
+}
+VOLATILITY_STD = {
+    'High': 10,
+    'Mid': 6,
+    'Low': 3
+}
+
+# Incremental runs resume from year boundaries
+CHECKPOINT_INTERVAL = 52
+
+# How often the portfolio is rebalanced. 'weekly' checks every week (the original behavior),
+# 'threshold' only trades in weeks where some asset crosses its selling threshold
+REBALANCING_POLICIES = ('weekly', 'monthly', 'quarterly', 'threshold')
+DEFAULT_POLICY = 'weekly'
+THRESHOLD_LOOKAHEAD = 52 # weeks projected at once while looking for the next threshold crossing
+
+# Time steps of simulate_chunked(). Weekly is what every other simulation uses
+STEPS_PER_YEAR = {'weekly': 52, 'daily': 365}
+CHUNK_MEMORY_BUDGET = 32 * 2**20 # bytes of per-chunk working set
+
+# Running statistics the kernels can keep while they loop (see new_accumulators), so a summary
+# doesn't need the timeline. Returns are time-weighted: contributions don't count as growth
+SUMMARY_STATS = ('steps', 'log_growth', 'return_mean', 'return_m2', 'peak_log', 'max_drawdown')
+SUMMARY_COLUMNS = len(SUMMARY_STATS) # per-asset proportion sums start here
+MIN_GROWTH_FACTOR = 1e-12 # a week that wipes the portfolio out still has a finite log return
+
+# Monte Carlo defaults
+MONTECARLO_PERCENTILES = (5, 25, 50, 75, 95)
+MONTECARLO_MEMORY_BUDGET = 256 * 2**20 # bytes
+
+EngineResult = namedtuple('EngineResult', ['current_amount', 'total_sold', 'total_bought', 'actual_proportion'])
+
+PortfolioInputs = namedtuple('PortfolioInputs', [
+    'investment_id', 'start_amount', 'ideal_proportion', 'threshold_proportion', 'decay',
+    'random_growth', 'asset_volatility', 'name_length',
+    'volatility_duration', 'volatility_magnitude', 'volatility_phase',
+    'bullbear_duration', 'bullbear_magnitude', 'bullbear_phase',
+    'correlation' # randomStreams.CorrelationFactor of the investments' correlations, None when there are none
+], defaults=[None])
+
+ChunkedResult = namedtuple('ChunkedResult', ['investment_id', 'steps', 'steps_per_year', 'timeline', 'summary'], defaults=[None])
+
+# Everything per batch slot: (assets,) arrays for the first six, scalars for the rest
+SummaryResult = namedtuple('SummaryResult', [
+    'current_amount', 'total_sold', 'total_bought',  # state after the last week
+    'final_proportion',                               # each asset's share of the final worth
+    'proportion_sum',                                 # each asset's share, summed over every week (the pie chart)
+    'final_worth', 'cagr', 'max_drawdown', 'volatility', 'steps'
+])
+
+MonteCarloResult = namedtuple('MonteCarloResult', ['investment_id', 'weeks', 'percentiles', 'total', 'per_asset', 'paths'])
+
+SweepResult = namedtuple('SweepResult', ['start_amounts', 'monthly_amounts', 'horizons', 'strategies', 'final_worth',
+                                         'cagr', 'max_drawdown', 'volatility'], defaults=[None, None, None])
+
+
+def threshold_proportion(idealProportion, strategyMultiplier):
+    # Basically a linear function, with sine-wave at the higher end to smooth it.
+    return np.minimum(
+            (np.sin(idealProportion * 0.5 * np.pi)
+                + (idealProportion * 0.7))/ (0.7 + 1),
+            idealProportion * strategyMultiplier
+    )
+
+
+def prepare_portfolio(investments, startInvestment, investmentTime_inWeeks, steps_per_year=52):
+    '''
+        Turns the session's investments list into engine-ready arrays.
+        Everything here is computed once per run, no matter how many paths are simulated.
+        Steps are weeks unless steps_per_year says otherwise (growth rates are converted to match).
+
+        Each field is read into one array in a single pass, and everything after that is
+        whole-array arithmetic, so thousands of assets cost about as much per asset as a few.
+    '''
+
+    def column(field, dtype=np.float64):
+        return np.fromiter((investment.get(field, np.nan) for investment in investments), dtype=dtype, count=len(investments))
+
+    investmentIds = np.array([investment['investment_id'] for investment in investments], dtype=object)
+
+    # re-scaling idealProportion and expectedGrowth
+    idealProportion = column('ideal_proportion')
+    idealProportion /= idealProportion.sum()
+    expectedGrowth = column('expected_growth') / 100
+
+    strategyMultiplier = label_values(investments, 'investment_strategy', STRATEGY_MULTIPLIERS)
+    assetVolatility = label_values(investments, 'asset_volatility', VOLATILITY_STD)
+
+    # Disabling random number generation where necessary
+    randomGrowth = np.fromiter((bool(investment.get('random_growth', True)) for investment in investments), dtype=bool, count=len(investments))
+    assetVolatility[~randomGrowth] = 0
+
+    thresholdProportion = threshold_proportion(idealProportion, strategyMultiplier)
+
+    # (if enabled) Pre-calculate Expected Growth decay
+    # Tends to the median growth (if growth > median)
+    median_growth = np.nanmedian(expectedGrowth)
+
+    # Compound interest conversion from annual to weekly growth
+    expectedGrowth = (1 + expectedGrowth) ** (1/steps_per_year) - 1
+
+    # Linear from each asset's growth to its decayed one, np.linspace's arithmetic on every asset at once
+    decayedGrowth = np.where(expectedGrowth > median_growth, (median_growth * 10 + expectedGrowth) / 11, expectedGrowth)
+    decay = decay_rows(expectedGrowth, decayedGrowth, investmentTime_inWeeks, np.arange(investmentTime_inWeeks))
+
+    return PortfolioInputs(
+        investment_id=investmentIds,
+        start_amount=startInvestment * idealProportion,
+        ideal_proportion=idealProportion,
+        threshold_proportion=thresholdProportion,
+        decay=decay, # (weeks, assets)
+        random_growth=randomGrowth,
+        asset_volatility=assetVolatility,
+        name_length=np.char.str_len(investmentIds.astype(str)),
+        volatility_duration=column('volatility_duration'),
+        volatility_magnitude=column('volatility_magnitude'),
+        volatility_phase=column('volatility_phase'),
+        bullbear_duration=column('bullbear_duration'),
+        bullbear_magnitude=column('bullbear_magnitude'),
+        bullbear_phase=column('bullbear_phase'),
+        correlation=correlation_factor(investments, investmentIds)
+    )
+
+
+def correlation_factor(investments, investmentIds):
+    '''
+        Optional 'correlations' of each investment, {other investment_id: coefficient}, as a factor for the random streams.
+    '''
+
+    correlations = [investment.get('correlations') for investment in investments]
+    if not any(correlations):
+        return None
+    return randomStreams.correlation_factor(investmentIds, correlations)
+
+
+def label_values(investments, field, values):
+    '''
+        (assets,) numbers of a labelled field (e.g. 'Risky' -> 1.15): each distinct label is looked up
+        once, then spread to every asset. Unknown or missing labels give NaN, like pandas' map did.
+    '''
+
+    labels, codes = np.unique(np.array([str(investment.get(field)) for investment in investments]), return_inverse=True)
+    return np.array([values.get(label, np.nan) for label in labels], dtype=np.float64)[codes]
+
+
+def with_horizon(inputs, investmentTime_inWeeks):
+    '''
+        The same prepared portfolio over another horizon, without going through pandas again.
+        Decay schedules are linear between their first and last week; this is np.linspace's own arithmetic,
+        per asset, so it matches prepare_portfolio to the bit.
+    '''
+
+    return inputs._replace(decay=decay_rows(inputs.decay[0], inputs.decay[-1], investmentTime_inWeeks, np.arange(investmentTime_inWeeks)))
+
+
+def decay_rows(first, last, investmentTime_inWeeks, rows):
+    '''
+        Rows (0-based weeks) of the decay schedules going from `first` to `last` growth over the whole horizon.
+    '''
+
+    decay = rows[:, np.newaxis] * ((last - first) / max(investmentTime_inWeeks - 1, 1)) + first
+    if investmentTime_inWeeks > 1:
+        decay[rows == investmentTime_inWeeks - 1] = last
+    return decay
+
+
+def market_cycles(weeks, randomStd,
+                  vol_Dur, vol_Mag, volPhase,
+                  trend_Dur, trend_Mag, trendPhase):
+    '''
+        Pre-calculates bull-bear cycles and volatility cycles for every week and asset.
+            - Transforms user input into formula-friendly versions
+            - Use Sine wave functions to oscillate both cycles
+
+        Returns (mean, spread), both (weeks, assets): the weekly random multiplier is drawn
+        from a normal distribution with oscilating mean (bbCycles) and spread (volCycles).
+    '''
+
+    # Formula for translating years to the phased cycle
+    transformed_vol_Dur = (1/vol_Dur/52)
+    transformed_trend_Dur = (1/trend_Dur/52)
+
+    # Allows the user to pick the phase of each cycle
+    vol_phaseShift = volPhase * np.pi / (transformed_trend_Dur * np.pi)
+    bb_phaseShift = trendPhase * (2 * np.pi) / (transformed_trend_Dur * np.pi)
+
+    # Every (weeks, assets) step below works in place, same operations in the same order as the
+    # formulas in the comments: with thousands of assets, temporaries cost more than the math
+    weeks = weeks[:, np.newaxis]
+
+    # volatilityCycle = max(|sin((weeks - vol_phaseShift) * transformed_vol_Dur * pi) * vol_Mag| + 1e-10, 0.35)
+    volatilityCycle = weeks - vol_phaseShift
+    volatilityCycle *= transformed_vol_Dur
+    volatilityCycle *= np.pi
+    np.sin(volatilityCycle, out=volatilityCycle)
+    volatilityCycle *= vol_Mag
+    np.abs(volatilityCycle, out=volatilityCycle)
+    volatilityCycle += 1e-10
+    np.maximum(volatilityCycle, 0.35, out=volatilityCycle) # Minimum Volatility allowed
+
+    # ---------------- Making Volatility Cycles have a floor. Floor is smoothed for niceness
+    # sVolatilityCycle = sigmoid((volatilityCycle - PARAM_FLOOR) * scaling_factor) * (volatilityCycle - PARAM_FLOOR) + PARAM_FLOOR
+    PARAM_FLOOR = 0.5
+    scaling_factor = 1 / PARAM_FLOOR * 1.4 # empirically gives the smoothest curves for any PARAM_FLOOR
+    volatilityCycle -= PARAM_FLOOR
+
+    sVolatilityCycle = volatilityCycle * scaling_factor
+    np.negative(sVolatilityCycle, out=sVolatilityCycle)
+    np.exp(sVolatilityCycle, out=sVolatilityCycle)
+    sVolatilityCycle += 1
+    np.divide(1, sVolatilityCycle, out=sVolatilityCycle)
+    sVolatilityCycle *= volatilityCycle
+    sVolatilityCycle += PARAM_FLOOR
+    sVolatilityCycle *= randomStd
+
+    # trendCycle = max(sin(...) * trend_Mag, sin(...) * min(0.95, trend_Mag)), capping de-growth; the sine is shared
+    trendSine = weeks - bb_phaseShift
+    trendSine *= transformed_trend_Dur
+    trendSine *= np.pi
+    np.sin(trendSine, out=trendSine)
+
+    trendCycle = trendSine * trend_Mag
+    trendSine *= np.minimum(0.95, trend_Mag)
+    np.maximum(trendCycle, trendSine, out=trendCycle)
+    trendCycle += 1
+
+    return trendCycle, sVolatilityCycle
+
+
+def portfolio_cycles(inputs):
+    weeks = np.arange(1, inputs.decay.shape[0] + 1)
+    return market_cycles(
+        weeks,
+        inputs.asset_volatility,
+        inputs.volatility_duration,
+        inputs.volatility_magnitude,
+        inputs.volatility_phase,
+        inputs.bullbear_duration,
+        inputs.bullbear_magnitude,
+        inputs.bullbear_phase
+    )
+
+
+def growth_schedule(inputs, random_mode='per_asset', seed=randomStreams.DEFAULT_SEED):
+    '''
+        Weekly growth of a fresh single-path run, (weeks, assets): decay times the random multipliers.
+    '''
+
+    if not inputs.random_growth.any():
+        return inputs.decay
+
+    mean, spread = portfolio_cycles(inputs)
+    return inputs.decay * randomStreams.random_multipliers(inputs.investment_id, inputs.name_length, mean, spread,
+                                                           mode=random_mode, seed=seed, correlation=inputs.correlation)
+
+
+def new_accumulators(batch, assets):
+    '''
+        Fresh summary accumulators, (batch, SUMMARY_STATS + assets): the running statistics,
+        then each asset's proportion summed over the weeks. Kernels update them in place.
+    '''
+    return np.zeros((batch, SUMMARY_COLUMNS + assets))
+
+
+def _accumulate(accumulators, previousTotal, grownTotal, amounts):
+    '''
+        Adds a block of weeks to the (batch, SUMMARY_STATS + assets) accumulators, in place.
+            previousTotal:  (weeks, batch) worth at the start of each week
+            grownTotal:     (weeks, batch) worth after that week's growth, before trading and contributions
+            amounts:        (weeks, batch, assets) holdings at the end of each week
+    '''
+
+    stats = accumulators[:, :SUMMARY_COLUMNS]
+    weeks = previousTotal.shape[0]
+    weekReturn = np.divide(grownTotal, previousTotal, out=np.ones_like(grownTotal), where=previousTotal > 0) - 1
+
+    # Mean and variance of the weekly returns, the block merged into the running ones (Chan et al.)
+    steps = stats[:, 0].copy()
+    blockMean = weekReturn.mean(axis=0)
+    delta = blockMean - stats[:, 2]
+    stats[:, 0] = steps + weeks
+    stats[:, 2] += delta * weeks / stats[:, 0]
+    stats[:, 3] += ((weekReturn - blockMean) ** 2).sum(axis=0) + delta ** 2 * steps * weeks / stats[:, 0]
+
+    # Growth index, in logs, and its deepest fall from a previous peak
+    logIndex = stats[:, 1] + np.cumsum(np.log(np.maximum(1 + weekReturn, MIN_GROWTH_FACTOR)), axis=0)
+    peak = np.maximum(np.maximum.accumulate(logIndex, axis=0), stats[:, 4])
+    stats[:, 1], stats[:, 4] = logIndex[-1], peak[-1]
+    stats[:, 5] = np.maximum(stats[:, 5], (-np.expm1(logIndex - peak)).max(axis=0))
+
+    accumulators[:, SUMMARY_COLUMNS:] += (amounts / (amounts.sum(axis=-1, keepdims=True) + 1e-10)).sum(axis=0)
+
+
+def summarize(accumulators, currentAmount, totalSold, totalBought, steps_per_year=52):
+    '''
+        SummaryResult of (batch, ...) accumulators and final state; annualized with steps_per_year.
+    '''
+
+    stats = accumulators[:, :SUMMARY_COLUMNS]
+    steps = stats[:, 0]
+    finalWorth = currentAmount.sum(axis=-1)
+
+    return SummaryResult(
+        current_amount=currentAmount.copy(),
+        total_sold=totalSold.copy(),
+        total_bought=totalBought.copy(),
+        final_proportion=currentAmount / (finalWorth[:, np.newaxis] + 1e-10),
+        proportion_sum=accumulators[:, SUMMARY_COLUMNS:].copy(),
+        final_worth=finalWorth,
+        cagr=np.expm1(stats[:, 1] * steps_per_year / np.maximum(steps, 1)),
+        max_drawdown=stats[:, 5].copy(),
+        volatility=np.sqrt(stats[:, 3] / np.maximum(steps - 1, 1) * steps_per_year),
+        steps=steps.astype(np.int64)
+    )
+
+
+def _rebalance_numpy(currentAmount, totalSold, totalBought, growth, idealProportion, thresholdProportion, weeklyContribution, record,
+                     out_amount, out_sold, out_bought, out_proportion, accumulators=None):
+    '''
+        Arrays carry a batch axis: currentAmount is (batch, assets), growth is (weeks, batch, assets).
+        currentAmount, totalSold and totalBought hold the starting state and are updated in place.
+        record[week] is the output slot where that week is stored, or -1 to skip it.
+        accumulators (see new_accumulators), when given, are updated every week.
+    '''
+
+    distinctInvestments_amount = currentAmount.shape[-1]
+
+    zeros = np.zeros_like(currentAmount)
+    evenProportion = np.full_like(currentAmount, 1/distinctInvestments_amount)
+
+    for week in range(growth.shape[0]):
+        if accumulators is not None:
+            previousTotal = currentAmount.sum(axis=-1)
+
+        # Casting compound growth
+        currentAmount += currentAmount * growth[week]
+
+        # -------------------- Rebalancing Portfolio Section
+        portfolioTotal = currentAmount.sum(axis=-1, keepdims=True)
+        thresholdInvestment = thresholdProportion * portfolioTotal
+        idealInvestment = idealProportion * portfolioTotal
+
+        # Calculate the Selling Delta based on threshold trigger
+        sellingDelta = np.maximum(currentAmount - thresholdInvestment, zeros)
+        totalSold += sellingDelta
+
+        np.minimum(currentAmount, thresholdInvestment, out=currentAmount)
+        soldAmount = sellingDelta.sum(axis=-1, keepdims=True)
+
+        # Calculate toBuy delta (how much each investment needs to be bought in theory)
+        toBuy_Delta = np.maximum(idealInvestment - currentAmount, zeros)
+
+        # Actually 'buying' assets, with the money left in 'soldAmount' + Monthly Contributions
+        #  First half: transform toBuy_Delta in proportion
+        # Second half: multiply each proportion with the amount of money in the balance
+        toBuy_Proportion = toBuy_Delta / (toBuy_Delta.sum(axis=-1, keepdims=True) + 1e-10)
+
+        nothingToBuy = toBuy_Proportion.sum(axis=-1) == 0
+        if nothingToBuy.any():
+            toBuy_Proportion[nothingToBuy] = evenProportion[nothingToBuy]
+
+        boughtValues = toBuy_Proportion * np.round(soldAmount + weeklyContribution, 2)
+        totalBought += boughtValues
+        currentAmount += boughtValues
+
+        # --------------------------- Storing Info in TimeLine
+        slot = record[week]
+        if slot >= 0 or accumulators is not None:
+            proportion = currentAmount / (currentAmount.sum(axis=-1, keepdims=True) + 1e-10)
+        if slot >= 0:
+            out_amount[slot] = currentAmount
+            out_sold[slot] = totalSold
+            out_bought[slot] = totalBought
+            out_proportion[slot] = proportion
+
+        # --------------------------- Summary statistics (one week of _accumulate)
+        if accumulators is not None:
+            stats = accumulators.reshape(-1, accumulators.shape[-1])
+            weekReturn = np.divide(portfolioTotal[..., 0], previousTotal, out=np.ones_like(previousTotal), where=previousTotal > 0) - 1
+            weekReturn = weekReturn.reshape(-1)
+            stats[:, 0] += 1
+            delta = weekReturn - stats[:, 2]
+            stats[:, 2] += delta / stats[:, 0]
+            stats[:, 3] += delta * (weekReturn - stats[:, 2])
+            stats[:, 1] += np.log(np.maximum(1 + weekReturn, MIN_GROWTH_FACTOR))
+            stats[:, 4] = np.maximum(stats[:, 4], stats[:, 1])
+            stats[:, 5] = np.maximum(stats[:, 5], -np.expm1(stats[:, 1] - stats[:, 4]))
+            stats[:, SUMMARY_COLUMNS:] += proportion.reshape(-1, distinctInvestments_amount)
+
+
+def _rebalance_loops(currentAmount, totalSold, totalBought, growth, idealProportion, thresholdProportion, weeklyContribution, record,
+                     out_amount, out_sold, out_bought, out_proportion, accumulators=None):
+    '''
+        Same algorithm as _rebalance_numpy, written with explicit loops so numba can compile it.
+        Sums are sequential here, so results match the numpy backend up to float rounding.
+        The accumulators follow _accumulate one week at a time (Welford's update).
+    '''
+
+    weeks, batch, n = growth.shape
+
+    toBuy_Delta = np.zeros(n)
+
+    for week in range(weeks):
+        slot = record[week]
+
+        for b in range(batch):
+            previousTotal = 0.0
+            portfolioTotal = 0.0
+            for i in range(n):
+                previousTotal += currentAmount[b, i]
+                currentAmount[b, i] += currentAmount[b, i] * growth[week, b, i]
+                portfolioTotal += currentAmount[b, i]
+
+            soldAmount = 0.0
+            toBuy_Sum = 0.0
+            for i in range(n):
+                thresholdInvestment = thresholdProportion[b, i] * portfolioTotal
+                sellingDelta = max(currentAmount[b, i] - thresholdInvestment, 0.0)
+                totalSold[b, i] += sellingDelta
+                soldAmount += sellingDelta
+                currentAmount[b, i] = min(currentAmount[b, i], thresholdInvestment)
+
+                toBuy_Delta[i] = max(idealProportion[b, i] * portfolioTotal - currentAmount[b, i], 0.0)
+                toBuy_Sum += toBuy_Delta[i]
+
+            toSpend = np.round(soldAmount + weeklyContribution[b], 2)
+            toBuy_ProportionSum = 0.0
+            for i in range(n):
+                toBuy_Delta[i] = toBuy_Delta[i] / (toBuy_Sum + 1e-10)
+                toBuy_ProportionSum += toBuy_Delta[i]
+
+            newTotal = 0.0
+            for i in range(n):
+                boughtValue = (1/n) * toSpend if toBuy_ProportionSum == 0 else toBuy_Delta[i] * toSpend
+                totalBought[b, i] += boughtValue
+                currentAmount[b, i] += boughtValue
+                newTotal += currentAmount[b, i]
+
+            if slot >= 0:
+                for i in range(n):
+                    out_amount[slot, b, i] = currentAmount[b, i]
+                    out_sold[slot, b, i] = totalSold[b, i]
+                    out_bought[slot, b, i] = totalBought[b, i]
+                    out_proportion[slot, b, i] = currentAmount[b, i] / (newTotal + 1e-10)
+
+            if accumulators is not None:
+                weekReturn = portfolioTotal / previousTotal - 1 if previousTotal > 0 else 0.0
+                steps = accumulators[b, 0] + 1
+                delta = weekReturn - accumulators[b, 2]
+                accumulators[b, 0] = steps
+                accumulators[b, 2] += delta / steps
+                accumulators[b, 3] += delta * (weekReturn - accumulators[b, 2])
+                accumulators[b, 1] += math.log(max(1 + weekReturn, MIN_GROWTH_FACTOR))
+                accumulators[b, 4] = max(accumulators[b, 4], accumulators[b, 1])
+                accumulators[b, 5] = max(accumulators[b, 5], -math.expm1(accumulators[b, 1] - accumulators[b, 4]))
+                for i in range(n):
+                    accumulators[b, SUMMARY_COLUMNS + i] += currentAmount[b, i] / (newTotal + 1e-10)
+
+
+_rebalance_numba = numba.njit(cache=True)(_rebalance_loops) if numba is not None else None
+
+
+def rebalancing_events(weeks, policy, first_week=0, steps_per_year=52):
+    '''
+        Scheduled rebalancing weeks (steps) of a policy, as a (weeks,) bool mask: the last step of every period.
+        first_week is the absolute step of the first one, so resumed runs keep the same calendar.
+    '''
+
+    step = np.arange(first_week, first_week + weeks)
+    periods = {'weekly': 52, 'monthly': 12, 'quarterly': 4}
+    if policy in periods:
+        return step * periods[policy] // steps_per_year != (step + 1) * periods[policy] // steps_per_year
+    if policy == 'threshold':
+        return np.zeros(weeks, dtype=bool)
+    raise ValueError(f"Unknown rebalancing policy '{policy}', available: {', '.join(REBALANCING_POLICIES)}")
+
+
+def _rebalance_events(currentAmount, totalSold, totalBought, growth, idealProportion, thresholdProportion, weeklyContribution, record,
+                      out_amount, out_sold, out_bought, out_proportion, scheduled, threshold_only, accumulators=None):
+    '''
+        Rebalancing only at event weeks: the scheduled ones, and (threshold_only) the weeks where
+        some asset crosses its selling threshold.
+
+        In between, nothing is sold and the weekly contribution is bought at the ideal proportions, so
+        each asset follows a_k = a_k-1 * (1 + g_k) + c. Over a whole stretch, with P = cumprod(1 + g):
+            a_k = P_k * (a_0 + c * sum(1 / P_j, j <= k))
+        which is a couple of cumprod/cumsum calls, however many weeks the stretch has. Event weeks go
+        through the regular weekly step. Same array layout and in-place updates as _rebalance_numpy,
+        record is a numpy array here. Accumulators take each quiet stretch as one block.
+    '''
+
+    weeks = growth.shape[0]
+    contribution = weeklyContribution * idealProportion # (batch, assets) bought every quiet week
+    eventWeeks = np.flatnonzero(scheduled)
+    noRecord = [-1]
+    lookahead = 1
+
+    def store(slots, amount, sold, bought):
+        out_amount[slots] = amount
+        out_sold[slots] = sold
+        out_bought[slots] = bought
+        out_proportion[slots] = amount / (amount.sum(axis=-1, keepdims=True) + 1e-10)
+
+    week = 0
+    while week < weeks:
+        nextEvent = eventWeeks[np.searchsorted(eventWeeks, week)] if len(eventWeeks) and eventWeeks[-1] >= week else weeks
+        stop = min(nextEvent, week + lookahead) if threshold_only else nextEvent
+        crossing = None
+
+        # ------------ Quiet stretch [week, stop), in closed form
+        if stop > week:
+            factors = np.cumprod(1 + growth[week:stop], axis=0)
+            invested = np.cumsum(1 / factors, axis=0)
+            slots = record[week:stop]
+            kept = slots >= 0
+
+            if threshold_only or kept.any() or accumulators is not None:
+                amounts = factors * (currentAmount + contribution * invested)
+
+            if threshold_only:
+                # Worth after growth, before that week's contribution, is what the weekly step compares
+                grown = amounts - contribution
+                crossed = (grown > thresholdProportion * grown.sum(axis=-1, keepdims=True)).any(axis=-1) # (weeks, batch)
+                crossedWeeks = np.flatnonzero(crossed.any(axis=-1))
+                if len(crossedWeeks):
+                    crossing = crossedWeeks[0]
+                    stop = week + crossing
+                    kept[crossing:] = False
+                # Crossings tend to come in bursts: look less far ahead after one, further after a quiet window
+                lookahead = min(2 * (crossing + 1), THRESHOLD_LOOKAHEAD) if crossing is not None else min(2 * lookahead, THRESHOLD_LOOKAHEAD)
+
+            if kept.any():
+                quietWeeks = np.arange(1, len(kept) + 1)[kept][:, np.newaxis, np.newaxis]
+                store(slots[kept], amounts[kept], totalSold, totalBought + contribution * quietWeeks)
+
+            if stop > week:
+                last = stop - week - 1
+                if accumulators is not None:
+                    quiet = amounts[:last + 1]
+                    totals = quiet.sum(axis=-1)
+                    _accumulate(accumulators, np.concatenate([currentAmount.sum(axis=-1)[np.newaxis], totals[:-1]]),
+                                totals - contribution.sum(axis=-1), quiet)
+                currentAmount[:] = factors[last] * (currentAmount + contribution * invested[last])
+                totalBought += contribution * (stop - week)
+            week = stop
+
+        if week >= weeks:
+            break
+
+        # ------------ Event week: the regular weekly step
+        if crossing is not None and not crossed[crossing].all():
+            # only the portfolios that crossed trade, the others just buy as usual
+            traded = crossed[crossing]
+            amount, sold, bought = currentAmount[traded], totalSold[traded], totalBought[traded]
+            tradedAccumulators = accumulators[traded] if accumulators is not None else None
+            _rebalance_numpy(amount, sold, bought, growth[week:week + 1, traded], idealProportion[traded],
+                             thresholdProportion[traded], weeklyContribution[traded], noRecord, None, None, None, None,
+                             tradedAccumulators)
+            if accumulators is not None:
+                quiet = amounts[crossing:crossing + 1, ~traded]
+                untradedAccumulators = accumulators[~traded]
+                _accumulate(untradedAccumulators, currentAmount[~traded].sum(axis=-1)[np.newaxis],
+                            quiet.sum(axis=-1) - contribution[~traded].sum(axis=-1), quiet)
+                accumulators[traded], accumulators[~traded] = tradedAccumulators, untradedAccumulators
+            currentAmount[~traded] = amounts[crossing][~traded]
+            totalBought[~traded] += contribution[~traded]
+            currentAmount[traded], totalSold[traded], totalBought[traded] = amount, sold, bought
+        elif crossing is not None or week == nextEvent:
+            _rebalance_numpy(currentAmount, totalSold, totalBought, growth[week:week + 1], idealProportion,
+                             thresholdProportion, weeklyContribution, noRecord, None, None, None, None, accumulators)
+        else:
+            continue # the look-ahead window ended without a crossing
+
+        if record[week] >= 0:
+            store(record[week], currentAmount, totalSold, totalBought)
+        week += 1
+
+
+BACKENDS = {'numpy': _rebalance_numpy}
+if _rebalance_numba is not None:
+    BACKENDS['numba'] = _rebalance_numba
+
+
+def resolve_backend(backend=None):
+    backend = backend or DEFAULT_BACKEND
+    if backend == 'auto':
+        return 'numba' if 'numba' in BACKENDS else 'numpy'
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown engine backend '{backend}', available: {', '.join(BACKENDS)}")
+    return backend
+
+
+@appMetrics.stage(appMetrics.REBALANCE_LOOP)
+def run_rebalancing(startAmount, growth, idealProportion, thresholdProportion, weeklyContribution,
+                    backend=None, record_weeks=None, dtype=np.float64, startSold=0, startBought=0,
+                    policy=DEFAULT_POLICY, first_week=0, steps_per_year=52, summary=False, accumulators=None):
+    '''
+        Runs the weekly compound growth + rebalancing loop (a week is any time step, see steps_per_year).
+
+            startAmount:          (assets,) or (batch, assets) money allocated to each asset at week 0
+            growth:               (weeks, assets) or (weeks, batch, assets) weekly growth rate,
+                                  random multipliers already applied. A growth without a batch axis
+                                  is shared by every batch slot of the other arguments
+            idealProportion:      (assets,) or (batch, assets) target proportions, summing up to 1
+            thresholdProportion:  (assets,) or (batch, assets) proportion that triggers selling
+            weeklyContribution:   money added to the portfolio every week, scalar or (batch,)
+            record_weeks:         sorted 0-based weeks to keep in the output (default: all of them,
+                                  an empty list skips the timeline)
+            startSold/Bought:     totals carried over when resuming from a checkpoint
+            policy:               one of REBALANCING_POLICIES. Anything but 'weekly' compounds in
+                                  closed form between events (numpy, whatever the backend)
+            first_week:           absolute week of growth[0], for the policy's calendar
+            steps_per_year:       length of a step, for the policy's calendar (weeklyContribution is per step)
+            summary:              also keep the running statistics of a SummaryResult while looping
+            accumulators:         new_accumulators() state to continue from (a previous chunk's), updated in place
+
+        Returns an EngineResult whose fields are (recorded weeks, assets) arrays,
+        or (recorded weeks, batch, assets) when a batched growth was given.
+        With summary, returns (EngineResult, SummaryResult).
+    '''
+
+    growth = np.asarray(growth, dtype=np.float64)
+    batched = growth.ndim == 3
+    if not batched:
+        growth = growth[:, np.newaxis, :]
+    weeks, batch, distinctInvestments_amount = growth.shape
+
+    if batch == 1:
+        # Batch slots that only differ on amounts, contributions or thresholds read the same growth (a view, no copy)
+        batch = max([np.shape(values)[0] for values in (startAmount, idealProportion, thresholdProportion) if np.ndim(values) == 2]
+                    + [np.size(weeklyContribution)])
+        batched = batched or batch > 1
+        growth = np.broadcast_to(growth, (weeks, batch, distinctInvestments_amount))
+    else:
+        growth = np.ascontiguousarray(growth)
+
+    def per_batch(values):
+        return np.ascontiguousarray(np.broadcast_to(values, (batch, distinctInvestments_amount)), dtype=np.float64)
+
+    currentAmount = per_batch(startAmount).copy()
+    totalSold = per_batch(startSold).copy()
+    totalBought = per_batch(startBought).copy()
+    idealProportion = per_batch(idealProportion)
+    thresholdProportion = per_batch(thresholdProportion)
+    weeklyContribution = np.ascontiguousarray(np.broadcast_to(weeklyContribution, (batch,)), dtype=np.float64)
+
+    if summary and accumulators is None:
+        accumulators = new_accumulators(batch, distinctInvestments_amount)
+    if accumulators is not None:
+        summary = True
+        accumulators = accumulators.reshape(batch, SUMMARY_COLUMNS + distinctInvestments_amount) # a view, updated in place
+
+    record = np.full(weeks, -1, dtype=np.int64)
+    if record_weeks is None:
+        record_weeks = np.arange(weeks)
+    record[record_weeks] = np.arange(len(record_weeks))
+
+    result = EngineResult(*(np.empty((len(record_weeks), batch, distinctInvestments_amount), dtype=dtype)
+                            for _ in EngineResult._fields))
+
+    scheduled = rebalancing_events(weeks, policy, first_week, steps_per_year)
+
+    if weeks > 0 and distinctInvestments_amount > 0 and not scheduled.all():
+        _rebalance_events(currentAmount, totalSold, totalBought, growth, idealProportion, thresholdProportion,
+                          weeklyContribution[:, np.newaxis], record, *result,
+                          scheduled=scheduled, threshold_only=policy == 'threshold', accumulators=accumulators)
+    elif weeks > 0 and distinctInvestments_amount > 0:
+        backend = resolve_backend(backend)
+        # The kernel's views of the state: updating them updates currentAmount, totalSold and totalBought
+        kernelState = [currentAmount, totalSold, totalBought, growth, idealProportion, thresholdProportion, weeklyContribution]
+        outputs = tuple(result)
+        if backend == 'numpy':
+            # numpy broadcasts the contribution over the assets axis
+            kernelState[-1] = weeklyContribution[:, np.newaxis]
+            if batch == 1:
+                # 1-D ufuncs are noticeably cheaper for the single path case
+                kernelState = [values[:, 0, :] if values is growth else values[0] for values in kernelState]
+                outputs = tuple(field[:, 0, :] for field in result)
+            record = record.tolist() # plain ints index faster than numpy scalars
+
+        BACKENDS[backend](*kernelState, record, *outputs, accumulators)
+
+    if not batched:
+        result = EngineResult(*(field[:, 0, :] for field in result))
+
+    if summary:
+        finals = summarize(accumulators, currentAmount, totalSold, totalBought, steps_per_year)
+        if not batched:
+            finals = SummaryResult(*(field[0] for field in finals))
+        return result, finals
+
+    return result
+
+
+def resume_week(previous, inputs):
+    '''
+        Finds how many weeks of a `previous` run are still valid for `inputs`.
+
+        Everything but the horizon is part of the checkpoint's cache key, so the only thing that
+        can differ is the decay schedule: its linspace depends on the horizon. Runs are resumed
+        from the last year boundary before the first week whose growth changed.
+    '''
+
+    if previous is None:
+        return 0
+
+    oldDecay = previous['decay']
+    if oldDecay.shape[1] != inputs.decay.shape[1]:
+        return 0
+
+    common = min(oldDecay.shape[0], inputs.decay.shape[0])
+    changed = np.flatnonzero((oldDecay[:common] != inputs.decay[:common]).any(axis=1))
+    if len(changed) == 0:
+        return common
+
+    return changed[0] // CHECKPOINT_INTERVAL * CHECKPOINT_INTERVAL
+
+
+def simulate_timeline(inputs, weeklyContribution, random_mode='per_asset', seed=randomStreams.DEFAULT_SEED,
+                      previous=None, backend=None, policy=DEFAULT_POLICY):
+    '''
+        Full single-path simulation: random growth + rebalancing.
+
+        `previous` is a checkpoint returned by an earlier call with the same portfolio and settings,
+        except for the horizon. Its valid weeks are reused and only the rest is simulated, which makes
+        scrubbing the horizon slider almost free.
+
+        Returns (EngineResult, checkpoint). checkpoint is None when it isn't worth replacing `previous`.
+    '''
+
+    weeks, distinctInvestments_amount = inputs.decay.shape
+    randomGrowth = inputs.random_growth.any()
+
+    # Legacy streams are seeded from the horizon itself, nothing carries over between horizons
+    start = resume_week(previous, inputs) if random_mode != 'legacy' else 0
+
+    # ------------ Pre calculating random values section (skipped if there's no randomGrowth checked)
+    growth = inputs.decay[start:]
+    rng_state = np.zeros((0, 6), dtype=np.uint64)
+
+    if randomGrowth:
+        mean, spread = portfolio_cycles(inputs)
+
+        if random_mode == 'legacy':
+            random_values = randomStreams.random_multipliers(inputs.investment_id, inputs.name_length, mean, spread, mode='legacy')
+        else:
+            if start > 0 and start == previous['decay'].shape[0] and len(previous['rng_state']):
+                # The streams continue right where the previous run stopped
+                generators = randomStreams.restore_generators(previous['rng_state'])
+                normals = randomStreams.standard_normals(generators, weeks - start, correlation=inputs.correlation)
+            else:
+                generators = randomStreams.asset_generators(inputs.investment_id, seed)
+                normals = randomStreams.standard_normals(generators, weeks, correlation=inputs.correlation)[start:]
+            # mean + spread * normals, in spread's own (fresh) memory
+            random_values = spread[start:]
+            random_values *= normals
+            random_values += mean[start:]
+            rng_state = randomStreams.generator_states(generators)
+
+        random_values *= growth
+        growth = random_values
+
+    # ------------ Resuming from the checkpoint
+    if start > 0:
+        checkpoint = {field: previous[field][start - 1] for field in ('current_amount', 'total_sold', 'total_bought')}
+    else:
+        checkpoint = {'current_amount': inputs.start_amount, 'total_sold': 0, 'total_bought': 0}
+
+    tail = run_rebalancing(
+        checkpoint['current_amount'],
+        growth,
+        inputs.ideal_proportion,
+        inputs.threshold_proportion,
+        weeklyContribution,
+        backend=backend,
+        startSold=checkpoint['total_sold'],
+        startBought=checkpoint['total_bought'],
+        policy=policy,
+        first_week=start
+    )
+
+    if start > 0:
+        timeline = EngineResult(*(np.concatenate([previous[field][:start], values])
+                                  for field, values in zip(EngineResult._fields, tail)))
+    else:
+        timeline = tail
+
+    # A shorter run that reused everything has nothing new to offer to the next one
+    if previous is not None and start == weeks and weeks < previous['decay'].shape[0]:
+        return timeline, None
+
+    return timeline, {**timeline._asdict(), 'decay': inputs.decay, 'rng_state': rng_state}
+
+
+def simulate_chunked(investments, startInvestment, monthlyInvestment, years, time_step='daily', seed=randomStreams.DEFAULT_SEED,
+                     record_every=1, memory_budget=CHUNK_MEMORY_BUDGET, backend=None, policy=DEFAULT_POLICY, progress=None,
+                     summary=False):
+    '''
+        Single-path simulation in fixed-size chunks of time steps, for daily steps and very long horizons.
+
+        Nothing the size of the whole horizon is built: decay schedules, market cycles and random values
+        are generated per chunk (per-asset streams continue from one chunk to the next), and the rebalancing
+        state carries over in float64. Every `record_every`-th step, and the last one, streams into float32
+        output arrays: the working set stays at `memory_budget` however long the horizon is.
+
+        Random growth always uses per-asset streams, legacy paths are seeded from the whole horizon at once.
+        With time_step='weekly', this is simulate_timeline() in float32.
+
+        progress(done, steps) is called after every chunk; raising from it stops the simulation.
+
+        Returns a ChunkedResult: investment_id, steps (1-based numbers of the recorded steps),
+        steps_per_year, a float32 EngineResult of (recorded steps, assets) arrays, and with
+        summary, the SummaryResult of the whole run (its accumulators carry over between chunks).
+    '''
+
+    stepsPerYear = STEPS_PER_YEAR[time_step]
+    totalSteps = int(round(years * stepsPerYear))
+
+    # Two steps hold every asset's first and last (decayed) growth rate, the rest is interpolated per chunk
+    inputs = prepare_portfolio(investments, startInvestment, 2, steps_per_year=stepsPerYear)
+    firstGrowth, lastGrowth = inputs.decay[0], inputs.decay[-1]
+    distinctInvestments_amount = len(firstGrowth)
+
+    recorded = np.arange(record_every - 1, totalSteps, max(int(record_every), 1))
+    if totalSteps and (len(recorded) == 0 or recorded[-1] != totalSteps - 1):
+        recorded = np.append(recorded, totalSteps - 1)
+    timeline = EngineResult(*(np.empty((len(recorded), distinctInvestments_amount), dtype=np.float32)
+                              for _ in EngineResult._fields))
+
+    # growth, normals, the two cycles and their temporaries, all float64 (steps, assets)
+    chunkSteps = max(int(memory_budget // (8 * 8 * max(distinctInvestments_amount, 1))), 1)
+
+    randomGrowth = inputs.random_growth.any()
+    if randomGrowth:
+        generators = randomStreams.asset_generators(inputs.investment_id, seed)
+
+    currentAmount, totalSold, totalBought = inputs.start_amount, 0, 0
+    accumulators = new_accumulators(1, distinctInvestments_amount)[0] if summary else None
+    finals = None
+    for start in range(0, totalSteps, chunkSteps):
+        stop = min(start + chunkSteps, totalSteps)
+        rows = np.arange(start, stop)
+
+        growth = decay_rows(firstGrowth, lastGrowth, totalSteps, rows)
+        if randomGrowth:
+            mean, spread = market_cycles(
+                (rows + 1) * (52 / stepsPerYear), # cycles are defined in weeks
+                inputs.asset_volatility,
+                inputs.volatility_duration,
+                inputs.volatility_magnitude,
+                inputs.volatility_phase,
+                inputs.bullbear_duration,
+                inputs.bullbear_magnitude,
+                inputs.bullbear_phase
+            )
+            growth = growth * (mean + spread * randomStreams.standard_normals(generators, stop - start, correlation=inputs.correlation))
+
+        # The chunk's recorded steps, plus its last one to carry the state over
+        outputRows = np.flatnonzero((recorded >= start) & (recorded < stop))
+        recordWeeks = np.union1d(recorded[outputRows] - start, [stop - start - 1])
+
+        chunk = run_rebalancing(
+            currentAmount, growth, inputs.ideal_proportion, inputs.threshold_proportion,
+            monthlyInvestment * 12 / stepsPerYear,
+            backend=backend,
+            record_weeks=recordWeeks,
+            startSold=totalSold,
+            startBought=totalBought,
+            policy=policy,
+            first_week=start,
+            steps_per_year=stepsPerYear,
+            accumulators=accumulators
+        )
+        if summary:
+            chunk, finals = chunk
+
+        currentAmount, totalSold, totalBought = chunk.current_amount[-1], chunk.total_sold[-1], chunk.total_bought[-1]
+        kept = np.isin(recordWeeks, recorded[outputRows] - start)
+        for output, values in zip(timeline, chunk):
+            output[outputRows] = values[kept]
+
+        if progress is not None:
+            progress(stop, totalSteps)
+
+    if summary and finals is None: # no steps at all
+        empty = np.zeros((1, distinctInvestments_amount))
+        finals = SummaryResult(*(field[0] for field in summarize(new_accumulators(1, distinctInvestments_amount),
+                                                                 currentAmount[np.newaxis], empty, empty, stepsPerYear)))
+    return ChunkedResult(inputs.investment_id, recorded + 1, stepsPerYear, timeline, finals)
+
+
+def simulate_sweep(investments, start_amounts, monthly_amounts, horizons, strategies=(None,),
+                   random_mode='per_asset', seed=randomStreams.DEFAULT_SEED, memory_budget=MONTECARLO_MEMORY_BUDGET, backend=None,
+                   policy=DEFAULT_POLICY, summary=False):
+    '''
+        What-if grid: final portfolio worth for every combination of
+            start_amounts:    Start Investment Amount values
+            monthly_amounts:  Monthly Investment values
+            horizons:         Investment Time values, in years (at least 1)
+            strategies:       investment_strategy applied to every asset, None keeps each asset's own
+
+        Every scenario is a slot of the engine's batch axis, so the grid runs as one batched pass
+        (per chunk of scenarios, when they don't fit `memory_budget`). Amounts and contributions
+        only change per-slot scalars, and strategies the selling thresholds; horizons change the
+        decay schedule, so their growth arrays are built once per horizon.
+
+        With summary, cagr, max_drawdown and volatility are filled in too. Nothing of the timelines is
+        stored then, and every pass covers a single horizon.
+
+        Returns a SweepResult; final_worth (and the summary fields) are (starts, monthlies, horizons, strategies).
+    '''
+
+    start_amounts = np.asarray(start_amounts, dtype=np.float64)
+    monthly_amounts = np.asarray(monthly_amounts, dtype=np.float64)
+    horizons = np.asarray(horizons, dtype=int)
+    strategies = tuple(strategies)
+    if (horizons < 1).any():
+        raise ValueError("Sweep horizons must be at least 1 year")
+
+    # Growth only depends on the horizon (its decay schedule, and legacy seeds)
+    inputs = prepare_portfolio(investments, 1, int(horizons.max()) * 52)
+    horizonGrowth = {
+        horizon: growth_schedule(with_horizon(inputs, horizon * 52), random_mode, seed)
+        for horizon in np.unique(horizons).tolist()
+    }
+
+    idealProportion = inputs.ideal_proportion
+    thresholds = np.array([
+        inputs.threshold_proportion if strategy is None else threshold_proportion(idealProportion, STRATEGY_MULTIPLIERS[strategy])
+        for strategy in strategies
+    ])
+
+    # Scenario axis, horizon-major so each chunk spans as few horizons as possible
+    horizonIndex, startIndex, monthlyIndex, strategyIndex = (axis.ravel() for axis in np.meshgrid(
+        np.arange(len(horizons)), np.arange(len(start_amounts)), np.arange(len(monthly_amounts)), np.arange(len(strategies)),
+        indexing='ij'
+    ))
+    scenarios = len(horizonIndex)
+    finalWorth = np.empty(scenarios)
+    metrics = {field: np.empty(scenarios) for field in ('cagr', 'max_drawdown', 'volatility')} if summary else {}
+
+    distinctInvestments_amount = len(idealProportion)
+    scenarioBytes = 2 * int(horizons.max()) * 52 * distinctInvestments_amount * 8 # growth copy + working set
+    chunkSize = max(int(memory_budget // max(scenarioBytes, 1)), 1)
+
+    # Compiled loops cost nothing per call, so each horizon gets its own pass and skips the padded weeks.
+    # The numpy kernel pays per week instead: it pads shorter horizons and runs them all at once
+    # (not with summary: the padded weeks would count in the statistics)
+    backend = resolve_backend(backend)
+    bounds = set(range(0, scenarios, chunkSize)) | {scenarios}
+    if backend != 'numpy' or summary:
+        bounds |= set(np.flatnonzero(np.diff(horizonIndex)) + 1)
+    bounds = sorted(bounds)
+
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        chunk = slice(start, stop)
+        chunkHorizons = horizons[horizonIndex[chunk]]
+        chunkLength = len(chunkHorizons)
+        distinctHorizons = np.unique(chunkHorizons)
+
+        if len(distinctHorizons) == 1:
+            # Shared by every slot, but with its batch axis: a chunk of one scenario is still a batch
+            growth = horizonGrowth[int(distinctHorizons[0])][:, np.newaxis, :]
+        else:
+            # Shorter horizons are padded; their weeks past the end are never read
+            growth = np.zeros((int(distinctHorizons[-1]) * 52, chunkLength, distinctInvestments_amount))
+            for horizon in distinctHorizons.tolist():
+                growth[:horizon * 52, chunkHorizons == horizon] = horizonGrowth[horizon][:, np.newaxis, :]
+
+        endWeeks = distinctHorizons * 52 - 1
+        timeline = run_rebalancing(
+            start_amounts[startIndex[chunk], np.newaxis] * idealProportion,
+            growth,
+            np.broadcast_to(idealProportion, (chunkLength, distinctInvestments_amount)),
+            thresholds[strategyIndex[chunk]],
+            monthly_amounts[monthlyIndex[chunk]] * 12 / 52,
+            backend=backend,
+            record_weeks=np.empty(0, dtype=int) if summary else endWeeks,
+            policy=policy,
+            summary=summary
+        )
+
+        if summary:
+            timeline, finals = timeline
+            finalWorth[chunk] = finals.final_worth
+            for field, values in metrics.items():
+                values[chunk] = getattr(finals, field)
+        else:
+            slot = np.searchsorted(endWeeks, chunkHorizons * 52 - 1)
+            finalWorth[chunk] = timeline.current_amount[slot, np.arange(chunkLength)].sum(axis=-1)
+
+    def grid(values):
+        return values.reshape(len(horizons), len(start_amounts), len(monthly_amounts), len(strategies)).transpose(1, 2, 0, 3)
+    return SweepResult(start_amounts, monthly_amounts, horizons, strategies, grid(finalWorth),
+                       **{field: grid(values) for field, values in metrics.items()})
+
+
+def simulate_paths(inputs, weeklyContribution, paths, seed=randomStreams.DEFAULT_SEED, max_samples=None,
+                   memory_budget=MONTECARLO_MEMORY_BUDGET, percentiles=MONTECARLO_PERCENTILES, backend=None, progress=None,
+                   policy=DEFAULT_POLICY):
+    '''
+        Monte Carlo mode: simulates `paths` random outcomes of the same portfolio at once,
+        by adding a path axis to the random values and to the rebalancing arrays.
+
+        Paths are processed in chunks so the working set stays within `memory_budget` bytes.
+        Percentiles need every path's value, so only a subset of weeks is kept per path
+        (evenly spaced, always including the last one) when the whole timeline wouldn't fit,
+        or when it's longer than `max_samples`.
+
+        progress(done, paths) is called after every chunk; raising from it stops the simulation.
+
+        Returns a MonteCarloResult:
+            weeks:      (samples,) 1-based week numbers that were kept
+            total:      (percentiles, samples) bands of the total portfolio worth
+            per_asset:  (percentiles, samples, assets) bands of each asset's worth
+    '''
+
+    weeks, distinctInvestments_amount = inputs.decay.shape
+    paths = max(int(paths), 1)
+
+    # Half of the budget goes to the kept (float32) samples of every path, half to the chunk working set
+    maxSamples = max(int(memory_budget // 2 // (paths * distinctInvestments_amount * 4)), 1)
+    if max_samples is not None:
+        maxSamples = max(min(maxSamples, int(max_samples)), 1)
+    stride = max(math.ceil(weeks / maxSamples), 1)
+    record_weeks = np.arange(weeks - 1, -1, -stride)[::-1]
+
+    # random normals + growth (float64) + the four engine outputs for the kept weeks
+    pathBytes = (2 * weeks + 4 * len(record_weeks)) * distinctInvestments_amount * 8
+    chunkSize = int(min(max(memory_budget // 2 // max(pathBytes, 1), 1), paths))
+
+    # paths on the last axis, so percentiles partition contiguous memory
+    samples = np.empty((len(record_weeks), distinctInvestments_amount, paths), dtype=np.float32)
+
+    if weeks > 0:
+        randomGrowth = inputs.random_growth.any()
+        if randomGrowth:
+            mean, spread = portfolio_cycles(inputs)
+            generators = randomStreams.asset_generators(inputs.investment_id, seed)
+
+        for start in range(0, paths, chunkSize):
+            chunk = min(chunkSize, paths - start)
+
+            if randomGrowth:
+                # Each asset's stream is drawn path-major, so the outcome doesn't depend on how paths are chunked
+                normals = randomStreams.standard_normals(generators, weeks, paths=chunk, correlation=inputs.correlation).transpose(1, 0, 2)
+                growth = inputs.decay[:, np.newaxis, :] * (mean[:, np.newaxis, :] + spread[:, np.newaxis, :] * normals)
+            else:
+                growth = np.broadcast_to(inputs.decay[:, np.newaxis, :], (weeks, chunk, distinctInvestments_amount))
+
+            timeline = run_rebalancing(
+                inputs.start_amount, growth, inputs.ideal_proportion, inputs.threshold_proportion,
+                weeklyContribution, backend=backend, record_weeks=record_weeks, policy=policy
+            )
+            samples[:, :, start:start + chunk] = timeline.current_amount.transpose(0, 2, 1)
+
+            if progress is not None:
+                progress(start + chunk, paths)
+
+    return MonteCarloResult(
+        investment_id=inputs.investment_id,
+        weeks=record_weeks + 1,
+        percentiles=tuple(percentiles),
+        total=np.percentile(samples.sum(axis=1, dtype=np.float64), percentiles, axis=-1),
+        per_asset=np.percentile(samples, percentiles, axis=-1),
+        paths=paths
+    )
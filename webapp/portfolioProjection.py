@@ -1,4 +1,14 @@
 from webapp import application
+from webapp import appMetrics
+from webapp import portfolioEngine
+from webapp import simulationCache
+from webapp import downsampling
+from webapp import figurePayloads
+from webapp import inflationSchedule
+from webapp import simulationContext
+from webapp import simulationJobs
+from webapp import simulationResult
+from webapp import taxLedger
 
 import dash
 import dash_bootstrap_components as dbc
@@ -10,27 +20,74 @@ from dash import no_update
 from flask import Flask, session
 import pandas as pd
 import numpy as np
+import json
 
 import plotly.graph_objects as go
 import plotly.express as px
 
-# Global variable to store the investments
-investments = []
-portfolioSettings = {
-    'Start Investment Amount': 1000,
-    'Monthly Investment': 100,
-    'Investment Time (years)': 4
-}
-
-
 # Initialize Dash app with the existing Flask server
 dash_app = dash.Dash(__name__, server=application, external_stylesheets=[dbc.themes.BOOTSTRAP], routes_pathname_prefix='/dash/portfolioProjection/')
+dash_app.config.suppress_callback_exceptions = True # the line charts only exist after the first calculation
+figurePayloads.register_decoder(dash_app)
+# Latency and payload metrics of its callbacks (each one registered with @timed_callback), see /metrics
+timed_callback = appMetrics.instrument_dash(dash_app, 'portfolioProjection')
 
 TOOLTIP_STYLE = {"background-color": "black", "color": "white", "border-radius": "5px"}
 LABEL_STYLE = {'font-weight': 'bold'}
 H6_STYLE = {'textAlign': 'center', 'padding': '5px', 'fontWeight': 'bold', 'fontStyle': 'italic'}
 
-MAX_INVESTMENT_TIME = 40
+MAX_INVESTMENT_TIME = 40 # weekly steps: timelines, Monte Carlo paths and sweeps are held whole
+MAX_DAILY_INVESTMENT_TIME = 80 # daily runs are chunked, their memory doesn't grow with the horizon
+MAX_MONTECARLO_PATHS = 5000
+MONTECARLO_CHART_POINTS = 520 # the fan charts don't need every single week
+POINTS_PER_TRACE = 500 # line charts are downsampled (LTTB) above this, full resolution only comes back on zoom
+MAX_CHART_SERIES = 20 # above this many assets, charts show the largest ones and the rest as one "Other" series
+
+# numba is optional and opt-in (requirements-optional.txt and ENGINE_BACKEND): say which kernel this deploy runs.
+# Set on the engine module, so /simulate and the simulation workers (which preload this module) run the same one
+portfolioEngine.DEFAULT_BACKEND = application.config.get('ENGINE_BACKEND') or portfolioEngine.DEFAULT_BACKEND
+application.logger.info("Simulation engine backend: %s", portfolioEngine.resolve_backend())
+
+# Repeated clicks with the same inputs are served from here. The disk tier is shared by every worker on the host
+CACHE_FIGURES = True # also keep the serialized charts, so a repeat request is only a lookup
+simulation_cache = simulationCache.SimulationCache(disk_dir=application.config.get('SIMULATION_CACHE_DIR'))
+
+# Long simulations run on a process pool in the background, the page polls their progress
+BACKGROUND_MIN_WORK = 2_000_000 # asset-weeks (times Monte Carlo paths) below this are calculated within the request
+JOB_POLL_INTERVAL = 500 # ms
+simulation_jobs = (simulationJobs.SimulationJobs(application.config['SIMULATION_JOBS_DIR'], preload=[__name__])
+                   if application.config.get('SIMULATION_JOBS_DIR') else None)
+
+# Profit taxes on what the rebalancer sells, reported only: the worth shown is before them (None: the charts leave taxes out)
+TAX_RULES = (taxLedger.tax_rules(application.config['TAX_BRACKETS'], application.config.get('TAX_EXEMPTION'))
+             if application.config.get('TAX_BRACKETS') is not None else None)
+TAX_COLUMNS = {'realized_gains': 'Realized Gains', 'taxes_paid': 'Taxes Due (not deducted)'} # TaxResult fields shown per asset
+
+# What-if heatmap: final worth over a grid of two settings, the others stay as they are
+SWEEP_STEPS = 20
+SWEEP_AXES = {
+    'start_amount': 'Investment Starting Point ($)',
+    'monthly_amount': 'Monthly Investment ($)',
+    'investment_time': 'Investment Time (years)',
+    'investment_strategy': 'Investment Strategy'
+}
+SWEEP_STRATEGIES = [None, 'Conservative', 'Medium', 'Risky'] # None keeps each investment's own strategy
+
+
+def max_investment_time(time_step):
+    return MAX_DAILY_INVESTMENT_TIME if time_step == 'daily' else MAX_INVESTMENT_TIME
+
+
+def slider_marks(max_investment_time):
+    return {i: str(i) for i in range(0, max_investment_time+1, 5)}
+
+
+def legacy_random_options(time_step):
+    # Legacy streams are seeded from the whole horizon, the chunked daily runs can't reproduce them
+    if time_step == 'weekly':
+        return [{'label': ' Legacy random paths', 'value': 'legacy'}]
+    return [{'label': ' Legacy random paths (weekly steps only)', 'value': 'legacy', 'disabled': True}]
+
 
 dash_app.layout = dbc.Container([
     dbc.Row(
@@ -55,7 +112,96 @@ dash_app.layout = dbc.Container([
                 
                 html.Label('Investment Time (years)', style=LABEL_STYLE),
                 dcc.Slider(id='investment-time-slider', min=0, max=MAX_INVESTMENT_TIME, step=1, value=4,
-                           marks={i: str(i) for i in range(0, MAX_INVESTMENT_TIME+1, 1)})
+                           marks=slider_marks(MAX_INVESTMENT_TIME),
+                           tooltip={'placement': 'bottom'}),
+
+                dbc.Row([
+                    dbc.Col([
+                        html.Label('Monte Carlo Paths', style=LABEL_STYLE, id='montecarlo-paths-label'),
+                        dcc.Input(id='montecarlo-paths', type='number', min=0, max=MAX_MONTECARLO_PATHS, step=100, value=0, style={'width': '100%'}),
+                        dbc.Tooltip('Simulates many random outcomes and shows their distribution. 0 runs a single projection.',
+                                    target='montecarlo-paths-label', style=TOOLTIP_STYLE)
+                    ], width=6, align="center"),
+
+                    dbc.Col([
+                        dcc.Checklist(id='legacy-random-check', options=legacy_random_options('weekly'), value=[],
+                                      style={'marginTop': '25px'}),
+                        dbc.Tooltip('Reproduces the random growth numbers from older versions of this dashboard.',
+                                    target='legacy-random-check', style=TOOLTIP_STYLE)
+                    ], width=6, align="center")
+                ]),
+
+                dbc.Row([
+                    dbc.Col([
+                        html.Label('Chart Resolution', style=LABEL_STYLE, id='chart-resolution-label'),
+                        dcc.Dropdown(id='chart-resolution', options=[
+                            {'label': 'Daily', 'value': 'daily'},
+                            {'label': 'Weekly', 'value': 'weekly'},
+                            {'label': 'Monthly', 'value': 'monthly'},
+                            {'label': 'Yearly', 'value': 'yearly'}
+                        ], value='weekly', clearable=False),
+                        dbc.Tooltip(f'Long weekly timelines are simplified to {POINTS_PER_TRACE} points per line, zoom in to see every week.',
+                                    target='chart-resolution-label', style=TOOLTIP_STYLE)
+                    ], width=6, align="center"),
+
+                    dbc.Col([
+                        html.Label('Rebalancing', style=LABEL_STYLE, id='rebalancing-policy-label'),
+                        dcc.Dropdown(id='rebalancing-policy', options=[
+                            {'label': 'Weekly', 'value': 'weekly'},
+                            {'label': 'Monthly', 'value': 'monthly'},
+                            {'label': 'Quarterly', 'value': 'quarterly'},
+                            {'label': 'Only when a threshold is crossed', 'value': 'threshold'}
+                        ], value=portfolioEngine.DEFAULT_POLICY, clearable=False),
+                        dbc.Tooltip('How often the portfolio sells what is above its threshold and buys back what is below its ideal proportion. '
+                                    'In between, monthly investments are split by the ideal proportions.',
+                                    target='rebalancing-policy-label', style=TOOLTIP_STYLE)
+                    ], width=6, align="center")
+                ]),
+
+                dbc.Row([
+                    dbc.Col([
+                        html.Label('Time Step', style=LABEL_STYLE, id='time-step-label'),
+                        dcc.Dropdown(id='time-step', options=[
+                            {'label': 'Weekly', 'value': 'weekly'},
+                            {'label': 'Daily', 'value': 'daily'}
+                        ], value='weekly', clearable=False),
+                        dbc.Tooltip('Daily steps simulate every day of the horizon. They always use per-asset random paths, '
+                                    'and Monte Carlo simulations need weekly steps.',
+                                    target='time-step-label', style=TOOLTIP_STYLE)
+                    ], width=6, align="center"),
+
+                    dbc.Col([
+                        html.Label('Values', style=LABEL_STYLE, id='value-view-label'),
+                        dcc.RadioItems(id='value-view', options=[
+                            {'label': ' Nominal', 'value': 'nominal'},
+                            {'label': " Real (today's money)", 'value': 'real'}
+                        ], value='nominal', inline=True, inputStyle={'marginLeft': '10px'}),
+                        dbc.Tooltip('Real values take the inflation below out of every amount. Both views come from the same simulation.',
+                                    target='value-view-label', style=TOOLTIP_STYLE)
+                    ], width=6, align="center")
+                ]),
+
+                dbc.Row([
+                    dbc.Col([
+                        html.Label('Inflation', style=LABEL_STYLE),
+                        dcc.Dropdown(id='inflation-mode', options=[
+                            {'label': 'Constant', 'value': 'constant'},
+                            {'label': 'Changes over the years', 'value': 'yearly'},
+                            {'label': 'Uploaded series', 'value': 'series'}
+                        ], value='constant', clearable=False)
+                    ], width=6, align="center"),
+
+                    dbc.Col([
+                        html.Label('Inflation (%)', style=LABEL_STYLE, id='inflation-value-label'),
+                        dcc.Input(id='inflation-value', type='text', value='4', style={'width': '100%'}),
+                        dbc.Tooltip('Constant: one yearly rate, like 4. Changes over the years: "year: rate" pairs, like "0: 6, 5: 4", '
+                                    'each rate holds until the next year listed.',
+                                    target='inflation-value-label', style=TOOLTIP_STYLE)
+                    ], width=6, align="center")
+                ]),
+
+                dcc.Upload(id='inflation-upload', children=html.A('Upload an inflation series (CSV, one yearly rate in % per row)'),
+                           accept='.csv', style={'marginTop': '10px'})
             ], style={'background': '#f5f5f5', 'padding': '2px 15px 15px 15px', 'borderRadius': '5px'}),
 
             html.Br(),
@@ -71,6 +217,8 @@ dash_app.layout = dbc.Container([
             # Hidden Containers
             html.Div(id='div-assetsBackup', style={'display': 'none'}),
             html.Div(id='hide-table-flag', style={'display': 'none'}),
+            dcc.Store(id='simulation-job'),
+            dcc.Interval(id='simulation-poll', interval=JOB_POLL_INTERVAL, disabled=True),
 
             # Display Areas
             dcc.Loading(
@@ -81,210 +229,256 @@ dash_app.layout = dbc.Container([
                 ],
                 style={'height': '100%', 'display': 'flex', 'alignItems': 'flex-start'}
             ),
+
+            html.Br(),
+
+            # What-if Heatmap
+            html.Div([
+                html.H6('What-if Heatmap', style={**H6_STYLE, 'color': '#55bee0'}),
+                dbc.Row([
+                    dbc.Col([
+                        html.Label('Horizontal Axis', style=LABEL_STYLE, id='sweep-x-label'),
+                        dcc.Dropdown(id='sweep-x', options=[{'label': label, 'value': axis} for axis, label in SWEEP_AXES.items()],
+                                     value='investment_time', clearable=False),
+                        dbc.Tooltip('Every other setting stays as in Portfolio Settings.',
+                                    target='sweep-x-label', style=TOOLTIP_STYLE)
+                    ], width=6, align="center"),
+
+                    dbc.Col([
+                        html.Label('Vertical Axis', style=LABEL_STYLE),
+                        dcc.Dropdown(id='sweep-y', options=[{'label': label, 'value': axis} for axis, label in SWEEP_AXES.items()],
+                                     value='monthly_amount', clearable=False)
+                    ], width=6, align="center")
+                ]),
+                html.Br(),
+                html.Button('Calculate What-if Grid', id='sweep-button', className='btn btn-primary')
+            ], style={'background': '#f5f5f5', 'padding': '2px 15px 15px 15px', 'borderRadius': '5px'}),
+
+            dcc.Loading(
+                id="loading-sweep",
+                type="default",
+                children=[
+                    html.Div(id='sweep-div')
+                ]
+            ),
         ])
     )  
 ], fluid=True, style={'marginTop': '20px'})
 
 # --------------------- CALLBACKS SECTION --------------
 
-def calc_portfolio(portfolioSettings):
+def get_portfolio_inputs(context):
+
+    if context is None:
+        return no_update
+
+    return simulationContext.portfolio_inputs(context)
+
 
-    global investments
+def simulate_timeline(context):
+    '''
+        Returns (investment ids, EngineResult) for the context's portfolio,
+        straight from simulation_cache when the same inputs were already simulated.
+    '''
 
-    if 'investments' in session and session['investments']:
-        investments = session['investments']
-        df = pd.DataFrame(investments)
-    else:
+    if context is None:
         return no_update
-    
-    startInvestment = portfolioSettings.get('Start Investment Amount', 0)
-    monthlyInvestment = portfolioSettings.get('Monthly Investment', 0)
-    investmentTime = portfolioSettings.get('Investment Time (years)', 0)
-
-    distinctInvestments_amount = df.shape[0]
-    # re-scaling idealProportion and expectedGrowth
-    df['ideal_proportion'] /= df['ideal_proportion'].sum()
-    df['expected_growth'] /= 100
-
-    # Re-labeling risks and volatility
-    df['investment_strategy'] = df['investment_strategy'].map({
-                                                                'Conservative': 1.0375,
-                                                                'Medium': 1.075,
-                                                                'Risky': 1.15
-                                                            })
-
-    df['asset_volatility'] = df['asset_volatility'].map({
-                                                        'High': 10,
-                                                        'Mid': 6,
-                                                        'Low': 3
-                                                    })
-    
-    # Disabling random number generation where necessary
-    df.loc[df['random_growth'] == False, 'asset_volatility'] = 0
-
-    # Basically a linear function, with sine-wave at the higher end to smooth it.
-    thresholdProportion = \
-        np.minimum(
-            (np.sin(df['ideal_proportion'] * 0.5 * np.pi)
-                + (df['ideal_proportion'] * 0.7))/ (0.7 + 1),
-            df['ideal_proportion'] * df['investment_strategy']
+
+    cache_key = simulationCache.canonical_key(*simulationContext.cache_parts(context), kind='timeline')
+    cached = simulation_cache.get(cache_key)
+    if cached is not None:
+        return cached['investment_id'], portfolioEngine.EngineResult(*(cached[field] for field in portfolioEngine.EngineResult._fields))
+
+    if context.settings.time_step != 'weekly':
+        # Daily steps run in chunks (float32 results), memory stays flat on long horizons
+        settings = context.settings
+        chunked = portfolioEngine.simulate_chunked(list(context.investments), settings.start_amount, settings.monthly_amount,
+                                                   settings.investment_time, time_step=settings.time_step,
+                                                   policy=settings.rebalancing_policy)
+        investment_ids = chunked.investment_id.astype(str)
+        simulation_cache.set(cache_key, {'investment_id': investment_ids, **chunked.timeline._asdict()})
+        return investment_ids, chunked.timeline
+
+    # Every setting but the horizon: runs that only differ on it can extend each other
+    checkpoint_key = simulationCache.canonical_key(*simulationContext.cache_parts(context, investment_time=None), kind='checkpoint')
+
+    inputs = get_portfolio_inputs(context)
+    timeline, checkpoint = portfolioEngine.simulate_timeline(
+        inputs,
+        context.settings.monthly_amount*12/52,
+        random_mode='legacy' if context.settings.legacy_random else 'per_asset',
+        previous=simulation_cache.get(checkpoint_key),
+        policy=context.settings.rebalancing_policy
     )
 
-    investmentTime_inWeeks = investmentTime * 52
-    
-    # Initializing balances and setting actual investment amount for each investment
-    totalSold = np.zeros(distinctInvestments_amount)
-    totalBought = np.zeros(distinctInvestments_amount)
-    currentAmount = np.array(startInvestment * df['ideal_proportion'])
-
-    # Initializing random_values
-    random_values = None
-
-    # (if enabled) Pre-calculate Expected Growth decay
-    # Tends to the median growth (if growth > median)
-    median_growth = df['expected_growth'].median()
-
-    # Compound interest conversion from annual to weekly growth
-    df['expected_growth'] = (1 + df['expected_growth']) ** (1/52) - 1
-
-    decay_2DList = np.array([
-        np.linspace(
-            start,
-            ((median_growth * 10 + start) / 11),
-            num=investmentTime_inWeeks
-        ) if start > median_growth else np.full(investmentTime_inWeeks, start)
-        for start in df['expected_growth']
-    ])
+    if checkpoint is not None:
+        simulation_cache.set(checkpoint_key, checkpoint)
 
-    # ------------ Pre calculating random values section
-    def vectorized_genPseudoRdNum(
-            weeks,randomStd, nameLen,
-            vol_Dur,vol_Mag, volPhase,
-            trend_Dur, trend_Mag, trendPhase
-            ):
-        
-        '''
-            Generates an ndArray of 'weeks' size with pre-calculations for bull-bear cycles, and volatility cycles.
-            This function is divided in x steps:
-                - It calculates a predictable seed
-                - Transforms user input into formula-friendly versions
-                - Use Sine wave functions to oscillate both cycles
-                - Returns pseudo-random number for all weeks, with oscilating mean (bbCycles) and spread (volCycles)
-
-        '''
-
-        # This makes the seed predictable, enabling the user to test portfolio performance on average if he wants to.
-        nameLen_ext = np.tile(nameLen, (len(weeks), 1)) # making nameLen match the shape of weeks
-        seedCalc = ((weeks + nameLen_ext[:,0])).astype(int)
-        np.random.seed(seedCalc)
-
-        # Formula for translating years to the phased cycle 
-        transformed_vol_Dur = (1/vol_Dur/52)
-        transformed_trend_Dur = (1/trend_Dur/52)
-
-        # Allows the user to pick the phase of each cycle
-        vol_phaseShift = volPhase * np.pi / (transformed_trend_Dur * np.pi)
-        bb_phaseShift = trendPhase * (2 * np.pi) / (transformed_trend_Dur * np.pi)
-        
-        volatilityCycle = np.maximum(
-                            np.abs(
-                                np.sin(
-                                    (weeks[:, np.newaxis] - vol_phaseShift) * transformed_vol_Dur * np.pi
-                                ) * vol_Mag
-                            ) + 1e-10,
-                        0.35) # Minimum Volatility allowed
-
-        # ---------------- Making Volatility Cycles have a floor. Floor is smoothed for niceness
-        def sigmoid(x):
-            return 1 / (1 + np.exp(-x))
-
-        PARAM_FLOOR = 0.5
-        scaling_factor = 1 / PARAM_FLOOR * 1.4 # empirically gives the smoothest curves for any PARAM_FLOOR
-        scaled_volatility = (volatilityCycle - PARAM_FLOOR) * scaling_factor
-
-        sVolatilityCycle = sigmoid(scaled_volatility) * (volatilityCycle - PARAM_FLOOR) + PARAM_FLOOR
-
-        # wrapping trend's formula in a function allows me to easily cap de-growth
-        def trendCycle_func(weeks, transformed_trend_Dur, bb_phaseShift, trend_Mag):
-            return (np.sin((weeks[:, np.newaxis] - bb_phaseShift) * transformed_trend_Dur * np.pi) * trend_Mag)
-        
-        trendCycle = np.maximum(trendCycle_func(weeks, transformed_trend_Dur, bb_phaseShift, trend_Mag),
-                        trendCycle_func(weeks, transformed_trend_Dur, bb_phaseShift, trend_Mag = np.minimum(0.95, trend_Mag)))
-
-
-        # Create an array of random numbers with shape (investmentTime_inWeeks, number_of_rows)
-        return np.array([np.random.normal(1 * (1+trendCycle[i]), randomStd * sVolatilityCycle[i]) 
-                                for i in range(len(weeks))])
-    
+    investment_ids = inputs.investment_id.astype(str)
+    simulation_cache.set(cache_key, {'investment_id': investment_ids, **timeline._asdict()})
 
-    
-    if df['random_growth'].any(): # skipping pre-calculation if there's no randomGrowth checked
-        weeks = np.arange(1, investmentTime_inWeeks + 1)
-        random_values = vectorized_genPseudoRdNum(
-            weeks, 
-            df['asset_volatility'].to_numpy(), 
-            df['investment_id'].str.len().to_numpy(),
-            df['volatility_duration'].to_numpy(),
-            df['volatility_magnitude'].to_numpy(),
-            df['volatility_phase'].to_numpy(),
-            df['bullbear_duration'].to_numpy(),
-            df['bullbear_magnitude'].to_numpy(),
-            df['bullbear_phase'].to_numpy()
-        )
+    return investment_ids, timeline
+
+
+def calc_portfolio(context):
+    '''
+        The context's simulation as a PortfolioTimeline; .to_frame() gives the long-format DataFrame.
+    '''
 
-    results = []
-    for week in range(1, investmentTime_inWeeks + 1):
-        # Getting precalculated values for Decay Growth
-        weekGrowth = decay_2DList[:, week-1]        
-        
-        # skipping calculation if there's no randomGrowth checked
-        if random_values is not None:
-            weekGrowth *=  random_values[week - 1]
+    simulation = simulate_timeline(context)
+    if simulation is no_update:
+        return no_update
 
-        # Casting compound growth
-        currentAmount += currentAmount * weekGrowth
+    return simulationResult.PortfolioTimeline.from_engine(*simulation)
 
-        # -------------------- Rebalancing Portfolio Section
-        thresholdInvestment = thresholdProportion * currentAmount.sum()
-        idealInvestment = df['ideal_proportion'] * currentAmount.sum()
 
-        # Calculate the Selling Delta based on threshold trigger
-        sellingDelta = np.maximum(currentAmount - thresholdInvestment, np.zeros(distinctInvestments_amount))        
+def calc_portfolio_distribution(context, paths, progress=None):
 
-        totalSold += sellingDelta
+    inputs = get_portfolio_inputs(context)
+    if inputs is no_update:
+        return no_update
 
-        # Update the 'Current Amount' column based on threshold trigger
-        currentAmount = np.minimum(currentAmount, thresholdInvestment)
-        soldAmount = sellingDelta.sum()
+    # Per-asset streams with a fixed seed: same portfolio, same distribution
+    return portfolioEngine.simulate_paths(
+        inputs,
+        context.settings.monthly_amount*12/52,
+        paths,
+        max_samples=MONTECARLO_CHART_POINTS,
+        progress=progress,
+        policy=context.settings.rebalancing_policy
+    )
 
-        # Calculate toBuy delta (how much each investment needs to be bought in theory)
-        toBuy_Delta = np.maximum(idealInvestment - currentAmount, np.zeros(distinctInvestments_amount))
 
-        # Actually 'buying' assets, with the money left in 'soldAmount' + Monthly Contributions
-        #  First half: transform toBuy_Delta in proportion
-        # Second half: multiply each proportion with the amount of money in the balance
-        toBuy_Proportion = toBuy_Delta / (toBuy_Delta.sum() + 1e-10)
+def add_fan_traces(figure, weeks, bands, percentiles, name, color, outer_bands=True):
+    '''
+        Draws percentile bands as shaded areas around the median line.
+        bands is (percentiles, weeks), with percentiles symmetric around the median.
+    '''
+
+    r, g, b = px.colors.hex_to_rgb(color)
+    middle = len(percentiles) // 2
+    years = weeks // 52
+
+    # outermost pair first, so inner bands are drawn darker on top
+    pairs = list(zip(range(middle), range(len(percentiles) - 1, middle, -1)))
+
+    for depth, (low, high) in enumerate(pairs, start=1):
+        if not outer_bands and depth < len(pairs):
+            continue
+        opacity = 0.15 * depth
+        label = f"{name} P{percentiles[low]}-P{percentiles[high]}"
+        figure.add_trace(go.Scatter(x=weeks, y=bands[high], mode='lines', line={'width': 0},
+                                    legendgroup=label, showlegend=False, hoverinfo='skip'))
+        figure.add_trace(go.Scatter(x=weeks, y=bands[low], mode='lines', line={'width': 0}, name=label,
+                                    legendgroup=label, fill='tonexty', fillcolor=f'rgba({r},{g},{b},{opacity})',
+                                    hoverinfo='skip'))
+
+    figure.add_trace(go.Scatter(x=weeks, y=bands[middle], mode='lines', line={'color': color}, name=f"{name} (median)",
+                                customdata=years, hovertemplate='Week: %{x}<br>$%{y:,.2f}<br>Current Year: %{customdata}'))
+
+
+def top_assets(weights, limit=MAX_CHART_SERIES):
+    '''
+        (indexes of the assets charted on their own, label of the rest or None).
+        Up to `limit` assets are all charted, in their order. Above that, the limit - 1 heaviest
+        ones are (by `weights`, largest first) and every other asset goes into one "Other" series.
+    '''
+
+    if len(weights) <= limit:
+        return np.arange(len(weights)), None
+    shown = np.argsort(-np.asarray(weights), kind='stable')[:limit - 1]
+    return shown, f"Other ({len(weights) - len(shown):,} assets)"
+
+
+def other_total(values, shown):
+    ''' Sum of every column of (weeks, assets) `values` but the shown ones, (weeks,). '''
+    rest = np.ones(values.shape[1])
+    rest[shown] = 0
+    return values @ rest
+
+
+@appMetrics.stage(appMetrics.FIGURE_BUILD)
+def build_fan_charts(distribution):
+    total_chart = go.Figure()
+    add_fan_traces(total_chart, distribution.weeks, distribution.total, distribution.percentiles,
+                   'Total', px.colors.qualitative.Plotly[0])
+    total_chart.update_layout(title=f"Total Amount ($) through Time, {distribution.paths:,} simulations",
+                              xaxis_title='Week', yaxis_title='Current Amount ($)')
+
+    # Only the inner band per asset, otherwise the chart gets unreadable. Percentiles of the
+    # other assets' sum can't be told from theirs: with too many assets, only the largest ones are drawn
+    asset_chart = go.Figure()
+    colors = px.colors.qualitative.Plotly
+    shown, other = top_assets(distribution.per_asset[len(distribution.percentiles) // 2, -1])
+    for i in shown:
+        add_fan_traces(asset_chart, distribution.weeks, distribution.per_asset[:, :, i], distribution.percentiles,
+                       distribution.investment_id[i], colors[i % len(colors)], outer_bands=False)
+    title = "Current Amount ($) through Time by Investment ID, median and P25-P75"
+    if other is not None:
+        title += f", largest {len(shown)} of {len(distribution.investment_id):,}"
+    asset_chart.update_layout(title=title, xaxis_title='Week', yaxis_title='Current Amount ($)')
+
+    return figurePayloads.typed_graph('fan-chart-total', total_chart), figurePayloads.typed_graph('fan-chart-by-type', asset_chart)
+
+
+def step_label(steps_per_year):
+    return 'Day' if steps_per_year == portfolioEngine.STEPS_PER_YEAR['daily'] else 'Week'
+
+
+@appMetrics.stage(appMetrics.FIGURE_BUILD)
+def line_chart_by_type(investment_ids, timeline, resolution='weekly', week_range=None, steps_per_year=52):
+    weeks = np.arange(1, timeline.current_amount.shape[0] + 1)
+
+    # The largest assets at the end of the run, the same ones at any zoom level
+    amounts = timeline.current_amount
+    shown, other = top_assets(amounts[-1] if len(amounts) else np.zeros(amounts.shape[1]))
+    names = list(np.asarray(investment_ids)[shown])
+    if other is not None:
+        amounts = np.column_stack([amounts[:, shown], other_total(amounts, shown)])
+        names.append(other)
+
+    x, y = downsampling.resample(weeks, amounts, POINTS_PER_TRACE, resolution, week_range, steps_per_year)
+    step = step_label(steps_per_year)
+
+    figure = go.Figure([
+        go.Scatter(x=x[:, i], y=y[:, i], mode='lines', name=investment_id, customdata=x[:, i] // steps_per_year,
+                   hovertemplate=step + ': %{x}<br>Current Amount ($): %{y}<br>Current Year: %{customdata}')
+        for i, investment_id in enumerate(names)
+    ])
+    figure.update_layout(title="Current Amount ($) through Time by Investment ID", legend_title_text='investment_id',
+                         xaxis_title=step, yaxis_title='Current Amount ($)', xaxis_range=week_range)
+    return figure
 
-        if np.sum(toBuy_Proportion) == 0:
-            toBuy_Proportion = np.full(distinctInvestments_amount, 1/distinctInvestments_amount)
 
-        boughtValues =  toBuy_Proportion * np.round(soldAmount + (monthlyInvestment*12/52), 2)
+@appMetrics.stage(appMetrics.FIGURE_BUILD)
+def line_chart_total(timeline, resolution='weekly', week_range=None, steps_per_year=52):
+    weeks = np.arange(1, timeline.current_amount.shape[0] + 1)
+    x, y = downsampling.resample(weeks, timeline.current_amount.sum(axis=1), POINTS_PER_TRACE, resolution, week_range, steps_per_year)
+    step = step_label(steps_per_year)
 
-        totalBought += boughtValues
+    figure = go.Figure(go.Scatter(x=x, y=y, mode='lines', customdata=x // steps_per_year,
+                                  hovertemplate=step + ': %{x}<br>Current Amount ($): %{y}<br>Current Year: %{customdata}'))
+    figure.update_layout(title="Total Amount ($) through Time", xaxis_title=step, yaxis_title='Current Amount ($)',
+                         xaxis_range=week_range)
+    return figure
 
-        currentAmount += boughtValues
-        actualProportion = currentAmount / (currentAmount.sum() + 1e-10)
-        # --------------------------- Storing Info in TimeLine
 
-        results.extend(list(zip(df['investment_id'], currentAmount, [week]*distinctInvestments_amount, totalSold, totalBought, actualProportion)))
+def zoomed_week_range(relayoutData):
+    '''
+        The week range the user zoomed into, None when they reset the zoom,
+        or no_update for every other relayout event (legend clicks, panning the y axis...).
+    '''
 
+    if not relayoutData:
+        return no_update
+    if 'xaxis.range[0]' in relayoutData and 'xaxis.range[1]' in relayoutData:
+        return [relayoutData['xaxis.range[0]'], relayoutData['xaxis.range[1]']]
+    if 'xaxis.range' in relayoutData:
+        return list(relayoutData['xaxis.range'])
+    if relayoutData.get('xaxis.autorange'):
+        return None
+    return no_update
 
-    return pd.DataFrame(
-                        results,
-                        columns=[
-                            'investment_id','Current Amount ($)','Week',
-                            'Total Sold','Total Bought','Actual Proportion (%)'
-                        ])
 
 # Callback for disabling options when random-growth-check is off
 @dash_app.callback(
@@ -294,6 +488,7 @@ def calc_portfolio(portfolioSettings):
     ],
     [Input('random-growth-check', 'value')]
 )
+@timed_callback
 def update_asset_volatility_and_advanced_settings(random_growth_value):
     is_disabled = len(random_growth_value) == 0
     # If checkbox is unchecked (i.e., value is empty), hide the div
@@ -302,42 +497,132 @@ def update_asset_volatility_and_advanced_settings(random_growth_value):
     return is_disabled, div_style
 
 
-# Callback for plotting the calculation
+# Callback for the settings that depend on the time step: daily runs go further, without legacy paths
 @dash_app.callback(
-    Output('charts-div', 'children'),
-    Input('calculate-button', 'n_clicks'),
     [
-        State('investment-start-amount', 'value'),
-        State('investment-monthly-amount', 'value'),
-        State('investment-time-slider', 'value')
-    ]      
+        Output('investment-time-slider', 'max'),
+        Output('investment-time-slider', 'marks'),
+        Output('legacy-random-check', 'options')
+    ],
+    [Input('time-step', 'value')]
 )
-def calc_and_display_portfolio(n, investment_start_amount, investment_monthly_amount, investment_time):
-    global investments
+@timed_callback
+def update_time_step_settings(time_step):
+    maxInvestmentTime = max_investment_time(time_step)
+    return maxInvestmentTime, slider_marks(maxInvestmentTime), legacy_random_options(time_step)
+
+
+def simulation_job(context, paths, progress=None):
+    '''
+        Everything a click needs, as plain arrays. Runs within the request for small portfolios,
+        or on simulation_jobs' process pool for long ones, with progress(fraction, message).
+    '''
+
+    if progress is not None:
+        progress(0, 'Simulating the portfolio timeline')
+    investment_ids, timeline = simulate_timeline(context)
+    result = {'investment_id': investment_ids, **timeline._asdict()}
+
+    if TAX_RULES is not None:
+        taxes = taxLedger.tax_ledger(get_portfolio_inputs(context).start_amount, timeline, TAX_RULES,
+                                     portfolioEngine.STEPS_PER_YEAR[context.settings.time_step])
+        result.update({f'tax_{field}': getattr(taxes, field) for field in TAX_COLUMNS})
+
+    if paths:
+        report = None
+        if progress is not None:
+            report = lambda done, total: progress(0.1 + 0.9 * done / total, f'Monte Carlo: {done:,} of {total:,} simulations')
+        distribution = calc_portfolio_distribution(context, paths, progress=report)
+        result.update({f'montecarlo_{field}': np.asarray(value) for field, value in distribution._asdict().items() if field != 'investment_id'})
+
+    return result
+
+
+def unpack_simulation(result):
+    '''
+        (investment ids, EngineResult, MonteCarloResult or None) from a simulation_job() result.
+    '''
+
+    investment_ids = result['investment_id']
+    timeline = portfolioEngine.EngineResult(*(result[field] for field in portfolioEngine.EngineResult._fields))
+
+    distribution = None
+    if 'montecarlo_total' in result:
+        distribution = portfolioEngine.MonteCarloResult(
+            investment_id=investment_ids,
+            weeks=result['montecarlo_weeks'],
+            percentiles=tuple(int(percentile) for percentile in result['montecarlo_percentiles']),
+            total=result['montecarlo_total'],
+            per_asset=result['montecarlo_per_asset'],
+            paths=int(result['montecarlo_paths'])
+        )
 
-    # Updating the global portfolioSettings before calling calc_portfolio
-    portfolioSettings['Investment Time (years)'] = min(investment_time, MAX_INVESTMENT_TIME) # Just in case the front-end sends a huge value, cap at 40 years
-    portfolioSettings['Start Investment Amount'] = investment_start_amount 
-    portfolioSettings['Monthly Investment'] = investment_monthly_amount
+    return investment_ids, timeline, distribution
 
-    # df = pd.DataFrame(investments)
-    timeline_df = calc_portfolio(portfolioSettings)
 
-    # Return early if there's no update
-    if timeline_df is no_update:
-        return ""
+def unpack_taxes(result):
+    '''
+        {TaxResult field: per-asset values} of TAX_COLUMNS from a simulation_job() result, None without taxes.
+    '''
+
+    if 'tax_taxes_paid' not in result:
+        return None
+    return {field: result[f'tax_{field}'] for field in TAX_COLUMNS}
+
+
+def simulation_progress(status):
+    percent = 100 * status.get('progress', 0)
+    message = status.get('message') or 'Waiting for a free simulation worker...'
+    return html.Div([
+        html.H5(message, style={'textAlign': 'center'}),
+        dbc.Progress(value=percent, label=f"{percent:.0f}%", striped=True, animated=True)
+    ], style={'padding': '20px', 'width': '100%'})
+
 
+def deflate_run(timeline, distribution, inflation, steps_per_year=52):
+    '''
+        (timeline, distribution) in today's money, for yearly inflation rates (%). distribution may be None.
+    '''
+
+    deflator = inflationSchedule.deflators(inflation, timeline.current_amount.shape[0], steps_per_year)
+    if distribution is not None:
+        distribution = inflationSchedule.deflate_distribution(distribution, deflator)
+    return inflationSchedule.deflate(timeline, deflator), distribution
+
+
+@appMetrics.stage(appMetrics.FIGURE_BUILD)
+def display_portfolio(settings, investment_ids, timeline, distribution, chart_resolution, taxes=None, inflation=None):
+    '''
+        The charts of a run. With inflation (yearly rates in %), every amount is shown in today's money:
+        the nominal run, deflated.
+    '''
+
+    stepsPerYear = portfolioEngine.STEPS_PER_YEAR[settings.time_step]
+    nominal_worth = None
+    if inflation is not None:
+        # No steps (a horizon of 0): worth nothing, like PortfolioTimeline.final_worth
+        nominal_worth = float(timeline.current_amount[-1].sum()) if timeline.current_amount.shape[0] else 0.0
+        timeline, distribution = deflate_run(timeline, distribution, inflation, stepsPerYear)
+    result = simulationResult.PortfolioTimeline.from_engine(investment_ids, timeline)
 
     # ------------------------------- calculations for plotting -------------------------------
     # Calculate the current worth of the portfolio
-    current_worth = timeline_df[timeline_df['Week'] == timeline_df['Week'].max()]['Current Amount ($)'].sum()
-    investment_start_amount = 1 if investment_start_amount == 0 else investment_start_amount
+    current_worth = result.final_worth()
+    investment_start_amount = 1 if settings.start_amount == 0 else settings.start_amount
     
     # Calculate the percentage growth compared to 'Start Investment Amount'
     percentage_growth = ((current_worth - investment_start_amount) / investment_start_amount + 1e-16) * 100
 
-    # Converting Weeks to Years
-    timeline_df['Current Year'] = timeline_df['Week'] // 52
+    # Per-asset totals over every week, sorted by investment_id like a groupby would
+    per_asset = pd.DataFrame({
+        'investment_id': result.assets.astype(str),
+        **{column: result.per_asset_sum(metric).to_numpy()
+           for metric, column in simulationResult.METRIC_COLUMNS.items() if metric != 'current_amount'}
+    })
+    if taxes is not None:
+        for field, column in TAX_COLUMNS.items():
+            per_asset[column] = taxes[field]
+    per_asset = per_asset.sort_values('investment_id', ignore_index=True)
 
     # ------------------------------- Plotting -------------------------------
 
@@ -346,9 +631,23 @@ def calc_and_display_portfolio(n, investment_start_amount, investment_monthly_am
         html.H3(f"Your portfolio is now worth: ${current_worth:,.2f}", style={'color': 'green', 'font-weight': 'bold'}),
         html.H5(f"Your portfolio grew by: {percentage_growth:.2f}%")
     ], style={'border': '1px solid #ddd', 'padding': '10px', 'border-radius': '5px', 'margin-bottom': '20px'})
+    if nominal_worth is not None:
+        summary_div.children[0].children = f"Your portfolio is now worth: ${current_worth:,.2f} in today's money"
+        summary_div.children.append(html.H5(f"That's ${nominal_worth:,.2f} before inflation"))
+    if taxes is not None:
+        summary_div.children.append(
+            html.H5(f"Profit taxes due: ${taxes['taxes_paid'].sum():,.2f}, on ${taxes['realized_gains'].sum():,.2f} of realized gains"
+                    + (" (in the dollars of each sale)" if inflation is not None else "")
+                    + ". They're an estimate, not deducted from the worth above")
+        )
 
     # Create the Pie Chart
-    grouped_df = timeline_df.groupby('investment_id').sum()['Actual Proportion (%)'].reset_index()
+    grouped_df = per_asset[['investment_id', 'Actual Proportion (%)']]
+    proportions = grouped_df['Actual Proportion (%)'].to_numpy()
+    shown, other = top_assets(proportions)
+    if other is not None:
+        otherSlice = pd.DataFrame({'investment_id': [other], 'Actual Proportion (%)': [np.delete(proportions, shown).sum()]})
+        grouped_df = pd.concat([grouped_df.iloc[shown], otherSlice], ignore_index=True)
     pie_chart = dcc.Graph(
         figure=px.pie(
             grouped_df,
@@ -358,33 +657,15 @@ def calc_and_display_portfolio(n, investment_start_amount, investment_monthly_am
             )
     )
 
-    # Create the Line Chart for each Investment ID
-    line_chart_by_type = dcc.Graph(
-        figure=px.line(
-            timeline_df,
-            x='Week',
-            y='Current Amount ($)',
-            color='investment_id',
-            title="Current Amount ($) through Time by Investment ID",
-            hover_data=['Current Year']
-            )
-    )
-
-    # Create the Line Chart for the Total Amount
-    priceHistory = timeline_df.groupby('Week', as_index=False)['Current Amount ($)'].sum()
-    priceHistory['Current Year'] = priceHistory['Week'] // 52
-    line_chart_total = dcc.Graph(
-        figure=px.line(
-            priceHistory,
-            x='Week',
-            y='Current Amount ($)',
-            title="Total Amount ($) through Time",
-            hover_data= ['Current Year']
-            )
-    )
+    # Line charts only carry POINTS_PER_TRACE points per line, zooming in asks for the full resolution
+    line_chart_by_type_graph = figurePayloads.typed_graph(
+        'line-chart-by-type', line_chart_by_type(investment_ids, timeline, chart_resolution, steps_per_year=stepsPerYear))
+    line_chart_total_graph = figurePayloads.typed_graph(
+        'line-chart-total', line_chart_total(timeline, chart_resolution, steps_per_year=stepsPerYear))
 
-    # Mini table with total sold and bought amounts for each asset
-    mini_table_data = timeline_df[['investment_id', 'Total Sold', 'Total Bought']].groupby('investment_id', as_index = False).sum().round(2)
+    # Mini table with total sold and bought amounts for each asset (and the taxes on what was sold)
+    mini_table_data = per_asset[['investment_id', 'Total Sold', 'Total Bought'] +
+                                (list(TAX_COLUMNS.values()) if taxes is not None else [])].round(2)
     mini_table = dash_table.DataTable(
         id='mini-investment-table',
         columns=[{'name': i, 'id': i} for i in mini_table_data.columns],
@@ -392,7 +673,7 @@ def calc_and_display_portfolio(n, investment_start_amount, investment_monthly_am
         style_table={'margin-top': '20px'}
     )
 
-    return [
+    charts = [
         summary_div,        
         # Row for the charts
         dbc.Row([
@@ -404,9 +685,297 @@ def calc_and_display_portfolio(n, investment_start_amount, investment_monthly_am
                 pie_chart
             ], width=6)
         ]),
-        line_chart_by_type, 
-        line_chart_total
+        line_chart_by_type_graph,
+        line_chart_total_graph,
+        # What the charts above were calculated with, for the zoom callbacks
+        dcc.Store(id='charts-settings', data={'settings': settings._asdict(), 'resolution': chart_resolution, 'inflation': inflation})
     ]
 
+    # ------------------------------- Monte Carlo distribution (optional) -------------------------------
+    if distribution is not None and len(distribution.weeks):
+        low, high = distribution.total[0, -1], distribution.total[-1, -1]
+        summary_div.children.append(
+            html.H5(f"In {distribution.percentiles[-1] - distribution.percentiles[0]}% of {distribution.paths:,} simulations, "
+                    f"it ends between ${low:,.2f} and ${high:,.2f}")
+        )
+        charts.extend(build_fan_charts(distribution))
+
+    return charts
+
+
+def poll_simulation_job(job):
+    '''
+        Progress of the background job this page waits for, and its charts once it's done.
+    '''
+
+    if not job or simulation_jobs is None:
+        return no_update, None, True
+
+    status = simulation_jobs.status(job['key'])
+    if status is not None and status['state'] in simulationJobs.ACTIVE_STATES:
+        return simulation_progress(status), no_update, False
+
+    result = simulation_jobs.result(job['key']) if status is not None and status['state'] == 'done' else None
+    simulation_jobs.release(job['key'])
+
+    if result is None:
+        error = (status or {}).get('error', 'the simulation was cancelled')
+        return html.Div(f"The simulation could not finish: {error}", style={'color': 'red'}), None, True
+
+    charts = display_portfolio(simulationContext.PortfolioSettings(**job['settings']), *unpack_simulation(result), job['resolution'],
+                               taxes=unpack_taxes(result), inflation=job.get('inflation'))
+    if CACHE_FIGURES:
+        simulation_cache.set(job['figures_key'], {'figures': figurePayloads.to_json(charts)})
+
+    return charts, None, True
+
+
+# Callback for plotting the calculation (and polling the background job of long ones)
+@dash_app.callback(
+    [
+        Output('charts-div', 'children'),
+        Output('simulation-job', 'data'),
+        Output('simulation-poll', 'disabled')
+    ],
+    [
+        Input('calculate-button', 'n_clicks'),
+        Input('simulation-poll', 'n_intervals'),
+        Input('value-view', 'value')
+    ],
+    [
+        State('investment-start-amount', 'value'),
+        State('investment-monthly-amount', 'value'),
+        State('investment-time-slider', 'value'),
+        State('montecarlo-paths', 'value'),
+        State('legacy-random-check', 'value'),
+        State('rebalancing-policy', 'value'),
+        State('time-step', 'value'),
+        State('chart-resolution', 'value'),
+        State('simulation-job', 'data'),
+        State('inflation-mode', 'value'),
+        State('inflation-value', 'value'),
+        State('inflation-upload', 'contents')
+    ]
+)
+@timed_callback
+def calc_and_display_portfolio(n, n_intervals, value_view, investment_start_amount, investment_monthly_amount, investment_time,
+                               montecarlo_paths, legacy_random, rebalancing_policy=portfolioEngine.DEFAULT_POLICY, time_step='weekly',
+                               chart_resolution='weekly', job=None, inflation_mode='constant', inflation_value=None, inflation_series=None):
+    if dash.callback_context.triggered_id == 'simulation-poll':
+        return poll_simulation_job(job)
+
+    settings = simulationContext.PortfolioSettings(
+        start_amount=investment_start_amount,
+        monthly_amount=investment_monthly_amount,
+        investment_time=min(investment_time, max_investment_time(time_step)), # Just in case the front-end sends a huge value, cap it
+        legacy_random=bool(legacy_random) and time_step == 'weekly',
+        rebalancing_policy=rebalancing_policy or portfolioEngine.DEFAULT_POLICY,
+        time_step=time_step if time_step in portfolioEngine.STEPS_PER_YEAR else 'weekly'
+    )
+
+    # The real view deflates the same (nominal) run, inflation isn't part of the simulation's settings
+    inflation = None
+    if value_view == 'real':
+        try:
+            inflation = inflationSchedule.yearly_rates(inflation_mode, inflation_value, settings.investment_time, inflation_series).tolist()
+        except ValueError as error:
+            return html.Div(f"Inflation: {error}", style={'color': 'red'}), no_update, no_update
+
+    context = simulationContext.from_session(settings)
+    # Monte Carlo runs in weekly steps only
+    paths = min(int(montecarlo_paths or 0), MAX_MONTECARLO_PATHS) if settings.time_step == 'weekly' else 0
+    job_key = simulationCache.canonical_key(*simulationContext.cache_parts(context), paths, kind='job') if context else None
+    figures_key = simulationCache.canonical_key(*simulationContext.cache_parts(context), paths, chart_resolution,
+                                                POINTS_PER_TRACE, TAX_RULES, inflation, kind='figures') if context else None
+
+    if job and job['key'] == job_key: # double-click (or another view of the same run), keep waiting for the same job
+        return no_update, {**job, 'figures_key': figures_key, 'inflation': inflation}, False
+    if job and simulation_jobs is not None:
+        # A newer click replaces the job this page was waiting for (which stops, unless someone else waits for it too)
+        simulation_jobs.release(job['key'])
+
+    # Return early if there's no update
+    if context is None:
+        return "", None, True
+
+    # Same inputs as an earlier click: the whole response is a lookup
+    if CACHE_FIGURES:
+        cached = simulation_cache.get(figures_key)
+        if cached is not None:
+            return json.loads(cached['figures']), None, True
+
+    # Small portfolios are quicker to calculate right away than to hand over to a worker
+    work = len(context.investments) * settings.investment_time * portfolioEngine.STEPS_PER_YEAR[settings.time_step] * max(paths, 1)
+    if simulation_jobs is None or work < BACKGROUND_MIN_WORK:
+        result = simulation_job(context, paths)
+        charts = display_portfolio(settings, *unpack_simulation(result), chart_resolution, taxes=unpack_taxes(result), inflation=inflation)
+        if CACHE_FIGURES:
+            simulation_cache.set(figures_key, {'figures': figurePayloads.to_json(charts)})
+        return charts, None, True
+
+    # Identical runs in flight (double-clicks, other users) share one job
+    job = {'key': job_key, 'figures_key': figures_key, 'settings': settings._asdict(), 'resolution': chart_resolution,
+           'inflation': inflation}
+    status = simulation_jobs.submit(job_key, simulation_job, context, paths)
+    if status['state'] == 'done':
+        return poll_simulation_job(job)
+    return simulation_progress(status), job, False
+
+# ---------------------------------------- What-if heatmap
+
+def sweep_grid(settings, x_axis, y_axis):
+    '''
+        Values of every setting for the sweep: SWEEP_STEPS of them on the two chosen axes,
+        the current setting on the others.
+    '''
+
+    start_amount = settings.start_amount or 0
+    monthly_amount = settings.monthly_amount or 0
+    grid = {
+        'start_amount': [start_amount],
+        'monthly_amount': [monthly_amount],
+        'investment_time': [max(settings.investment_time, 1)],
+        'investment_strategy': [None]
+    }
+
+    swept = {
+        'start_amount': np.linspace(0, 2 * start_amount or 10000, SWEEP_STEPS),
+        'monthly_amount': np.linspace(0, 2 * monthly_amount or 1000, SWEEP_STEPS),
+        'investment_time': np.unique(np.linspace(1, MAX_INVESTMENT_TIME, SWEEP_STEPS).round().astype(int)),
+        'investment_strategy': SWEEP_STRATEGIES
+    }
+    for axis in (x_axis, y_axis):
+        grid[axis] = swept[axis]
+    return grid
+
+
+def calc_sweep(context, x_axis, y_axis):
+    '''
+        Final worth over the x/y grid, as (x values, y values, surface[y, x]).
+    '''
+
+    grid = sweep_grid(context.settings, x_axis, y_axis)
+    cache_key = simulationCache.canonical_key(*simulationContext.cache_parts(context), x_axis, y_axis, SWEEP_STEPS, kind='sweep')
+    cached = simulation_cache.get(cache_key)
+    if cached is None:
+        sweep = portfolioEngine.simulate_sweep(
+            list(context.investments),
+            grid['start_amount'],
+            grid['monthly_amount'],
+            grid['investment_time'],
+            grid['investment_strategy'],
+            random_mode='legacy' if context.settings.legacy_random else 'per_asset',
+            policy=context.settings.rebalancing_policy
+        )
+        cached = {'final_worth': sweep.final_worth}
+        simulation_cache.set(cache_key, cached)
+
+    # final_worth is (starts, monthlies, horizons, strategies), only the two swept axes are longer than one
+    axes = list(SWEEP_AXES)
+    surface = np.moveaxis(cached['final_worth'], [axes.index(y_axis), axes.index(x_axis)], [0, 1])
+    return grid[x_axis], grid[y_axis], surface.reshape(surface.shape[0], surface.shape[1])
+
+
+@appMetrics.stage(appMetrics.FIGURE_BUILD)
+def sweep_heatmap(x_axis, y_axis, x_values, y_values, surface):
+
+    def labels(axis, values):
+        if axis == 'investment_strategy':
+            return ['As configured' if strategy is None else strategy for strategy in values]
+        return np.asarray(values)
+
+    figure = go.Figure(go.Heatmap(
+        x=labels(x_axis, x_values), y=labels(y_axis, y_values), z=surface, colorscale='Viridis',
+        colorbar={'title': 'Final Worth ($)'},
+        hovertemplate=f"{SWEEP_AXES[x_axis]}: %{{x}}<br>{SWEEP_AXES[y_axis]}: %{{y}}<br>Final Worth ($): %{{z:,.2f}}<extra></extra>"
+    ))
+    figure.update_layout(title="Final Worth ($) by Setting", xaxis_title=SWEEP_AXES[x_axis], yaxis_title=SWEEP_AXES[y_axis])
+    return figure
+
+
+@dash_app.callback(
+    Output('sweep-div', 'children'),
+    Input('sweep-button', 'n_clicks'),
+    [
+        State('sweep-x', 'value'),
+        State('sweep-y', 'value'),
+        State('investment-start-amount', 'value'),
+        State('investment-monthly-amount', 'value'),
+        State('investment-time-slider', 'value'),
+        State('legacy-random-check', 'value'),
+        State('rebalancing-policy', 'value')
+    ],
+    prevent_initial_call=True
+)
+@timed_callback
+def calc_and_display_sweep(n, x_axis, y_axis, investment_start_amount, investment_monthly_amount, investment_time, legacy_random,
+                           rebalancing_policy=portfolioEngine.DEFAULT_POLICY):
+    if x_axis == y_axis:
+        return html.Div("Pick two different settings for the heatmap axes", style={'color': 'red'})
+
+    settings = simulationContext.PortfolioSettings(
+        start_amount=investment_start_amount,
+        monthly_amount=investment_monthly_amount,
+        investment_time=min(investment_time, MAX_INVESTMENT_TIME),
+        legacy_random=bool(legacy_random),
+        rebalancing_policy=rebalancing_policy or portfolioEngine.DEFAULT_POLICY
+    )
+    context = simulationContext.from_session(settings)
+    if context is None:
+        return ""
+
+    return figurePayloads.typed_graph('sweep-heatmap', sweep_heatmap(x_axis, y_axis, *calc_sweep(context, x_axis, y_axis)),
+                                      style={'height': '600px'})
+
+# Callbacks for fetching the full resolution of the zoomed range
+def charts_context(chartsSettings):
+    if not chartsSettings:
+        return None
+    return simulationContext.from_session(simulationContext.PortfolioSettings(**chartsSettings['settings']))
+
+
+@dash_app.callback(
+    Output(figurePayloads.figure_id('line-chart-by-type'), 'data'),
+    Input(figurePayloads.graph_id_of('line-chart-by-type'), 'relayoutData'),
+    State('charts-settings', 'data'),
+    prevent_initial_call=True
+)
+@timed_callback
+def zoom_line_chart_by_type(relayoutData, chartsSettings):
+    week_range = zoomed_week_range(relayoutData)
+    if week_range is no_update: # legend clicks and other relayout events never need the run
+        return no_update
+    simulation = simulate_timeline(charts_context(chartsSettings))
+    if simulation is no_update:
+        return no_update
+
+    investment_ids, timeline = simulation
+    stepsPerYear = portfolioEngine.STEPS_PER_YEAR[chartsSettings['settings']['time_step']]
+    if chartsSettings.get('inflation') is not None:
+        timeline, _ = deflate_run(timeline, None, chartsSettings['inflation'], stepsPerYear)
+    return figurePayloads.encode_figure(line_chart_by_type(investment_ids, timeline, chartsSettings['resolution'], week_range, stepsPerYear))
+
+
+@dash_app.callback(
+    Output(figurePayloads.figure_id('line-chart-total'), 'data'),
+    Input(figurePayloads.graph_id_of('line-chart-total'), 'relayoutData'),
+    State('charts-settings', 'data'),
+    prevent_initial_call=True
+)
+@timed_callback
+def zoom_line_chart_total(relayoutData, chartsSettings):
+    week_range = zoomed_week_range(relayoutData)
+    if week_range is no_update: # legend clicks and other relayout events never need the run
+        return no_update
+    simulation = simulate_timeline(charts_context(chartsSettings))
+    if simulation is no_update:
+        return no_update
+
+    _, timeline = simulation
+    stepsPerYear = portfolioEngine.STEPS_PER_YEAR[chartsSettings['settings']['time_step']]
+    if chartsSettings.get('inflation') is not None:
+        timeline, _ = deflate_run(timeline, None, chartsSettings['inflation'], stepsPerYear)
+    return figurePayloads.encode_figure(line_chart_total(timeline, chartsSettings['resolution'], week_range, stepsPerYear))
+
 if __name__ == '__main__':
     application.run(debug=False)
\ No newline at end of file
@@ -0,0 +1,211 @@
+'''
+    Random number streams for the Portfolio Projection engine.
+
+    Every asset gets its own np.random.Generator, seeded from its investment_id, so adding
+    or removing one asset never changes the paths of the others. Nothing here touches
+    numpy's global RNG, which makes concurrent simulations safe.
+
+    'legacy' mode reproduces the numbers from before these streams existed: one seed
+    derived from the first asset's name length, drawn with the old RandomState algorithm.
+
+    Correlated assets (see correlation_factor) mix their streams each week through a factor of
+    their correlation matrix: only they change, every other asset keeps its own independent stream.
+    Legacy mode ignores correlations, its numbers stay the old ones.
+'''
+
+from collections import namedtuple
+import hashlib
+import threading
+import zlib
+
+import cachetools
+import numpy as np
+
+from webapp import appMetrics
+
+
+DEFAULT_SEED = 2024
+MASK_64 = (1 << 64) - 1
+
+STREAM_MODES = ('per_asset', 'legacy')
+
+# Correlated assets (indices into the portfolio) and a factor of their correlation matrix, factor @ factor.T
+CorrelationFactor = namedtuple('CorrelationFactor', ['assets', 'factor'])
+
+EIGENVALUE_FLOOR = 1e-10 # correlation matrices that aren't positive definite are clipped to this
+_factors = cachetools.LRUCache(maxsize=32)
+_factors_lock = threading.Lock()
+
+
+def asset_key(investment_id):
+    # crc32 is stable across processes, unlike hash() with PYTHONHASHSEED
+    return zlib.crc32(str(investment_id).encode('utf-8'))
+
+
+@appMetrics.stage(appMetrics.RANDOM_GENERATION)
+def asset_generators(investment_ids, seed=DEFAULT_SEED):
+    return [
+        np.random.Generator(np.random.PCG64(np.random.SeedSequence(seed, spawn_key=(asset_key(investment_id),))))
+        for investment_id in investment_ids
+    ]
+
+
+def generator_states(generators):
+    '''
+        Snapshots every generator as a (assets, 6) uint64 array, so it can be stored
+        next to plain numpy data (npz files, shared caches) and resumed later.
+    '''
+
+    states = np.zeros((len(generators), 6), dtype=np.uint64)
+    for i, generator in enumerate(generators):
+        state = generator.bit_generator.state
+        states[i] = (
+            state['state']['state'] >> 64, state['state']['state'] & MASK_64,
+            state['state']['inc'] >> 64, state['state']['inc'] & MASK_64,
+            state['has_uint32'], state['uinteger']
+        )
+    return states
+
+
+def restore_generators(states):
+    generators = []
+    for stateHigh, stateLow, incHigh, incLow, has_uint32, uinteger in states.tolist():
+        bit_generator = np.random.PCG64()
+        bit_generator.state = {
+            'bit_generator': 'PCG64',
+            'state': {'state': (stateHigh << 64) | stateLow, 'inc': (incHigh << 64) | incLow},
+            'has_uint32': has_uint32,
+            'uinteger': uinteger
+        }
+        generators.append(np.random.Generator(bit_generator))
+    return generators
+
+
+@appMetrics.stage(appMetrics.RANDOM_GENERATION)
+def standard_normals(generators, weeks, paths=None, correlation=None):
+    '''
+        Draws a (weeks, assets) matrix, or (paths, weeks, assets) when `paths` is given.
+
+        Each column comes from a single draw of its asset's generator, paths first. Drawing in
+        several calls (chunks of paths, or more weeks later on) continues the same streams,
+        so the values don't depend on how the work was split.
+
+        With a CorrelationFactor, every week's draws of the correlated assets are mixed by it, all
+        weeks (and paths) in one matrix multiply. Weeks stay independent, so splitting the work still doesn't matter.
+    '''
+
+    shape = (weeks,) if paths is None else (paths, weeks)
+
+    # Each generator fills its own contiguous block, assets are moved to the last axis as a view
+    normals = np.empty((len(generators),) + shape)
+    for i, generator in enumerate(generators):
+        generator.standard_normal(out=normals[i])
+    normals = np.moveaxis(normals, 0, -1)
+
+    if correlation is not None:
+        assets, factor = correlation
+        normals[..., assets] = normals[..., assets] @ factor.T
+    return normals
+
+
+def correlation_matrix(investment_ids, correlations):
+    '''
+        (correlated asset indices, their correlation matrix) out of each asset's correlations,
+        {other investment_id: coefficient} (ids compared case-insensitively, unknown ones left out).
+        A pair given by both of its assets gets the mean of both. Returns None when no pair is correlated.
+    '''
+
+    index = {}
+    for i, investment_id in enumerate(investment_ids):
+        index.setdefault(str(investment_id).upper(), i)
+
+    pairs = {}
+    for i, assetCorrelations in enumerate(correlations):
+        for other, coefficient in (assetCorrelations or {}).items():
+            j = index.get(str(other).upper())
+            if j is not None and j != i and coefficient:
+                pairs.setdefault((min(i, j), max(i, j)), []).append(float(coefficient))
+    if not pairs:
+        return None
+
+    # Assets without any correlation keep the identity, only the others go through the factor
+    assets = np.unique(np.array(list(pairs)))
+    position = {asset: k for k, asset in enumerate(assets.tolist())}
+    matrix = np.eye(len(assets))
+    for (i, j), coefficients in pairs.items():
+        matrix[position[i], position[j]] = matrix[position[j], position[i]] = np.clip(np.mean(coefficients), -1, 1)
+    return assets, matrix
+
+
+def correlation_factor(investment_ids, correlations):
+    '''
+        CorrelationFactor of the portfolio, None when nothing is correlated (the streams are used as drawn).
+        Factors are cached by matrix, a portfolio's is only computed again when its correlations change.
+    '''
+
+    correlated = correlation_matrix(investment_ids, correlations)
+    if correlated is None:
+        return None
+
+    assets, matrix = correlated
+    key = hashlib.sha1(assets.tobytes() + matrix.tobytes()).hexdigest()
+    with _factors_lock:
+        cached = _factors.get(key)
+    if cached is not None:
+        return cached
+
+    factor = CorrelationFactor(assets, matrix_factor(matrix))
+    for values in factor:
+        values.setflags(write=False)
+    with _factors_lock:
+        _factors[key] = factor
+    return factor
+
+
+def matrix_factor(matrix):
+    '''
+        Factor of a correlation matrix, its lower-triangular Cholesky one when it exists. Pairwise coefficients don't always make a valid
+        (positive semi-definite) matrix: those get the nearest one with unit diagonal, through their eigenvalues
+        clipped at EIGENVALUE_FLOOR, and its eigenvector-based factor instead.
+    '''
+
+    try:
+        return np.linalg.cholesky(matrix)
+    except np.linalg.LinAlgError:
+        pass
+
+    eigenvalues, eigenvectors = np.linalg.eigh(matrix)
+    factor = eigenvectors * np.sqrt(np.maximum(eigenvalues, EIGENVALUE_FLOOR))
+    # Back to unit variances: each row of the factor scaled to norm 1
+    factor /= np.linalg.norm(factor, axis=1, keepdims=True)
+    return factor
+
+
+@appMetrics.stage(appMetrics.RANDOM_GENERATION)
+def legacy_normals(weeks, nameLen, mean, spread):
+    '''
+        Same numbers the old global `np.random.seed` + per-week `np.random.normal` loop produced,
+        using a private RandomState so no global state is touched.
+    '''
+
+    # This makes the seed predictable, enabling the user to test portfolio performance on average if he wants to.
+    seedCalc = (weeks + nameLen[0]).astype(int)
+
+    # RandomState fills the matrix row by row, exactly like the old per-week calls did
+    return np.random.RandomState(seedCalc).normal(mean, spread)
+
+
+def random_multipliers(investment_ids, nameLen, mean, spread, mode='per_asset', seed=DEFAULT_SEED, correlation=None):
+    '''
+        Weekly random multipliers, (weeks, assets), with oscilating mean (bbCycles) and spread (volCycles).
+        correlation (a CorrelationFactor) only applies to 'per_asset' streams.
+    '''
+
+    weeks = mean.shape[0]
+
+    if mode == 'legacy':
+        return legacy_normals(np.arange(1, weeks + 1), nameLen, mean, spread)
+    if mode != 'per_asset':
+        raise ValueError(f"Unknown random stream mode '{mode}', available: {', '.join(STREAM_MODES)}")
+
+    return mean + spread * standard_normals(asset_generators(investment_ids, seed), weeks, correlation=correlation)
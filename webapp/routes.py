@@ -1,5 +1,11 @@
 from webapp import application
-from flask import Flask, session, render_template, request, redirect, url_for
+from webapp import appMetrics
+from webapp import investmentTable
+from webapp import portfolioEngine
+from webapp import sessionStore
+from webapp import simulationBatch
+from webapp import simulationContext
+from flask import Flask, Response, session, render_template, request, redirect, url_for
 import re
 import logging
 
@@ -62,9 +68,11 @@ def pg_compoundCalc():
 @application.route('/projects/portfolioProjection')
 def pg_portfolioProjection():
 
+    session_id = sessionStore.current_id()
+
     # If user doesn't have this cookie, create a default table for him
-    if 'investments' not in session:
-        session['investments'] = [
+    if sessionStore.session_store.portfolio(session_id) is None:
+        sessionStore.session_store.set_investments(session_id, [
         {"investment_id": "Debenture A", "ideal_proportion": 25, "investment_strategy": "Medium", "expected_growth": 9,
         "random_growth":False, "asset_volatility": "Low", "growth_decay":False, "volatility_duration": 3, "volatility_magnitude": 1,
         "volatility_phase": 0, "bullbear_duration": 4, "bullbear_magnitude": 1, "bullbear_phase":0},
@@ -90,9 +98,9 @@ def pg_portfolioProjection():
         "volatility_phase": 0, "bullbear_duration": 10, "bullbear_magnitude": 1, "bullbear_phase":0.05},
         
         
-    ]
+    ])
 
-    return render_template('projects_portfolioProjection.html', investments=session['investments'])
+    return render_template('projects_portfolioProjection.html', investments=sessionStore.session_store.investments(session_id))
 
 # ------------------------------------------------------------------
 # If code grows, put these function(s) in a controllers.py file
@@ -106,59 +114,304 @@ def delete_investment():
 
     logging.debug(f"Deleting investment: {investment_id}")
 
-    if 'investments' not in session:
+    session_id = sessionStore.current_id(create=False)
+    if sessionStore.session_store.portfolio(session_id) is None:
         return {'status': 'error'}
-    
-    investmentsList = session['investments']
-    investmentsList = [inv for inv in investmentsList if inv['investment_id'] != investment_id]
-    session['investments'] = investmentsList  # Reassigning to session to force update
+
+    # Only that investment's row is written
+    sessionStore.session_store.delete_investment(session_id, investment_id)
 
     return {'status': 'success'}
 
 
+def validate_investment(data, taken_ids):
+    '''
+        Checks one investment (the /add-investment payload) against the rest of its portfolio, whose
+        investment_ids (capitalized) are the set taken_ids: a hash lookup, like investmentTable's uploads.
+        Normalizes `data` in place; returns an error message, or None when it's valid.
+    '''
+
+    # More restrictions for input
+    if not isinstance(data, dict) or not isinstance(data.get('investment_id'), str) or not re.match(investmentTable.ID_PATTERN, data['investment_id']):
+        return 'Invalid investment_id'
+
+    # Capitalize and check for duplication
+    investment_id_upper = data['investment_id'].upper()
+    if investment_id_upper in taken_ids:
+        return 'Duplicate investment_id'
+    data['investment_id'] = investment_id_upper
+
+    if 'investment_strategy' not in data or data['investment_strategy'] not in investmentTable.STRATEGIES:
+        return 'Invalid investment_strategy'
+
+    if 'asset_volatility' not in data or data['asset_volatility'] not in investmentTable.VOLATILITIES:
+        return 'Invalid asset_volatility'
+
+    # JSON booleans only: bool() would take the string "false" for True
+    for field in investmentTable.BOOLEAN_FIELDS:
+        if field in data and not isinstance(data[field], bool):
+            return f'Invalid value for {field}'
+
+    for field in investmentTable.FLOAT_FIELDS:
+        if field in data:
+            try:
+                data[field] = float(data[field])
+            except (TypeError, ValueError):
+                return f'Invalid value for {field}'
+
+    if 'correlations' in data:
+        data['correlations'], error = investmentTable.parse_correlations(data['correlations'])
+        if error is not None:
+            return error
+        if data['correlations'] is None:
+            del data['correlations']
+
+    return None
+
+
 @application.route('/add-investment', methods=['POST'])
 def add_investment():
     data = request.get_json()
+    session_id = sessionStore.current_id()
 
     # -------------------------------- Validation checks
-    
-    # Capitalize and check for duplication
-    investment_id_upper = data['investment_id'].upper()
-    if any(investment['investment_id'] == investment_id_upper for investment in session.get('investments', [])):
+    taken_ids = {investment['investment_id'].upper() for investment in sessionStore.session_store.investments(session_id)}
+    error = validate_investment(data, taken_ids)
+    if error is not None:
+        return {'status': 'error', 'message': error}
+
+    # -------------------------------- All checks passed, add to session (only the new row is written)
+    try:
+        sessionStore.session_store.add_investment(session_id, data)
+    except sessionStore.DuplicateInvestment: # added meanwhile, by another request
         return {'status': 'error', 'message': 'Duplicate investment_id'}
-    
-    # More restrictions for input
-    if 'investment_id' not in data or not re.match("^[A-Za-z0-9_ -]+$", data['investment_id']):
-        return {'status': 'error', 'message': 'Invalid investment_id'}
-    data['investment_id'] = data['investment_id'].upper()
 
-    if 'investment_strategy' not in data or data['investment_strategy'] not in ['Risky', 'Medium', 'Conservative']:
-        return {'status': 'error', 'message': 'Invalid investment_strategy'}
+    return {'status': 'success'}
 
-    if 'asset_volatility' not in data or data['asset_volatility'] not in ['Low', 'Mid', 'High']:
-        return {'status': 'error', 'message': 'Invalid asset_volatility'}
 
-    boolean_fields = ['growth_decay', 'random_growth']
-    for field in boolean_fields:
-        if field in data:
-            try:
-                data[field] = bool(data[field])
-            except ValueError:
-                return {'status': 'error', 'message': f'Invalid value for {field}'}
+@application.route('/edit-investments', methods=['POST'])
+def edit_investments():
+    '''
+        Batch of changes to the session's investments, applied together or not at all. The body is a list of
+        operations, or {"operations": [...]}; see investmentTable.plan_changes for each operation.
+        Invalid operations are all reported, by index: {"operation": i, "errors": [...]}.
+    '''
+
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get('operations')
+    if not isinstance(data, list) or not data:
+        return {'status': 'error', 'message': 'Expected a list of operations'}, 400
+    if len(data) > investmentTable.MAX_ROWS:
+        return {'status': 'error', 'message': f'At most {investmentTable.MAX_ROWS:,} operations per request'}, 400
+
+    # -------------------------------- Validation checks, against one snapshot of the portfolio
+    session_id = sessionStore.current_id()
+    portfolio = sessionStore.session_store.portfolio(session_id)
+    changes, errors = investmentTable.plan_changes(portfolio.investments if portfolio is not None else (), data)
+    if errors:
+        return {'status': 'error', 'message': f'{len(errors)} invalid operation{"s" if len(errors) > 1 else ""}, nothing was changed',
+                'errors': errors[:investmentTable.MAX_ERRORS]}, 400
+
+    # -------------------------------- All checks passed, one write (unless the portfolio changed since the snapshot)
+    try:
+        sessionStore.session_store.apply_changes(session_id, portfolio.version if portfolio is not None else None, changes)
+    except sessionStore.PortfolioChanged:
+        return {'status': 'error', 'message': 'The portfolio changed meanwhile, nothing was changed'}, 409
+
+    return {'status': 'success', 'added': len(changes.added), 'updated': len(changes.updated), 'deleted': len(changes.deleted)}
+
+
+@application.route('/upload-investments', methods=['POST'])
+def upload_investments():
+    '''
+        Adds a CSV or Parquet table of investments (the page's table columns, see investmentTable) to the session's,
+        or replaces it with mode=replace. The file comes as the 'file' field of a form, or as the whole body;
+        its format from ?format=, its extension or its content type.
+
+        Every row is validated before anything is stored: one invalid row and the response lists
+        the errors of each row ({"row": n, "errors": [...]}, 1 being the first row after the header).
+    '''
 
-    float_fields = ['ideal_proportion', 'expected_growth', 'volatility_duration', 'volatility_magnitude', 'volatility_phase', 'bullbear_duration', 'bullbear_magnitude', 'bullbear_phase']
-    for field in float_fields:
+    upload = request.files.get('file')
+    stream = upload.stream if upload is not None else request.stream
+    file_format = investmentTable.file_format(request.args.get('format') or request.form.get('format'),
+                                              upload.filename if upload is not None else None,
+                                              upload.mimetype if upload is not None else request.mimetype)
+    if file_format is None:
+        return {'status': 'error', 'message': f'Unknown file format, expected one of {", ".join(investmentTable.FILE_FORMATS)}'}, 400
+
+    mode = request.args.get('mode') or request.form.get('mode') or 'append'
+    if mode not in ('append', 'replace'):
+        return {'status': 'error', 'message': 'Invalid mode, expected append or replace'}, 400
+
+    # -------------------------------- Validation checks, every row at once
+    session_id = sessionStore.current_id()
+    existing_ids = () if mode == 'replace' else (investment['investment_id'] for investment in sessionStore.session_store.investments(session_id))
+    try:
+        investments, errors = investmentTable.validate_table(investmentTable.read_table(stream, file_format), existing_ids)
+    except investmentTable.TableError as e:
+        return {'status': 'error', 'message': str(e)}, 400
+    if errors:
+        return {'status': 'error', 'message': f'{len(errors)} invalid row{"s" if len(errors) > 1 else ""}, nothing was added',
+                'errors': errors[:investmentTable.MAX_ERRORS]}, 400
+
+    # -------------------------------- All checks passed, one write for the whole table
+    if mode == 'replace':
+        sessionStore.session_store.set_investments(session_id, investments)
+    else:
+        try:
+            sessionStore.session_store.add_investments(session_id, investments)
+        except sessionStore.DuplicateInvestment: # added meanwhile, by another request
+            return {'status': 'error', 'message': 'Duplicate investment_id'}, 409
+
+    return {'status': 'success', 'added': len(investments)}
+
+
+@application.route('/download-investments')
+def download_investments():
+    '''
+        The session's investments as a file, ?format=csv (default) or parquet, sent as it's generated.
+    '''
+
+    file_format = request.args.get('format', 'csv')
+    if file_format not in investmentTable.EXPORTERS:
+        return {'status': 'error', 'message': f'Invalid format, expected one of {", ".join(investmentTable.FILE_FORMATS)}'}, 400
+    if file_format == 'parquet' and investmentTable.pyarrow is None:
+        return {'status': 'error', 'message': 'Parquet files are not supported on this server, use CSV'}, 406
+
+    investments = sessionStore.session_store.investments(sessionStore.current_id(create=False))
+    return Response(investmentTable.EXPORTERS[file_format](investments), mimetype=investmentTable.FILE_FORMATS[file_format],
+                    headers={'Content-Disposition': f'attachment; filename=investments.{file_format}'})
+
+
+def validate_settings(data):
+    '''
+        PortfolioSettings out of a /simulate run's settings; returns (settings, error message).
+    '''
+
+    data = dict(data or {})
+    unknown = set(data) - set(simulationContext.PortfolioSettings._fields)
+    if unknown:
+        return None, f'Unknown settings: {", ".join(sorted(unknown))}'
+
+    for field in ['start_amount', 'monthly_amount']:
         if field in data:
             try:
                 data[field] = float(data[field])
-            except ValueError:
-                return {'status': 'error', 'message': f'Invalid value for {field}'}
+            except (TypeError, ValueError):
+                return None, f'Invalid value for {field}'
+            if not data[field] >= 0:
+                return None, f'Invalid value for {field}'
 
-    # -------------------------------- All checks passed, add to session
-    if 'investments' not in session:
-        session['investments'] = []
+    time_step = data.get('time_step', 'weekly')
+    if time_step not in portfolioEngine.STEPS_PER_YEAR:
+        return None, 'Invalid time_step'
 
-    session['investments'].append(data)
-    session['investments'] = session['investments'] # Reassigning to session to force update
+    if 'investment_time' in data:
+        try:
+            data['investment_time'] = int(data['investment_time'])
+        except (TypeError, ValueError):
+            return None, 'Invalid value for investment_time'
+        # Same caps as the dashboard: longer horizons only for the chunked daily runs
+        maxInvestmentTime = simulationBatch.max_investment_time(time_step)
+        if not 1 <= data['investment_time'] <= maxInvestmentTime:
+            return None, f'investment_time must be between 1 and {maxInvestmentTime} years with {time_step} steps'
 
-    return {'status': 'success'}
+    if 'legacy_random' in data:
+        if not isinstance(data['legacy_random'], bool):
+            return None, 'Invalid value for legacy_random'
+        # Legacy streams are seeded from the whole horizon, chunked runs can't reproduce them
+        if data['legacy_random'] and time_step != 'weekly':
+            return None, 'legacy_random needs weekly time steps'
+
+    if data.get('rebalancing_policy', portfolioEngine.DEFAULT_POLICY) not in portfolioEngine.REBALANCING_POLICIES:
+        return None, 'Invalid rebalancing_policy'
+
+    return simulationContext.PortfolioSettings(**data), None
+
+
+@application.route('/simulate', methods=['POST'])
+def simulate():
+    '''
+        Headless batch of projections, no session involved. The body is a list of runs, or
+        {"runs": [...], "format": ..., "timeline": true}; each run is
+        {"investments": [<same items as /add-investment>], "settings": {<PortfolioSettings fields>}}.
+
+        Results come as JSON, or as NPZ / Arrow IPC with format=npz|arrow (body or query string)
+        or the matching Accept header. Every run has its summary (final worth, CAGR, drawdown, volatility...);
+        timeline=false returns nothing else, and the engine doesn't store the timelines at all.
+    '''
+
+    data = request.get_json(silent=True)
+    if isinstance(data, list):
+        data = {'runs': data}
+    if not isinstance(data, dict) or not isinstance(data.get('runs'), list) or not data['runs']:
+        return {'status': 'error', 'message': 'Expected a list of runs'}, 400
+    if len(data['runs']) > simulationBatch.MAX_RUNS:
+        return {'status': 'error', 'message': f'At most {simulationBatch.MAX_RUNS} runs per request'}, 400
+
+    if not isinstance(data.get('timeline', True), bool):
+        return {'status': 'error', 'message': 'Invalid value for timeline'}, 400
+
+    result_format = request.args.get('format') or data.get('format') \
+        or request.accept_mimetypes.best_match(list(simulationBatch.RESULT_FORMATS.values()), 'application/json')
+    result_format = {mimetype: name for name, mimetype in simulationBatch.RESULT_FORMATS.items()}.get(result_format, result_format)
+    if result_format not in simulationBatch.ENCODERS:
+        return {'status': 'error', 'message': f'Invalid format, expected one of {", ".join(simulationBatch.ENCODERS)}'}, 400
+    if result_format == 'arrow' and simulationBatch.pyarrow is None:
+        return {'status': 'error', 'message': 'Arrow output is not available on this server'}, 406
+
+    # -------------------------------- Validation checks, same rules as /add-investment
+    runs = []
+    work = 0
+    for i, run in enumerate(data['runs']):
+        if not isinstance(run, dict) or not isinstance(run.get('investments'), list) or not run['investments']:
+            return {'status': 'error', 'message': 'Expected a list of investments', 'run': i}, 400
+
+        investments = []
+        taken_ids = set()
+        for investment in run['investments']:
+            investment = dict(investment) if isinstance(investment, dict) else investment
+            error = validate_investment(investment, taken_ids)
+            if error is None:
+                # The form always sends every field, the engine needs them all
+                missing = [field for field in simulationBatch.INVESTMENT_FIELDS if field not in investment]
+                error = f'Missing {", ".join(missing)}' if missing else None
+            if error is not None:
+                return {'status': 'error', 'message': error, 'run': i}, 400
+            investments.append(investment)
+            taken_ids.add(investment['investment_id'])
+
+        if not sum(investment.get('ideal_proportion', 0) for investment in investments) > 0:
+            return {'status': 'error', 'message': 'ideal_proportion must add up to more than 0', 'run': i}, 400
+
+        settings, error = validate_settings(run.get('settings'))
+        if error is not None:
+            return {'status': 'error', 'message': error, 'run': i}, 400
+
+        work += len(investments) * simulationBatch.run_steps(settings)
+        runs.append((investments, settings))
+
+    if work > simulationBatch.MAX_BATCH_WORK:
+        return {'status': 'error', 'message': 'Batch too large, split it in smaller requests'}, 413
+
+    # -------------------------------- All checks passed, simulate
+    results = simulationBatch.run_batch(runs, timeline=data.get('timeline', True))
+    return Response(simulationBatch.ENCODERS[result_format](results), mimetype=simulationBatch.RESULT_FORMATS[result_format])
+
+
+@application.route('/metrics')
+def metrics():
+    '''
+        Callback, route and engine stage metrics of this process, in the Prometheus text format.
+        Only local clients (the scraper next to the server) get them, unless METRICS_PUBLIC is set.
+    '''
+
+    if not application.config.get('METRICS_PUBLIC') and request.remote_addr not in appMetrics.LOCAL_ADDRESSES:
+        return {'status': 'error', 'message': 'Metrics are only served locally'}, 403
+    return Response(appMetrics.render(), content_type=appMetrics.CONTENT_TYPE)
+
+
+# Latency and response size of every route above
+appMetrics.instrument_routes(application, __name__)
@@ -0,0 +1,503 @@
+'''
+    Server-side sessions, for portfolios that don't fit (or don't belong) in a cookie.
+
+    Flask's default session signs the whole investments list into the cookie: every request sends it,
+    verifies it and, when it changes, serializes and signs it all again, and the browser's cookie size
+    limit caps the number of assets. Here the cookie only holds a random session id:
+        - SQLite:  one row per session (its other keys, as JSON) and one row per investment, so adding
+                   or deleting an investment writes that row only. Every gunicorn worker on the host
+                   opens the same file (WAL mode); application.config['SESSION_DB_PATH'] = None keeps
+                   the sessions in this process' memory instead (one connection, one query at a time)
+        - LRU:     recently used portfolios stay in memory (per process). Whether a cached one is still
+                   current is a memory read, not a query: every write stamps its session's slot in a
+                   memory-mapped table shared by the workers (see ChangeSlots), so a change made through
+                   another worker is never missed
+
+    Sessions from before this store (Flask's signed cookie, investments included) are moved into it
+    the first time they come back.
+
+    Along with the investments, each cached portfolio keeps its hash (simulationContext.investments_key)
+    and an engine-ready copy (prepare_portfolio over 2 weeks, see simulationContext.portfolio_inputs),
+    computed once per change of the portfolio instead of once per click.
+
+    Cached portfolios are shared between requests: nothing modifies them in place, every change builds new ones.
+'''
+
+from collections import namedtuple
+import contextlib
+import json
+import os
+import re
+import secrets
+import sqlite3
+import threading
+import time
+import zlib
+
+import cachetools
+from flask import session
+from flask.sessions import SecureCookieSessionInterface, SessionInterface, SessionMixin
+from itsdangerous import BadSignature
+import numpy as np
+from werkzeug.datastructures import CallbackDict
+
+from webapp import application
+
+
+DEFAULT_CACHE_ASSETS = 200_000 # investments kept in memory, per process
+DEFAULT_TTL = 31 * 24 * 3600 # seconds a session is kept after its last change
+PRUNE_INTERVAL = 3600 # seconds between two clean-ups of the expired sessions
+BUSY_TIMEOUT = 10 # seconds a write waits for another worker's
+CHANGE_SLOTS = 1 << 16 # shared write stamps, sessions hashed into them (colliding ones only cost a reload)
+
+SESSION_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{43}$') # secrets.token_urlsafe(32)
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS sessions (
+        session_id TEXT PRIMARY KEY,
+        data TEXT NOT NULL DEFAULT '{}',
+        version INTEGER NOT NULL DEFAULT 0,
+        updated REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS investments (
+        session_id TEXT NOT NULL,
+        investment_id TEXT NOT NULL,
+        position INTEGER NOT NULL,
+        data TEXT NOT NULL,
+        PRIMARY KEY (session_id, investment_id)
+    );
+    CREATE INDEX IF NOT EXISTS investments_order ON investments (session_id, position);
+    CREATE TABLE IF NOT EXISTS generation (
+        id INTEGER PRIMARY KEY CHECK (id = 0),
+        value INTEGER NOT NULL
+    );
+    INSERT OR IGNORE INTO generation VALUES (0, 0);
+'''
+
+# investments: tuple of the line item dicts, in the order they were added
+# key and inputs: simulationContext's hash and engine-ready copy, filled the first time they're asked for
+Portfolio = namedtuple('Portfolio', ['version', 'investments', 'key', 'inputs'], defaults=[None, None])
+
+# An LRU entry: the portfolio, and the write stamp of its session it's current for
+Cached = namedtuple('Cached', ['stamp', 'portfolio'])
+
+
+class DuplicateInvestment(Exception):
+    pass
+
+
+class PortfolioChanged(Exception):
+    pass
+
+
+class ChangeSlots:
+    '''
+        The stamp of the last write to each session, in CHANGE_SLOTS slots (by a hash of the session id that
+        every process agrees on). Shared by the workers through a memory-mapped file next to the database,
+        in this process' memory without one.
+
+        Stamps are the database's generation, which every write transaction increments: a write stamps
+        its slot before COMMIT, while it holds the write lock, so a slot's stamps only ever grow.
+        Reading one is all an LRU hit costs.
+    '''
+
+    def __init__(self, path=None):
+        if path is None:
+            self.slots = np.zeros(CHANGE_SLOTS, dtype=np.int64)
+            return
+
+        with open(path, 'ab') as f: # every worker may create it, none truncates it
+            if os.fstat(f.fileno()).st_size < CHANGE_SLOTS * 8:
+                f.truncate(CHANGE_SLOTS * 8)
+        self.slots = np.memmap(path, dtype=np.int64, mode='r+', shape=(CHANGE_SLOTS,))
+
+    @staticmethod
+    def slot(session_id):
+        return zlib.crc32(session_id.encode()) % CHANGE_SLOTS
+
+    def stamp(self, session_id):
+        return int(self.slots[self.slot(session_id)])
+
+    def mark(self, session_id, generation):
+        self.slots[self.slot(session_id)] = generation
+
+
+class SessionStore:
+
+    def __init__(self, path=None, cache_assets=DEFAULT_CACHE_ASSETS, ttl=DEFAULT_TTL):
+        self.path = path
+        self.ttl = ttl
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._cache = cachetools.LRUCache(maxsize=cache_assets, getsizeof=lambda cached: len(cached.portfolio.investments) + 1)
+        self._changes = ChangeSlots(None if path is None else f'{path}-changes')
+        self._last_prune = 0
+
+        # Without a file, the database only lives in its connection: every thread shares it, in turns
+        self._shared = None
+        self._shared_lock = threading.RLock()
+        if path is None:
+            self._shared = sqlite3.connect(':memory:', isolation_level=None, check_same_thread=False)
+
+        with self._database() as connection:
+            connection.executescript(SCHEMA)
+        with self._transaction() as connection:
+            # A database started over next to older stamps: its generation starts past them
+            connection.execute('UPDATE generation SET value = MAX(value, ?)', (int(self._changes.slots.max()),))
+
+    @contextlib.contextmanager
+    def _database(self):
+        if self._shared is not None:
+            with self._shared_lock:
+                yield self._shared
+            return
+
+        # sqlite3 connections stay in the thread that opened them
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        yield connection
+
+    @contextlib.contextmanager
+    def _transaction(self, mode='IMMEDIATE'):
+        '''
+            BEGIN IMMEDIATE ... COMMIT (or ROLLBACK), writers from other workers wait for their turn.
+            Reads use mode='DEFERRED': one consistent snapshot, without taking the write lock.
+        '''
+
+        with self._database() as connection:
+            connection.execute(f'BEGIN {mode}')
+            try:
+                yield connection
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+            connection.execute('COMMIT')
+
+    def _query(self, sql, parameters):
+        with self._database() as connection:
+            return connection.execute(sql, parameters).fetchone()
+
+    @staticmethod
+    def new_id():
+        return secrets.token_urlsafe(32)
+
+    # ---------------------------------------- session data (everything but the investments)
+
+    def load(self, session_id):
+        ''' The session's other keys, or None when there's no such session. '''
+        row = self._query('SELECT data FROM sessions WHERE session_id = ?', (session_id,))
+        return None if row is None else json.loads(row[0])
+
+    def save(self, session_id, data):
+        self._query(
+            'INSERT INTO sessions (session_id, data, updated) VALUES (?, ?, ?) '
+            'ON CONFLICT (session_id) DO UPDATE SET data = excluded.data, updated = excluded.updated',
+            (session_id, json.dumps(data), time.time())
+        )
+        self._prune()
+
+    def delete(self, session_id):
+        with self._transaction() as connection:
+            connection.execute('DELETE FROM investments WHERE session_id = ?', (session_id,))
+            connection.execute('DELETE FROM sessions WHERE session_id = ?', (session_id,))
+            self._stamp(connection, session_id)
+        with self._lock:
+            self._cache.pop(session_id, None)
+
+    # ---------------------------------------- investments
+
+    def portfolio(self, session_id):
+        '''
+            The session's Portfolio, None when it never had any. Served from memory unless
+            the portfolio changed since (here or in another worker).
+        '''
+
+        stamp = self._changes.stamp(session_id)
+        with self._lock:
+            cached = self._cache.get(session_id)
+        if cached is not None and cached.stamp == stamp:
+            return cached.portfolio
+
+        with self._transaction('DEFERRED') as connection:
+            generation = connection.execute('SELECT value FROM generation').fetchone()[0]
+            row = connection.execute('SELECT version FROM sessions WHERE session_id = ?', (session_id,)).fetchone()
+            if row is None:
+                return None
+            rows = connection.execute('SELECT data FROM investments WHERE session_id = ? ORDER BY position', (session_id,)).fetchall()
+
+        portfolio = Portfolio(row[0], tuple(json.loads(data) for data, in rows))
+        if generation < stamp:
+            # Read while the write that stamped the slot was committing (or one that rolled back, until the next write): not cached
+            return portfolio
+        return self._remember(session_id, stamp, portfolio)
+
+    def investments(self, session_id):
+        portfolio = self.portfolio(session_id)
+        return () if portfolio is None else portfolio.investments
+
+    def derived(self, session_id, portfolio, **values):
+        '''
+            Keeps values computed from a portfolio (its key, inputs) along with it, unless it changed meanwhile.
+            Returns the updated Portfolio.
+        '''
+
+        updated = portfolio._replace(**values)
+        with self._lock:
+            cached = self._cache.get(session_id)
+            if cached is not None and cached.portfolio.version == portfolio.version:
+                self._set_cached(session_id, cached._replace(portfolio=updated))
+        return updated
+
+    def add_investment(self, session_id, investment):
+        ''' Appends one investment, raises DuplicateInvestment when its investment_id is taken. '''
+
+        with self._transaction() as connection:
+            version, generation = self._bump(connection, session_id)
+            try:
+                connection.execute(
+                    'INSERT INTO investments (session_id, investment_id, position, data) '
+                    'SELECT ?, ?, COALESCE(MAX(position), -1) + 1, ? FROM investments WHERE session_id = ?',
+                    (session_id, investment['investment_id'], json.dumps(investment), session_id)
+                )
+            except sqlite3.IntegrityError:
+                raise DuplicateInvestment(investment['investment_id'])
+
+        self._update_cached(session_id, version, generation, lambda investments: investments + (dict(investment),))
+
+    def add_investments(self, session_id, investments):
+        ''' Appends several investments in one write, all or none (DuplicateInvestment when an investment_id is taken). '''
+
+        investments = tuple(dict(investment) for investment in investments)
+        with self._transaction() as connection:
+            version, generation = self._bump(connection, session_id)
+            first = connection.execute('SELECT COALESCE(MAX(position), -1) + 1 FROM investments WHERE session_id = ?',
+                                       (session_id,)).fetchone()[0]
+            try:
+                connection.executemany(
+                    'INSERT INTO investments (session_id, investment_id, position, data) VALUES (?, ?, ?, ?)',
+                    [(session_id, investment['investment_id'], first + i, json.dumps(investment)) for i, investment in enumerate(investments)]
+                )
+            except sqlite3.IntegrityError as e:
+                raise DuplicateInvestment(str(e))
+
+        self._update_cached(session_id, version, generation, lambda current: current + investments)
+
+    def apply_changes(self, session_id, version, changes):
+        '''
+            Applies an investmentTable.TableChanges in one write, provided the portfolio is still at `version`
+            (None: no portfolio yet), the one the changes were validated against; raises PortfolioChanged otherwise.
+            Updated investments keep their place, even when their investment_id changes.
+        '''
+
+        deleted, updated, added = changes
+        with self._transaction() as connection:
+            row = connection.execute('SELECT version FROM sessions WHERE session_id = ?', (session_id,)).fetchone()
+            if (row[0] if row is not None else None) != version:
+                raise PortfolioChanged(session_id)
+            newVersion, generation = self._bump(connection, session_id)
+
+            connection.executemany('DELETE FROM investments WHERE session_id = ? AND investment_id = ?',
+                                   [(session_id, investment_id) for investment_id in deleted])
+
+            # Renamed rows first move out of the way ('\0' can't be in an investment_id), so ids can be swapped
+            renamed = [(session_id, investment_id) for investment_id, investment in updated.items() if investment['investment_id'] != investment_id]
+            connection.executemany("UPDATE investments SET investment_id = char(0) || investment_id WHERE session_id = ? AND investment_id = ?", renamed)
+            connection.executemany(
+                'UPDATE investments SET investment_id = ?, data = ? WHERE session_id = ? AND investment_id = ?',
+                [(investment['investment_id'], json.dumps(investment), session_id,
+                  investment_id if investment['investment_id'] == investment_id else '\0' + investment_id)
+                 for investment_id, investment in updated.items()]
+            )
+
+            first = connection.execute('SELECT COALESCE(MAX(position), -1) + 1 FROM investments WHERE session_id = ?',
+                                       (session_id,)).fetchone()[0]
+            try:
+                connection.executemany(
+                    'INSERT INTO investments (session_id, investment_id, position, data) VALUES (?, ?, ?, ?)',
+                    [(session_id, investment['investment_id'], first + i, json.dumps(investment)) for i, investment in enumerate(added)]
+                )
+            except sqlite3.IntegrityError as e: # validated against `version`, only a bug gets here
+                raise DuplicateInvestment(str(e))
+
+        deleted = set(deleted)
+        self._update_cached(session_id, newVersion, generation, lambda current: tuple(
+            updated.get(investment['investment_id'], investment) for investment in current if investment['investment_id'] not in deleted
+        ) + tuple(added))
+
+    def delete_investment(self, session_id, investment_id):
+        ''' Removes one investment; returns whether there was one. '''
+
+        with self._transaction() as connection:
+            deleted = connection.execute('DELETE FROM investments WHERE session_id = ? AND investment_id = ?',
+                                         (session_id, investment_id)).rowcount
+            if not deleted:
+                return False
+            version, generation = self._bump(connection, session_id)
+
+        self._update_cached(session_id, version, generation,
+                            lambda investments: tuple(investment for investment in investments if investment['investment_id'] != investment_id))
+        return True
+
+    def set_investments(self, session_id, investments):
+        ''' Replaces the whole portfolio. '''
+
+        investments = tuple(dict(investment) for investment in investments)
+        with self._transaction() as connection:
+            version, generation = self._bump(connection, session_id)
+            connection.execute('DELETE FROM investments WHERE session_id = ?', (session_id,))
+            connection.executemany(
+                'INSERT INTO investments (session_id, investment_id, position, data) VALUES (?, ?, ?, ?)',
+                [(session_id, investment['investment_id'], position, json.dumps(investment)) for position, investment in enumerate(investments)]
+            )
+
+        self._remember(session_id, generation, Portfolio(version, investments))
+
+    # ---------------------------------------- internals
+
+    def _bump(self, connection, session_id):
+        ''' (new version of the session's portfolio, its write stamp), creating the session if needed. '''
+        connection.execute(
+            'INSERT INTO sessions (session_id, updated) VALUES (?, ?) '
+            'ON CONFLICT (session_id) DO UPDATE SET version = version + 1, updated = excluded.updated',
+            (session_id, time.time())
+        )
+        version = connection.execute('SELECT version FROM sessions WHERE session_id = ?', (session_id,)).fetchone()[0]
+        return version, self._stamp(connection, session_id)
+
+    def _stamp(self, connection, session_id):
+        ''' Next generation, stamped on the session's slot; within the write transaction, before its COMMIT. '''
+        connection.execute('UPDATE generation SET value = value + 1')
+        generation = connection.execute('SELECT value FROM generation').fetchone()[0]
+        self._changes.mark(session_id, generation)
+        return generation
+
+    def _update_cached(self, session_id, version, generation, change):
+        # Only a cached copy of the version right before this change can be patched, anything else is reloaded
+        with self._lock:
+            cached = self._cache.get(session_id)
+            if cached is not None and cached.portfolio.version == version - 1:
+                self._set_cached(session_id, Cached(generation, Portfolio(version, change(cached.portfolio.investments))))
+            else:
+                self._cache.pop(session_id, None)
+        self._prune()
+
+    def _remember(self, session_id, stamp, portfolio):
+        with self._lock:
+            self._set_cached(session_id, Cached(stamp, portfolio))
+        return portfolio
+
+    def _set_cached(self, session_id, portfolio):
+        try:
+            self._cache[session_id] = portfolio
+        except ValueError: # bigger than the whole cache
+            self._cache.pop(session_id, None)
+
+    def _prune(self):
+        now = time.time()
+        if now - self._last_prune < PRUNE_INTERVAL:
+            return
+        self._last_prune = now
+
+        with self._transaction() as connection:
+            expired = now - self.ttl
+            for session_id, in connection.execute('SELECT session_id FROM sessions WHERE updated < ?', (expired,)).fetchall():
+                self._stamp(connection, session_id)
+            connection.execute('DELETE FROM investments WHERE session_id IN (SELECT session_id FROM sessions WHERE updated < ?)', (expired,))
+            connection.execute('DELETE FROM sessions WHERE updated < ?', (expired,))
+
+
+# ---------------------------------------- Flask session interface
+
+class StoredSession(CallbackDict, SessionMixin):
+
+    def __init__(self, session_id, data=None, new=False):
+        def on_update(self):
+            self.modified = True
+            self.accessed = True
+
+        super().__init__(data, on_update)
+        self.sid = session_id
+        self.new = new
+        self.modified = False
+
+
+class StoredSessionInterface(SessionInterface):
+    '''
+        The cookie only carries the session id. A new session gets its cookie once something
+        is stored in it (a key set, or current_id() called for the investments).
+
+        A cookie from Flask's own sessions (the whole session, signed) becomes a stored session:
+        its investments go to the store, its other keys to the session, and the response
+        replaces the cookie with the new session id.
+    '''
+
+    def __init__(self, store):
+        self.store = store
+        self.cookie_sessions = SecureCookieSessionInterface()
+
+    def open_session(self, app, request):
+        session_id = request.cookies.get(self.get_cookie_name(app))
+        if session_id and SESSION_ID_PATTERN.match(session_id):
+            data = self.store.load(session_id)
+            if data is not None:
+                return StoredSession(session_id, data)
+        elif session_id:
+            return self.migrate_cookie(app, session_id) or StoredSession(self.store.new_id(), new=True)
+        return StoredSession(self.store.new_id(), new=True)
+
+    def migrate_cookie(self, app, cookie):
+        ''' StoredSession holding what a signed cookie session held, None when the cookie isn't one. '''
+
+        serializer = self.cookie_sessions.get_signing_serializer(app)
+        if serializer is None: # no secret key, nothing could have been signed
+            return None
+        try:
+            data = dict(serializer.loads(cookie, max_age=int(app.permanent_session_lifetime.total_seconds())))
+        except (BadSignature, TypeError, ValueError):
+            return None
+
+        stored = StoredSession(self.store.new_id(), new=True)
+        investments = data.pop('investments', None)
+        if isinstance(investments, list) and all(isinstance(investment, dict) and 'investment_id' in investment
+                                                 for investment in investments):
+            # The first of each investment_id, in order
+            unique = {investment['investment_id']: investment for investment in reversed(investments)}
+            self.store.set_investments(stored.sid, reversed(unique.values()))
+        stored.update(data)
+        stored.modified = True # the response replaces the old cookie
+        return stored
+
+    def save_session(self, app, session, response):
+        name, domain, path = self.get_cookie_name(app), self.get_cookie_domain(app), self.get_cookie_path(app)
+
+        if session.modified:
+            self.store.save(session.sid, dict(session))
+        elif session.new:
+            return # nothing was ever stored, no cookie needed
+
+        if session.new or session.modified or self.should_set_cookie(app, session):
+            response.set_cookie(name, session.sid, expires=self.get_expiration_time(app, session), httponly=self.get_cookie_httponly(app),
+                                domain=domain, path=path, secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app))
+            response.vary.add('Cookie')
+
+
+def current_id(current=None, create=True):
+    '''
+        Session id of the current request (or of `current`, a session opened by hand).
+        With create, a new session is marked as modified so it gets its cookie with the response;
+        only readers (nothing to find in a new session anyway) should leave it out.
+    '''
+
+    current = session if current is None else current
+    if create and current.new:
+        current.modified = True
+    return current.sid
+
+
+session_store = SessionStore(application.config.get('SESSION_DB_PATH'))
+application.session_interface = StoredSessionInterface(session_store)
@@ -0,0 +1,244 @@
+'''
+    Headless Portfolio Projection runs, for the /simulate endpoint.
+
+    A request holds many (investments, settings) runs. Runs that share their portfolio and every
+    setting that shapes the growth (horizon, random mode, policy, time step) are grouped: the
+    portfolio is prepared and its growth drawn once, then the whole group goes through the
+    engine as one batched pass, each run being a batch slot with its own start amount and
+    weekly contribution. Results are the same the dashboard gets for the same inputs (to rounding
+    with the 'threshold' policy, where batch slots also split their closed form at each other's trades).
+
+    Every run comes with its summary (final worth, CAGR, max drawdown, volatility, per-asset totals),
+    accumulated by the engine while it loops, and with its timeline unless only summaries were asked.
+    Results can be encoded as:
+        - json:   one object per run, arrays as nested lists
+        - npz:    numpy's zip of arrays, see to_npz
+        - arrow:  Arrow IPC stream of one long-format table (pyarrow, in requirements.txt)
+'''
+
+from collections import namedtuple
+import io
+import json
+
+import numpy as np
+
+from webapp import appMetrics
+from webapp import investmentTable
+from webapp import portfolioEngine
+
+try:
+    import orjson
+except ImportError: # the json module covers the same output, only slower
+    orjson = None
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError: # only the 'arrow' format needs it
+    pyarrow = None
+
+
+RESULT_FORMATS = {
+    'json': 'application/json',
+    'npz': 'application/x-npz',
+    'arrow': 'application/vnd.apache.arrow.stream'
+}
+
+# Every investment field the engine reads (what the dashboard's form sends)
+INVESTMENT_FIELDS = investmentTable.REQUIRED_FIELDS
+
+MAX_INVESTMENT_TIME = 40 # years, same caps as the dashboard's slider
+MAX_DAILY_INVESTMENT_TIME = 80 # daily runs are chunked, their memory doesn't grow with the horizon
+MAX_RUNS = 1000
+MAX_BATCH_WORK = 20_000_000 # asset-steps per request, what every run's timeline adds up to
+
+# investment_id: (assets,) ids; summary: the run's portfolioEngine.SummaryResult;
+# steps and timeline: 1-based step of each row and an EngineResult of (steps, assets) arrays, None when only the summary was asked
+RunResult = namedtuple('RunResult', ['investment_id', 'steps_per_year', 'summary', 'steps', 'timeline'])
+
+SUMMARY_SCALARS = ['final_worth', 'cagr', 'max_drawdown', 'volatility']
+SUMMARY_PER_ASSET = ['current_amount', 'total_sold', 'total_bought', 'final_proportion', 'proportion_sum']
+
+
+def max_investment_time(time_step):
+    return MAX_DAILY_INVESTMENT_TIME if time_step == 'daily' else MAX_INVESTMENT_TIME
+
+
+def run_steps(settings):
+    return settings.investment_time * portfolioEngine.STEPS_PER_YEAR[settings.time_step]
+
+
+def group_runs(runs):
+    '''
+        {group key: [run indices]}, runs whose growth is identical share a group.
+    '''
+
+    groups = {}
+    for i, (investments, settings) in enumerate(runs):
+        key = (json.dumps(investments, sort_keys=True), settings.investment_time, settings.legacy_random,
+               settings.rebalancing_policy, settings.time_step)
+        groups.setdefault(key, []).append(i)
+    return groups
+
+
+def run_batch(runs, timeline=True, backend=None):
+    '''
+        Simulates every (investments, PortfolioSettings) run, validated beforehand.
+        Summaries are accumulated while the engine loops; timeline=False doesn't store any timeline.
+        Returns one RunResult per run, in order.
+    '''
+
+    results = [None] * len(runs)
+
+    for indices in group_runs(runs).values():
+        investments, settings = runs[indices[0]]
+        stepsPerYear = portfolioEngine.STEPS_PER_YEAR[settings.time_step]
+
+        if settings.time_step != 'weekly':
+            # Chunked runs are single-path, one call per run
+            for i in indices:
+                runSettings = runs[i][1]
+                chunked = portfolioEngine.simulate_chunked(list(investments), runSettings.start_amount, runSettings.monthly_amount,
+                                                           runSettings.investment_time, time_step=runSettings.time_step,
+                                                           record_every=1 if timeline else run_steps(runSettings),
+                                                           backend=backend, policy=runSettings.rebalancing_policy, summary=True)
+                results[i] = make_result(chunked.investment_id, stepsPerYear, chunked.summary,
+                                         chunked.steps if timeline else None, chunked.timeline if timeline else None)
+            continue
+
+        inputs = portfolioEngine.prepare_portfolio(list(investments), 1, settings.investment_time * 52)
+        growth = portfolioEngine.growth_schedule(inputs, 'legacy' if settings.legacy_random else 'per_asset')
+        weeks = growth.shape[0]
+
+        # One batch slot per run, the growth is shared (broadcast, not copied)
+        startAmounts = np.array([runs[i][1].start_amount for i in indices], dtype=np.float64)
+        weeklyContributions = np.array([runs[i][1].monthly_amount*12/52 for i in indices], dtype=np.float64)
+        batched, finals = portfolioEngine.run_rebalancing(
+            startAmounts[:, np.newaxis] * inputs.ideal_proportion,
+            growth[:, np.newaxis, :],
+            inputs.ideal_proportion,
+            inputs.threshold_proportion,
+            weeklyContributions,
+            backend=backend,
+            record_weeks=None if timeline else np.empty(0, dtype=int),
+            policy=settings.rebalancing_policy,
+            summary=True
+        )
+
+        for slot, i in enumerate(indices):
+            results[i] = make_result(
+                inputs.investment_id, stepsPerYear,
+                portfolioEngine.SummaryResult(*(field[slot] for field in finals)),
+                np.arange(1, weeks + 1) if timeline else None,
+                portfolioEngine.EngineResult(*(field[:, slot, :] for field in batched)) if timeline else None
+            )
+
+    return results
+
+
+def make_result(investment_ids, steps_per_year, summary, steps, timeline):
+    if timeline is not None:
+        steps = np.asarray(steps, dtype=np.int32)
+        timeline = portfolioEngine.EngineResult(*(np.ascontiguousarray(field, dtype=np.float64) for field in timeline))
+    return RunResult(np.asarray(investment_ids).astype(str), steps_per_year, summary, steps, timeline)
+
+
+def summary_dict(summary):
+    return {**{field: float(getattr(summary, field)) for field in SUMMARY_SCALARS},
+            **{field: np.asarray(getattr(summary, field), dtype=np.float64) for field in SUMMARY_PER_ASSET}}
+
+# ---------------------------------------- Encoders
+
+@appMetrics.stage(appMetrics.SERIALIZATION)
+def to_json(results):
+    payload = {'status': 'success', 'results': []}
+    for result in results:
+        run = {'investment_id': result.investment_id.tolist(), 'steps_per_year': result.steps_per_year,
+               'summary': summary_dict(result.summary)}
+        if result.timeline is not None:
+            run.update({'steps': result.steps, **result.timeline._asdict()})
+        payload['results'].append(run)
+
+    if orjson is not None:
+        return orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY)
+
+    def plain(value):
+        if isinstance(value, dict):
+            return {key: plain(item) for key, item in value.items()}
+        return value.tolist() if isinstance(value, np.ndarray) else value
+    return json.dumps(plain(payload)).encode()
+
+
+@appMetrics.stage(appMetrics.SERIALIZATION)
+def to_npz(results):
+    '''
+        Summary scalars as (runs,) arrays; per run, 'run<i>/investment_id', 'run<i>/summary/<field>'
+        and, with timelines, 'run<i>/steps' and 'run<i>/<EngineResult field>'.
+    '''
+
+    arrays = {'steps_per_year': np.array([result.steps_per_year for result in results])}
+    for field in SUMMARY_SCALARS:
+        arrays[field] = np.array([getattr(result.summary, field) for result in results], dtype=np.float64)
+
+    for i, result in enumerate(results):
+        arrays[f'run{i}/investment_id'] = result.investment_id
+        for field in SUMMARY_PER_ASSET:
+            arrays[f'run{i}/summary/{field}'] = np.asarray(getattr(result.summary, field), dtype=np.float64)
+        if result.timeline is not None:
+            arrays[f'run{i}/steps'] = result.steps
+            for field, values in result.timeline._asdict().items():
+                arrays[f'run{i}/{field}'] = values
+
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    return buffer.getvalue()
+
+
+@appMetrics.stage(appMetrics.SERIALIZATION)
+def to_arrow(results):
+    '''
+        One long-format table, investment_id dictionary-encoded:
+            - with timelines: a row per run, step (1-based) and asset, with the EngineResult fields
+            - summaries only: a row per run and asset, with the summary fields (scalars repeated per asset)
+    '''
+
+    if pyarrow is None:
+        raise RuntimeError("Arrow output needs pyarrow installed")
+
+    withTimeline = all(result.timeline is not None for result in results)
+    fields = list(portfolioEngine.EngineResult._fields) if withTimeline else SUMMARY_PER_ASSET + SUMMARY_SCALARS
+    columns = {'run': [], 'step': [], **{field: [] for field in fields}}
+    if not withTimeline:
+        del columns['step']
+
+    dictionary, codes = {}, []
+    for i, result in enumerate(results):
+        distinctInvestments_amount = len(result.investment_id)
+        rows = len(result.steps) if withTimeline else 1
+
+        columns['run'].append(np.full(rows * distinctInvestments_amount, i, dtype=np.int32))
+        codes.append(np.tile([dictionary.setdefault(name, len(dictionary)) for name in result.investment_id.tolist()], rows))
+        if withTimeline:
+            columns['step'].append(np.repeat(result.steps, distinctInvestments_amount))
+            for field, values in result.timeline._asdict().items():
+                columns[field].append(values.ravel())
+        else:
+            for field in fields:
+                columns[field].append(np.broadcast_to(np.asarray(getattr(result.summary, field), dtype=np.float64),
+                                                      (distinctInvestments_amount,)))
+
+    columns = {name: np.concatenate(parts) if parts else np.empty(0) for name, parts in columns.items()}
+    investmentIds = pyarrow.DictionaryArray.from_arrays(
+        np.concatenate(codes).astype(np.int32) if codes else np.empty(0, dtype=np.int32),
+        pyarrow.array(list(dictionary), type=pyarrow.string())
+    )
+    table = pyarrow.table({'run': columns.pop('run'), **({'step': columns.pop('step')} if withTimeline else {}),
+                           'investment_id': investmentIds, **columns})
+
+    sink = pyarrow.BufferOutputStream()
+    with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+ENCODERS = {'json': to_json, 'npz': to_npz, 'arrow': to_arrow}
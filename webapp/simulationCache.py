@@ -0,0 +1,226 @@
+'''
+    Result cache for portfolio simulations.
+
+    Users press "Calculate Portfolio" again and again with the same inputs, so results are
+    cached under a canonical hash of the investments list plus the portfolio settings.
+
+    Two tiers:
+        - memory: per process, LRU + TTL eviction (cachetools), bounded in bytes
+        - disk:   optional, one .npz file per entry in a folder every gunicorn worker on the
+                  host can read, so workers reuse each other's results
+
+    Entries are dicts of numpy arrays and/or strings; arrays become read-only once cached. Files are written with
+    allow_pickle=False and replaced atomically, so a reader never sees half an entry.
+'''
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+import cachetools
+import numpy as np
+
+
+DEFAULT_MAXSIZE = 256 * 2**20 # bytes, per process
+DEFAULT_TTL = 30 * 60 # seconds
+DEFAULT_DISK_MAXSIZE = 1024 * 2**20 # bytes, per host
+
+
+# Values json already writes the canonical way
+_CANONICAL_TYPES = {str, float, bool, type(None)}
+
+
+def _canonical(value):
+    # 25 and 25.0 should hash the same, and numpy scalars like their python counterparts
+    if isinstance(value, dict):
+        # Line items are dicts of plain values: skip the call for the ones that stay as they are
+        return {str(k): v if type(v) in _CANONICAL_TYPES else _canonical(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    if isinstance(value, (bool, np.bool_)):
+        return bool(value)
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return float(value)
+    return value
+
+
+def canonical_key(*parts, **named_parts):
+    payload = json.dumps(_canonical([parts, named_parts]), sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def read_entry(path):
+    ''' Loads an entry written by write_entry(), raises OSError/ValueError when it can't. '''
+    with np.load(path, allow_pickle=False) as data:
+        # Plain strings come back as 0-d arrays
+        return {name: (data[name].item() if data[name].dtype.kind == 'U' and data[name].ndim == 0 else data[name]) for name in data.files}
+
+
+def write_entry(path, entry):
+    ''' Writes an entry as .npz through a temporary file, so readers never see half of it. '''
+    tmp_path = os.path.join(os.path.dirname(path), f'.{os.path.basename(path)}.{uuid.uuid4().hex}.tmp')
+    try:
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **{name: np.asarray(value) for name, value in entry.items()})
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _entry_size(entry):
+    return sum(value.nbytes if isinstance(value, np.ndarray) else len(value) for value in entry.values())
+
+
+class _CountingTTLCache(cachetools.TTLCache):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lru_evictions = 0
+        self.ttl_evictions = 0
+
+    def expire(self, time=None):
+        # TTLCache.__len__ calls expire() itself, so count with the plain Cache one
+        before = cachetools.Cache.__len__(self)
+        result = super().expire(time)
+        self.ttl_evictions += before - cachetools.Cache.__len__(self)
+        return result
+
+    def popitem(self):
+        item = super().popitem()
+        self.lru_evictions += 1
+        return item
+
+
+class SimulationCache:
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE, ttl=DEFAULT_TTL, disk_dir=None, disk_maxsize=DEFAULT_DISK_MAXSIZE):
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self.disk_maxsize = disk_maxsize
+
+        self._memory = _CountingTTLCache(maxsize=maxsize, ttl=ttl, getsizeof=_entry_size)
+        self._lock = threading.Lock()
+        self._counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0, 'disk_evictions': 0}
+
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    # ---------------------------------------- public API
+
+    def get(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._counters['memory_hits'] += 1
+                return entry
+
+        entry = self._disk_get(key)
+
+        with self._lock:
+            if entry is None:
+                self._counters['misses'] += 1
+                return None
+            self._counters['disk_hits'] += 1
+            self._memory_set(key, entry)
+        return entry
+
+    def set(self, key, entry):
+        # Entries are shared between requests, nobody gets to modify them in place
+        for value in entry.values():
+            if isinstance(value, np.ndarray):
+                value.setflags(write=False)
+
+        with self._lock:
+            self._counters['stores'] += 1
+            self._memory_set(key, entry)
+        self._disk_set(key, entry)
+
+    def clear(self):
+        with self._lock:
+            # Cache.clear() goes through popitem(), which isn't an eviction
+            lru_evictions = self._memory.lru_evictions
+            self._memory.clear()
+            self._memory.lru_evictions = lru_evictions
+
+    def stats(self):
+        with self._lock:
+            self._memory.expire()
+            return {
+                **self._counters,
+                'hits': self._counters['memory_hits'] + self._counters['disk_hits'],
+                'lru_evictions': self._memory.lru_evictions,
+                'ttl_evictions': self._memory.ttl_evictions,
+                'entries': len(self._memory),
+                'bytes': self._memory.currsize
+            }
+
+    # ---------------------------------------- memory tier
+
+    def _memory_set(self, key, entry):
+        try:
+            self._memory[key] = entry
+        except ValueError: # entry alone is bigger than the whole cache
+            pass
+
+    # ---------------------------------------- disk tier
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, f'{key}.npz')
+
+    def _disk_get(self, key):
+        if not self.disk_dir:
+            return None
+
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                return None
+            return read_entry(path)
+        except (OSError, ValueError) as e:
+            if not isinstance(e, FileNotFoundError):
+                logging.warning(f"Ignoring unreadable cache entry {path}: {e}")
+            return None
+
+    def _disk_set(self, key, entry):
+        if not self.disk_dir:
+            return
+
+        try:
+            write_entry(self._path(key), entry)
+        except OSError as e:
+            logging.warning(f"Could not write cache entry for {key}: {e}")
+            return
+
+        self._disk_prune()
+
+    def _disk_prune(self):
+        # Expired entries go first, then the least recently written ones until we fit
+        try:
+            entries = []
+            for name in os.listdir(self.disk_dir):
+                if name.endswith('.npz'):
+                    stat = os.stat(os.path.join(self.disk_dir, name))
+                    entries.append((stat.st_mtime, stat.st_size, name))
+        except OSError:
+            return
+
+        entries.sort()
+        now = time.time()
+        total = sum(size for _, size, _ in entries)
+
+        for mtime, size, name in entries:
+            if total <= self.disk_maxsize and now - mtime <= self.ttl:
+                break
+            try:
+                os.remove(os.path.join(self.disk_dir, name))
+            except OSError: # another worker got there first
+                continue
+            total -= size
+            with self._lock:
+                self._counters['disk_evictions'] += 1
@@ -0,0 +1,94 @@
+'''
+    Per-request inputs of the Portfolio Projection simulations.
+
+    Callbacks used to write the investments and settings into module globals, so two requests
+    served by threads of the same worker could swap each other's portfolios. Now every callback
+    builds one SimulationContext and passes it down:
+        - PortfolioSettings: immutable, built from the callback arguments
+        - investments: snapshot of the session's list, taken once when the context is created
+
+    The investments live in sessionStore, which also keeps their hash and an engine-ready copy
+    between requests: a context built from the session doesn't hash or prepare the portfolio again.
+'''
+
+from collections import namedtuple
+
+import numpy as np
+
+from webapp import portfolioEngine
+from webapp import sessionStore
+from webapp import simulationCache
+
+
+PortfolioSettings = namedtuple('PortfolioSettings', [
+    'start_amount',         # Start Investment Amount
+    'monthly_amount',       # Monthly Investment
+    'investment_time',      # Investment Time (years)
+    'legacy_random',        # Legacy Random Paths: old seeding, instead of per-asset streams
+    'rebalancing_policy',   # Rebalancing: one of portfolioEngine.REBALANCING_POLICIES
+    'time_step'             # Time Step: 'weekly', or 'daily' (portfolioEngine.STEPS_PER_YEAR)
+], defaults=[1000, 100, 4, False, 'weekly', 'weekly'])
+
+# investments_key: canonical hash of the investments, taken once so the cache keys of a request don't
+# each hash thousands of line items again (None: hashed whenever it's needed)
+# inputs: the investments through prepare_portfolio, over 2 weeks and a start amount of 1 (None: prepared whenever needed)
+SimulationContext = namedtuple('SimulationContext', ['investments', 'settings', 'investments_key', 'inputs'], defaults=[None, None])
+
+
+def from_session(settings):
+    '''
+        Context for the current request, or None when the session holds no investments.
+    '''
+
+    session_id = sessionStore.current_id(create=False)
+    portfolio = sessionStore.session_store.portfolio(session_id)
+    if portfolio is None or not portfolio.investments:
+        return None
+
+    # Stored portfolios are never modified in place (every change replaces them), so nothing
+    # downstream can see the investments change halfway through a calculation.
+    # Their hash and engine-ready copy are computed by the first request that needs them.
+    if portfolio.inputs is None:
+        portfolio = sessionStore.session_store.derived(session_id, portfolio, key=investments_key(portfolio.investments),
+                                                       inputs=base_inputs(portfolio.investments))
+    return SimulationContext(portfolio.investments, settings, portfolio.key, portfolio.inputs)
+
+
+def base_inputs(investments):
+    '''
+        prepare_portfolio's arrays, independent of the settings (see portfolio_inputs).
+        Read-only: one copy is shared by every request on the same portfolio.
+    '''
+
+    inputs = portfolioEngine.prepare_portfolio(list(investments), 1, 2)
+    for values in inputs:
+        if isinstance(values, np.ndarray): # the correlation factor already is
+            values.setflags(write=False)
+    return inputs
+
+
+def portfolio_inputs(context):
+    '''
+        prepare_portfolio(investments, start amount, horizon in weeks), from the context's engine-ready copy when it has one.
+    '''
+
+    settings = context.settings
+    if context.inputs is None:
+        return portfolioEngine.prepare_portfolio(list(context.investments), settings.start_amount, settings.investment_time * 52)
+
+    inputs = portfolioEngine.with_horizon(context.inputs, settings.investment_time * 52)
+    return inputs._replace(start_amount=settings.start_amount * inputs.ideal_proportion)
+
+
+def investments_key(investments):
+    return simulationCache.canonical_key(list(investments), kind='investments')
+
+
+def cache_parts(context, **overrides):
+    '''
+        Plain values identifying the context, for simulationCache.canonical_key.
+        overrides replace some settings, e.g. investment_time=None to match every horizon.
+    '''
+
+    investments = context.investments_key or investments_key(context.investments)
+    return investments, context.settings._replace(**overrides)._asdict()
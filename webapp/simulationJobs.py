@@ -0,0 +1,282 @@
+'''
+    Background jobs for long simulations.
+
+    Jobs run on a local process pool. Their state lives in a folder (a status .json per job,
+    and its result as .npz), so every gunicorn worker on the host sees the same jobs, with
+    no broker involved:
+        - single flight: submitting a key that is already pending/running joins that job
+        - cancellation:  callers release() jobs they no longer want; once nobody waits for one,
+                         it stops at its next progress report
+        - progress:      jobs report a fraction and a message, read back with status()
+
+    Job functions are called as func(*args, progress=progress), with progress(fraction, message),
+    and return a dict of numpy arrays and/or strings (same format as simulationCache entries).
+    Pool workers never fork the (threaded) web process: they come from a forkserver, or are spawned
+    where there's none. Job functions and arguments are pickled, and the modules in `preload` are
+    imported once by the forkserver, so workers start with them.
+'''
+
+import contextlib
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from webapp import simulationCache
+
+try:
+    import fcntl
+except ImportError: # no fcntl on Windows: jobs are only shared between the threads of one process
+    fcntl = None
+
+
+DEFAULT_MAX_WORKERS = max((os.cpu_count() or 2) // 2, 1)
+DEFAULT_TTL = 30 * 60 # seconds a finished job (and its result) is kept
+PENDING_TIMEOUT = 10 * 60 # seconds a job may wait for a pool worker before it's considered lost
+PROGRESS_INTERVAL = 0.25 # seconds between two status writes of the same job
+
+ACTIVE_STATES = ('pending', 'running')
+
+
+class JobCancelled(Exception):
+    pass
+
+
+# ---------------------------------------- status files, shared by the web process and pool workers
+
+_thread_lock = threading.Lock()
+
+def _reset_thread_lock():
+    # A forked worker may inherit the lock from a thread that doesn't exist in it
+    global _thread_lock
+    _thread_lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_thread_lock)
+
+
+@contextlib.contextmanager
+def _locked(directory):
+    with _thread_lock:
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(directory, '.lock'), 'a') as lockFile:
+            fcntl.flock(lockFile, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lockFile, fcntl.LOCK_UN)
+
+
+def _status_path(directory, key):
+    return os.path.join(directory, f'{key}.json')
+
+
+def _result_path(directory, key):
+    return os.path.join(directory, f'{key}.npz')
+
+
+def _cancel_path(directory, key):
+    return os.path.join(directory, f'{key}.cancel')
+
+
+def _read_status(directory, key):
+    try:
+        with open(_status_path(directory, key)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_status(directory, key, status):
+    tmp_path = os.path.join(directory, f'.{key}.{uuid.uuid4().hex}.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump({**status, 'updated': time.time()}, f)
+    os.replace(tmp_path, _status_path(directory, key))
+
+
+def _update_status(directory, key, **changes):
+    with _locked(directory):
+        status = _read_status(directory, key) or {'waiters': 0}
+        status.update(changes)
+        _write_status(directory, key, status)
+        return status
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError: # exists, but belongs to someone else
+        return True
+    return True
+
+
+def _is_lost(status):
+    # A worker that died (OOM, restart) leaves its job 'running' forever
+    if status['state'] == 'running':
+        return not _is_alive(status.get('pid', -1))
+    return time.time() - status['updated'] > PENDING_TIMEOUT
+
+
+class _Progress:
+
+    def __init__(self, directory, key):
+        self.directory = directory
+        self.key = key
+        self._last = 0
+
+    def __call__(self, fraction, message=''):
+        if os.path.exists(_cancel_path(self.directory, self.key)):
+            raise JobCancelled(self.key)
+
+        now = time.monotonic()
+        if now - self._last >= PROGRESS_INTERVAL:
+            self._last = now
+            _update_status(self.directory, self.key, progress=float(fraction), message=message)
+
+
+def _run_job(directory, key, func, args):
+    # Runs in a pool worker
+    if os.path.exists(_cancel_path(directory, key)):
+        _update_status(directory, key, state='cancelled')
+        return
+
+    _update_status(directory, key, state='running', pid=os.getpid())
+    try:
+        result = func(*args, progress=_Progress(directory, key))
+        simulationCache.write_entry(_result_path(directory, key), result)
+        _update_status(directory, key, state='done', progress=1.0, message='')
+    except JobCancelled:
+        _update_status(directory, key, state='cancelled')
+    except Exception as e:
+        logging.exception(f"Simulation job {key} failed")
+        _update_status(directory, key, state='failed', error=f'{type(e).__name__}: {e}')
+
+
+class SimulationJobs:
+
+    def __init__(self, directory, max_workers=DEFAULT_MAX_WORKERS, ttl=DEFAULT_TTL, preload=()):
+        self.directory = directory
+        self.max_workers = max_workers
+        self.ttl = ttl
+        self.preload = list(preload)
+
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._futures = {}
+
+        os.makedirs(directory, exist_ok=True)
+
+    # ---------------------------------------- public API
+
+    def submit(self, key, func, *args):
+        '''
+            Starts func(*args) under `key`, or joins the job already known by that key.
+            Every submit() must be paired with a release() once the caller is done with the job.
+            Returns the job's status.
+        '''
+
+        self._prune()
+
+        with _locked(self.directory):
+            status = _read_status(self.directory, key)
+
+            if status is not None and (
+                (status['state'] in ACTIVE_STATES and not _is_lost(status))
+                or (status['state'] == 'done' and os.path.exists(_result_path(self.directory, key)))
+            ):
+                status['waiters'] = status.get('waiters', 0) + 1
+                _write_status(self.directory, key, status)
+                return status
+
+            if os.path.exists(_cancel_path(self.directory, key)):
+                os.remove(_cancel_path(self.directory, key))
+            status = {'state': 'pending', 'progress': 0.0, 'message': '', 'waiters': 1}
+            _write_status(self.directory, key, status)
+
+        try:
+            future = self._get_pool().submit(_run_job, self.directory, key, func, args)
+        except BrokenProcessPool:
+            self._pool = None # a worker died, start a new pool
+            future = self._get_pool().submit(_run_job, self.directory, key, func, args)
+
+        self._futures[key] = future
+        future.add_done_callback(lambda done: self._futures.pop(key) if self._futures.get(key) is done else None)
+        return status
+
+    def status(self, key):
+        '''
+            {'state', 'progress', 'message', 'waiters', 'updated', ...}, or None for unknown jobs.
+            Jobs whose worker died are reported as 'failed'.
+        '''
+
+        status = _read_status(self.directory, key)
+        if status is not None and status['state'] in ACTIVE_STATES and _is_lost(status):
+            status = {**status, 'state': 'failed', 'error': 'The simulation worker stopped unexpectedly'}
+        return status
+
+    def result(self, key):
+        try:
+            return simulationCache.read_entry(_result_path(self.directory, key))
+        except (OSError, ValueError):
+            return None
+
+    def release(self, key):
+        '''
+            Drops the caller's interest in a job; the last one to leave cancels it if it's still going.
+        '''
+
+        with _locked(self.directory):
+            status = _read_status(self.directory, key)
+            if status is None:
+                return
+            status['waiters'] = max(status.get('waiters', 0) - 1, 0)
+            _write_status(self.directory, key, status)
+
+            if status['waiters'] == 0 and status['state'] in ACTIVE_STATES:
+                open(_cancel_path(self.directory, key), 'w').close()
+                future = self._futures.get(key)
+                if future is not None and future.cancel(): # never got to a worker
+                    status['state'] = 'cancelled'
+                    _write_status(self.directory, key, status)
+
+    # ---------------------------------------- internals
+
+    def _get_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                # Forking a process with threads can copy locks some other thread holds
+                if 'forkserver' in multiprocessing.get_all_start_methods():
+                    context = multiprocessing.get_context('forkserver')
+                    context.set_forkserver_preload(self.preload)
+                else:
+                    context = multiprocessing.get_context('spawn')
+                self._pool = ProcessPoolExecutor(self.max_workers, mp_context=context)
+            return self._pool
+
+    def _prune(self):
+        # Finished jobs go once they're older than the ttl, together with their result and cancel flag
+        now = time.time()
+        try:
+            names = [name for name in os.listdir(self.directory) if name.endswith('.json')]
+        except OSError:
+            return
+
+        for name in names:
+            key = name[:-len('.json')]
+            status = _read_status(self.directory, key)
+            if status is None or status['state'] in ACTIVE_STATES or now - status['updated'] <= self.ttl:
+                continue
+            for path in (_status_path(self.directory, key), _result_path(self.directory, key), _cancel_path(self.directory, key)):
+                try:
+                    os.remove(path)
+                except OSError: # another worker got there first
+                    pass
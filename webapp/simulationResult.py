@@ -0,0 +1,98 @@
+'''
+    Compact container for simulated portfolio timelines.
+
+    The dashboard used to turn every simulation into a long-format DataFrame: one row per asset
+    per week, investment_id repeated as a Python string in each row, everything float64, plus
+    a 'Current Year' column and the copies each groupby made. PortfolioTimeline keeps what the
+    engine produces instead:
+        - metrics:   (weeks, assets) arrays, float64 or float32
+        - assets:    categorical index of the investment ids, one entry per asset
+        - views:     per asset, per week and total series, without copying the timeline
+        - to_frame:  the long-format DataFrame, only built when something asks for it
+'''
+
+import numpy as np
+import pandas as pd
+
+
+# Metric -> column of the long-format DataFrame
+METRIC_COLUMNS = {
+    'current_amount': 'Current Amount ($)',
+    'total_sold': 'Total Sold',
+    'total_bought': 'Total Bought',
+    'actual_proportion': 'Actual Proportion (%)'
+}
+
+
+class PortfolioTimeline:
+
+    def __init__(self, investment_ids, metrics, weeks=None, dtype=None):
+        '''
+            investment_ids:  (assets,) ids, in the metrics' column order
+            metrics:         {name: (weeks, assets) array}, usually the fields of an EngineResult
+            weeks:           (weeks,) 1-based week (or day) numbers of the rows, default 1..weeks
+            dtype:           storage dtype (e.g. np.float32), default keeps the arrays as they are
+        '''
+
+        investment_ids = np.asarray(investment_ids).astype(str)
+        self.assets = pd.CategoricalIndex(investment_ids, categories=pd.unique(investment_ids), name='investment_id')
+        self.metrics = {name: np.asarray(values, dtype=dtype) for name, values in metrics.items()}
+
+        rows = next(iter(self.metrics.values())).shape[0] if self.metrics else 0
+        self.weeks = np.arange(1, rows + 1, dtype=np.int32) if weeks is None else np.asarray(weeks, dtype=np.int32)
+
+    @classmethod
+    def from_engine(cls, investment_ids, result, weeks=None, dtype=None):
+        ''' From a portfolioEngine.EngineResult (or any namedtuple of (weeks, assets) arrays). '''
+        return cls(investment_ids, result._asdict(), weeks=weeks, dtype=dtype)
+
+    # ---------------------------------------- views
+
+    def __getitem__(self, metric):
+        return self.metrics[metric]
+
+    def asset(self, investment_id, metric='current_amount'):
+        ''' (weeks,) series of one asset, a strided view into the metric's array. '''
+        return self.metrics[metric][:, self.assets.get_loc(investment_id)]
+
+    def week(self, week, metric='current_amount'):
+        ''' (assets,) values of every asset on one week (1-based week number), a view. '''
+        return self.metrics[metric][np.searchsorted(self.weeks, week)]
+
+    def total(self, metric='current_amount'):
+        ''' (weeks,) sum over the assets, accumulated in float64. '''
+        return self.metrics[metric].sum(axis=1, dtype=np.float64)
+
+    def per_asset_sum(self, metric):
+        ''' Series indexed by investment_id: each asset's metric summed over the weeks. '''
+        return pd.Series(self.metrics[metric].sum(axis=0, dtype=np.float64), index=self.assets,
+                         name=METRIC_COLUMNS.get(metric, metric))
+
+    def final_worth(self):
+        ''' Total current amount on the last week. '''
+        if len(self.weeks) == 0:
+            return 0.0
+        return float(self.metrics['current_amount'][-1].sum(dtype=np.float64))
+
+    @property
+    def nbytes(self):
+        return sum(values.nbytes for values in self.metrics.values()) + self.weeks.nbytes
+
+    # ---------------------------------------- long format
+
+    def to_frame(self):
+        '''
+            One row per asset per week, same columns as the dashboard's old timeline DataFrame
+            (investment_id is categorical here, so it doesn't hold a string per row).
+        '''
+
+        weeks, distinctInvestments_amount = len(self.weeks), len(self.assets)
+        columns = {'investment_id': pd.Categorical.from_codes(np.tile(self.assets.codes, weeks), self.assets.categories)}
+
+        for name, values in self.metrics.items():
+            columns[METRIC_COLUMNS.get(name, name)] = values.ravel()
+            if name == 'current_amount':
+                columns['Week'] = np.repeat(self.weeks, distinctInvestments_amount)
+        columns.setdefault('Week', np.repeat(self.weeks, distinctInvestments_amount))
+
+        return pd.DataFrame(columns)
@@ -0,0 +1,217 @@
+'''
+    Profit taxes of a Portfolio Projection run.
+
+    The ledger is a report on a finished timeline: its weekly sales and purchases (the differences of
+    total_sold and total_bought) are what the rebalancer's sellingDelta sold and its buys bought.
+    Taxes are never deducted from the portfolio, so the simulation and its cost don't change, and
+    the worth it shows is before taxes.
+
+    Every purchase is a tax lot. Lots live in preallocated (assets, steps + 1) arrays of quantity,
+    cost and week, one FIFO queue per asset: slot 0 holds the start amount, slot k the purchase of
+    step k - 1, and head points at each asset's oldest open lot. Nothing is consumed while the run
+    loops; the queues are settled afterwards, for every sale at once. Quantities are in units of the
+    asset's own price index (1 at the start, compounded with its growth), so a lot's value follows
+    its asset however the amounts are rebalanced later.
+
+    Sales consume lots FIFO without a loop over lots: the cost of the first q units sold is the
+    cumulative cost curve of the lots at q, which np.interp reads for every step of every asset at
+    once (partially sold lots included). Realized gains are taxed per year, after losses carried
+    over from earlier years and the yearly exemption, through progressive brackets.
+'''
+
+from collections import namedtuple
+
+import numpy as np
+
+
+# brackets: ((yearly taxable gains from which it applies, rate in %), ...), progressive like income taxes
+# exemption: yearly realized gains that aren't taxed
+# carry_losses: net losses of a year lower the taxable gains of the following ones
+TaxRules = namedtuple('TaxRules', ['brackets', 'exemption', 'carry_losses'], defaults=[((0, 15),), 0, True])
+
+# (assets, steps + 1) FIFO queues of lots; quantity is what's still open of each lot, head the first open one
+TaxLots = namedtuple('TaxLots', ['quantity', 'cost', 'week', 'head'])
+
+# Per asset unless said otherwise. yearly_gains and yearly_taxes are (years, assets)
+TaxResult = namedtuple('TaxResult', [
+    'yearly_gains',         # realized gains (losses negative) of each year
+    'yearly_taxes',         # taxes of each year, split between the assets with gains in proportion to them
+    'realized_gains',       # over the whole run
+    'taxes_paid',           # over the whole run
+    'unrealized_gains',     # final amount minus the cost of the lots still open
+    'lots'                  # TaxLots at the end of the run
+])
+
+
+def tax_rules(brackets=None, exemption=0, carry_losses=True):
+    '''
+        TaxRules from plain values (e.g. the app config), brackets sorted by their lower bound.
+        Raises ValueError for negative bounds or rates.
+    '''
+
+    brackets = tuple(sorted((float(lower), float(rate)) for lower, rate in (brackets or ())))
+    if any(lower < 0 or rate < 0 for lower, rate in brackets) or float(exemption or 0) < 0:
+        raise ValueError('Tax brackets and exemptions must not be negative')
+    return TaxRules(brackets, float(exemption or 0), bool(carry_losses))
+
+
+def bracket_tax(taxable, brackets):
+    '''
+        Progressive tax on each value of taxable: every bracket's rate applies to the part between
+        its lower bound and the next one's.
+    '''
+
+    taxable = np.asarray(taxable, dtype=np.float64)
+    if not brackets:
+        return np.zeros_like(taxable)
+
+    lower = np.array([bound for bound, _ in brackets])
+    upper = np.append(lower[1:], np.inf)
+    rates = np.array([rate for _, rate in brackets]) / 100
+    slices = np.clip(taxable[..., None] - lower, 0, upper - lower)
+    return slices @ rates
+
+
+def step_flows(start_amount, timeline):
+    '''
+        (sold, bought, units) per step, as (steps, assets) float64 arrays. units is what a dollar buys
+        of each asset: 1 over its price index, which compounds each step's amounts before trading over
+        the ones at the end of the step before.
+    '''
+
+    amount = np.asarray(timeline.current_amount, dtype=np.float64)
+    sold = np.diff(np.asarray(timeline.total_sold, dtype=np.float64), axis=0, prepend=0)
+    bought = np.diff(np.asarray(timeline.total_bought, dtype=np.float64), axis=0, prepend=0)
+
+    previous = np.empty_like(amount)
+    previous[0] = start_amount
+    previous[1:] = amount[:-1]
+    # Nothing held: no growth to measure, and no lot the price could apply to
+    growth = np.divide(amount + sold - bought, previous, out=np.ones_like(amount), where=previous > 0)
+    price = np.cumprod(np.maximum(growth, 0), axis=0)
+    return sold, bought, np.divide(1, price, out=price, where=price > 0)
+
+
+def consumed_cost(cumulative_quantity, cumulative_cost, quantity):
+    '''
+        FIFO cost of the first quantity[a, j] units of every asset a, from its lots' cumulative
+        (assets, lots + 1) curves. One np.interp call: each asset's curve is scaled to [0, 1] and
+        shifted by 2 * asset, which keeps every asset's stretch of the flattened curve apart.
+    '''
+
+    assets = cumulative_quantity.shape[0]
+    total = cumulative_quantity[:, -1:]
+    scale = np.where(total > 0, total, 1)
+    offset = 2 * np.arange(assets, dtype=np.float64)[:, None]
+
+    points = (cumulative_quantity / scale + offset).ravel()
+    wanted = (np.minimum(quantity, total) / scale + offset).ravel()
+    return np.interp(wanted, points, cumulative_cost.ravel()).reshape(quantity.shape)
+
+
+def open_lots(start_amount, bought, units, sold_quantity):
+    '''
+        TaxLots once sold_quantity (per asset) was consumed FIFO, and the (assets, lots + 1)
+        cumulative quantity and cost curves of every lot bought.
+    '''
+
+    steps, assets = bought.shape
+    quantity = np.empty((assets, steps + 1))
+    cost = np.empty((assets, steps + 1))
+    week = np.empty((assets, steps + 1), dtype=np.int32)
+
+    quantity[:, 0] = cost[:, 0] = start_amount # bought at the start, at price 1
+    np.multiply(bought, units, out=quantity[:, 1:].T)
+    cost[:, 1:] = bought.T
+    week[:] = np.arange(-1, steps, dtype=np.int32)
+
+    cumulative_quantity = np.zeros((assets, steps + 2))
+    cumulative_cost = np.zeros((assets, steps + 2))
+    np.cumsum(quantity, axis=1, out=cumulative_quantity[:, 1:])
+    np.cumsum(cost, axis=1, out=cumulative_cost[:, 1:])
+
+    # What's left of each lot: everything past the units sold, and a partial lot at the head
+    sold_quantity = np.minimum(sold_quantity, cumulative_quantity[:, -1])[:, None]
+    remaining = np.clip(cumulative_quantity[:, 1:] - sold_quantity, 0, quantity)
+    cost *= np.divide(remaining, quantity, out=np.zeros_like(remaining), where=quantity > 0)
+    head = np.minimum((cumulative_quantity[:, 1:] <= sold_quantity).sum(axis=1), steps)
+
+    return TaxLots(remaining, cost, week, head), cumulative_quantity, cumulative_cost
+
+
+def yearly_taxes(yearly_gains, rules):
+    '''
+        Taxes of each year (years, assets) from its realized gains: the year's net gains, minus earlier
+        losses still carried and the exemption, through the brackets. Assets pay in proportion
+        to their gains, the ones with losses pay nothing.
+    '''
+
+    net = yearly_gains.sum(axis=1)
+    taxable = np.empty_like(net)
+    carried = 0.0
+    for year, gains in enumerate(net): # one step per year, the losses carried depend on every year before
+        if rules.carry_losses:
+            gains, carried = gains - carried, max(carried - gains, 0)
+        taxable[year] = max(gains - rules.exemption, 0)
+    taxes = bracket_tax(taxable, rules.brackets)
+
+    profits = np.maximum(yearly_gains, 0)
+    shares = np.divide(profits, profits.sum(axis=1, keepdims=True), out=np.zeros_like(profits),
+                       where=profits.sum(axis=1, keepdims=True) > 0)
+    return shares * taxes[:, None]
+
+
+def empty_ledger(start_amount):
+    '''
+        TaxResult of a run without steps: no gains, no taxes, and one open lot per asset holding its start amount.
+    '''
+
+    assets = start_amount.shape[0]
+    zeros = np.zeros(assets)
+    lots = TaxLots(
+        quantity=np.array(start_amount, dtype=np.float64).reshape(assets, 1),
+        cost=np.array(start_amount, dtype=np.float64).reshape(assets, 1),
+        week=np.full((assets, 1), -1, dtype=np.int32),
+        head=np.zeros(assets, dtype=np.int64)
+    )
+    return TaxResult(
+        yearly_gains=np.zeros((0, assets)),
+        yearly_taxes=np.zeros((0, assets)),
+        realized_gains=zeros,
+        taxes_paid=zeros.copy(),
+        unrealized_gains=zeros.copy(),
+        lots=lots
+    )
+
+
+def tax_ledger(start_amount, timeline, rules=None, steps_per_year=52):
+    '''
+        TaxResult of a timeline (EngineResult, or anything with its cumulative fields) that started
+        from start_amount (per asset). Steps are grouped into years of steps_per_year.
+    '''
+
+    rules = rules or TaxRules()
+    start_amount = np.broadcast_to(np.asarray(start_amount, dtype=np.float64), timeline.current_amount.shape[1:])
+    if timeline.current_amount.shape[0] == 0: # a horizon of 0: nothing sold, the start amounts are still open
+        return empty_ledger(start_amount)
+    sold, bought, units = step_flows(start_amount, timeline)
+
+    # Units sold by the end of every step, and the FIFO cost of them (a step sells before it buys,
+    # so only lots from earlier steps are consumed)
+    sold_quantity = np.cumsum(sold * units, axis=0).T
+    lots, cumulative_quantity, cumulative_cost = open_lots(start_amount, bought, units, sold_quantity[:, -1])
+    basis = np.diff(consumed_cost(cumulative_quantity, cumulative_cost, sold_quantity), axis=1, prepend=0).T
+
+    years = np.arange(0, sold.shape[0], steps_per_year)
+    yearly_gains = np.add.reduceat(sold - basis, years, axis=0)
+    taxes = yearly_taxes(yearly_gains, rules)
+
+    final_amount = np.asarray(timeline.current_amount[-1], dtype=np.float64)
+    return TaxResult(
+        yearly_gains=yearly_gains,
+        yearly_taxes=taxes,
+        realized_gains=yearly_gains.sum(axis=0),
+        taxes_paid=taxes.sum(axis=0),
+        unrealized_gains=final_amount - lots.cost.sum(axis=1),
+        lots=lots
+    )